@@ -0,0 +1,111 @@
+"""Measure enqueue-to-start latency and throughput of the download dispatcher
+
+Runs 1,000 stub jobs through DownloadDispatcher twice: once submitted in a
+single burst (throughput) and once trickled in so a slot is always free
+(enqueue-to-start latency). The old 0.5 s polling loop is emulated for
+comparison.
+
+Usage: python benchmarks/bench_queue_dispatch.py [--jobs 1000] [--workers 2] [--job-time 0.002]
+"""
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from youtube_music_downloader import DownloadDispatcher
+
+
+def run_dispatcher(jobs, workers, job_time, interval=0.0):
+    """Push stub jobs through the dispatcher and return start latencies"""
+    latencies = []
+    lock = threading.Lock()
+    done = threading.Event()
+    
+    def handler(item):
+        with lock:
+            latencies.append(time.perf_counter() - item["enqueued"])
+            if len(latencies) == jobs:
+                done.set()
+        time.sleep(job_time)
+    
+    dispatcher = DownloadDispatcher(handler, max_workers=workers)
+    started = time.perf_counter()
+    for i in range(jobs):
+        dispatcher.submit({"id": i, "enqueued": time.perf_counter()})
+        if interval:
+            time.sleep(interval)
+    done.wait()
+    
+    # Wait for the last jobs to finish before stopping the clock
+    while dispatcher.active_count:
+        time.sleep(job_time)
+    elapsed = time.perf_counter() - started
+    dispatcher.shutdown()
+    return latencies, elapsed
+
+
+def run_polling(jobs, workers, job_time, interval=0.5):
+    """Emulate the previous process_queue loop (one start per poll tick)"""
+    import queue
+    pending = queue.Queue()
+    latencies = []
+    active = [0]
+    
+    def handler(item):
+        latencies.append(time.perf_counter() - item["enqueued"])
+        time.sleep(job_time)
+        active[0] -= 1
+    
+    started = time.perf_counter()
+    for i in range(jobs):
+        pending.put({"id": i, "enqueued": time.perf_counter()})
+    while len(latencies) < jobs:
+        if active[0] < workers:
+            try:
+                item = pending.get_nowait()
+                active[0] += 1
+                threading.Thread(target=handler, args=(item,), daemon=True).start()
+            except queue.Empty:
+                pass
+        time.sleep(interval)
+    return latencies, time.perf_counter() - started
+
+
+def report(name, latencies, elapsed):
+    latencies = sorted(latencies)
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    print(f"{name}:")
+    print(f"  jobs:            {len(latencies)}")
+    print(f"  first start:     {latencies[0] * 1000:.2f} ms")
+    print(f"  median latency:  {statistics.median(latencies) * 1000:.2f} ms")
+    print(f"  p95 latency:     {p95 * 1000:.2f} ms")
+    print(f"  throughput:      {len(latencies) / elapsed:.1f} jobs/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--jobs", type=int, default=1000)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--job-time", type=float, default=0.002, help="seconds each stub job takes")
+    parser.add_argument("--polling-jobs", type=int, default=20,
+                        help="jobs for the polling baseline (it needs 0.5 s per job)")
+    args = parser.parse_args()
+    
+    latencies, elapsed = run_dispatcher(args.jobs, args.workers, args.job_time)
+    report("DownloadDispatcher (burst)", latencies, elapsed)
+    
+    latencies, elapsed = run_dispatcher(args.jobs, args.workers, args.job_time,
+                                        interval=args.job_time * 2 / args.workers)
+    report("DownloadDispatcher (trickle)", latencies, elapsed)
+    
+    if args.polling_jobs:
+        latencies, elapsed = run_polling(args.polling_jobs, args.workers, args.job_time)
+        report("Polling loop (previous behaviour)", latencies, elapsed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""Check .part resumption and measure parallel fragment downloads
+
+Runs yt-dlp with DownloadEngine.build_ydl_opts against a local media server
+(benchmarks/media_server.py) that emulates a high-latency, per-connection
+throttled CDN:
+
+  resume     a progressive download is cut half way, then started
+             again; the second attempt should fetch only the missing bytes
+             (compared with continuedl switched off)
+  fragments  an HLS stream is downloaded with 1, 4 and 8 connections per
+             item and the throughput is compared
+
+Usage: python benchmarks/bench_resume_fragments.py [--latency 0.15] [--rate 2000000]
+Requires yt-dlp.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import yt_dlp
+
+from media_server import MediaServer
+from youtube_music_downloader import DownloadEngine
+
+
+def ydl_opts(output_dir, connections=1, **extra):
+    opts = DownloadEngine.build_ydl_opts("m4a", "192", output_dir, connections)
+    # Only the transfer is measured; the synthetic bytes aren't real media
+    opts.update(format="best", fixup="never", noprogress=True, **extra)
+    return opts
+
+
+def download(url, opts):
+    with yt_dlp.YoutubeDL(opts) as ydl:
+        ydl.download([url])
+
+
+def bench_resume(server, workdir):
+    """Cut a download half way and report the bytes fetched by the next attempt"""
+    size = len(server.track)
+    results = {}
+    for continuedl in (True, False):
+        output_dir = tempfile.mkdtemp(dir=workdir)
+        
+        # No retries, so the first attempt fails and leaves its .part file behind.
+        # The generic extractor probes the URL once before the real download.
+        server.reset_counters()
+        server.cut_next(size // 2, skip=1)
+        try:
+            download(server.url("/track.m4a"), ydl_opts(output_dir, retries=0))
+        except yt_dlp.utils.DownloadError:
+            pass
+        first = server.bytes_sent["track.m4a"]
+        
+        server.reset_counters()
+        started = time.perf_counter()
+        download(server.url("/track.m4a"), ydl_opts(output_dir, continuedl=continuedl))
+        results[continuedl] = (first, server.bytes_sent["track.m4a"], time.perf_counter() - started)
+    
+    print(f"resume: {size} byte track, cut at 50%")
+    for continuedl, (first, second, seconds) in results.items():
+        label = "continuedl on " if continuedl else "continuedl off"
+        print(f"  {label}  first attempt {first:>9} B   retry {second:>9} B   retry took {seconds:.2f}s")
+
+
+def bench_fragments(server, workdir, connection_counts):
+    """Download the HLS stream with different connection counts"""
+    total = server.segments * len(server.segment)
+    print(f"fragments: {server.segments} x {len(server.segment)} B HLS segments")
+    baseline = None
+    for connections in connection_counts:
+        output_dir = tempfile.mkdtemp(dir=workdir)
+        started = time.perf_counter()
+        download(server.url("/hls/index.m3u8"), ydl_opts(output_dir, connections))
+        seconds = time.perf_counter() - started
+        baseline = baseline or seconds
+        print(f"  {connections:>2} connections  {seconds:6.2f}s  {total / seconds / 1024 / 1024:6.2f} MB/s"
+              f"  {baseline / seconds:4.1f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--latency", type=float, default=0.15, help="seconds before each response's first byte")
+    parser.add_argument("--rate", type=int, default=2000000, help="bytes/s per connection (0 = unthrottled)")
+    parser.add_argument("--track-mb", type=int, default=8)
+    parser.add_argument("--segments", type=int, default=40)
+    parser.add_argument("--connections", type=int, nargs="+", default=[1, 4, 8])
+    args = parser.parse_args()
+    
+    with MediaServer(track_size=args.track_mb * 1024 * 1024, segments=args.segments,
+                     latency=args.latency, rate=args.rate) as server, \
+            tempfile.TemporaryDirectory() as workdir:
+        print(f"latency {args.latency * 1000:.0f} ms, {args.rate / 1024 / 1024:.1f} MB/s per connection")
+        bench_resume(server, workdir)
+        bench_fragments(server, workdir, args.connections)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,166 @@
+"""Measure cold-start time and fail when it goes over budget
+
+Two measurements, each the median of several fresh interpreters:
+
+  import       cumulative import time of youtube_music_downloader from
+               python -X importtime, with the slowest imports it pulls in;
+               yt-dlp, pygame, PIL and Tk must not be among them
+  first frame  wall time from starting the interpreter until the main window
+               has been mapped and drawn (skipped without a display), with a
+               data dir holding a large download archive and thumbnail cache
+               so that loading them before the first frame would show
+
+Exits with status 1 when a median is over its budget or a heavy module is
+imported eagerly, so it can run as a regression check.
+
+Usage: python benchmarks/bench_startup.py [--runs 5] [--import-budget-ms 150] [--frame-budget-ms 1500]
+                                         [--archive-rows 50000] [--thumbnails 10000]
+"""
+import argparse
+import json
+import os
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from youtube_music_downloader import DownloadArchive, QueueJournal
+
+# Modules that must stay out of the import of the main module
+HEAVY_MODULES = ("yt_dlp", "pygame", "PIL", "tkinter", "urllib.request", "http.client")
+
+FIRST_FRAME_SCRIPT = """
+import json, os, sys, time
+sys.path.insert(0, {root!r})
+import tkinter as tk
+import youtube_music_downloader
+
+root = tk.Tk()
+
+def drawn():
+    print(json.dumps({{"time": time.time(),
+                      "loaded": [name for name in {heavy!r} if name in sys.modules]}}), flush=True)
+    os._exit(0)
+
+# Bound before the app, so this idle callback runs ahead of its deferred startup
+root.bind("<Map>", lambda event: event.widget is root and root.after_idle(drawn), add="+")
+app = youtube_music_downloader.YouTubeMusicDownloader(root)
+root.mainloop()
+"""
+
+
+def measure_import():
+    """Return (cumulative ms, {direct import: cumulative ms}, every module name) for one cold import"""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import youtube_music_downloader"],
+                            cwd=ROOT, capture_output=True, text=True, check=True)
+    names = set()
+    children = {}
+    total = None
+    for line in result.stderr.splitlines():
+        fields = line[len("import time:"):].split("|")
+        if not line.startswith("import time:") or len(fields) != 3 or not fields[1].strip().isdigit():
+            continue
+        # Nested imports are indented two spaces per level and listed before their parent
+        name = fields[2][1:]
+        depth = (len(name) - len(name.lstrip())) // 2
+        name = name.strip()
+        names.add(name)
+        if depth == 1:
+            children[name] = int(fields[1]) / 1000
+        elif depth == 0:
+            if name == "youtube_music_downloader":
+                total = int(fields[1]) / 1000
+                break
+            children = {}
+    return total, children, names
+
+
+def populate_data_dir(home, archive_rows, thumbnails):
+    """Fill home's app data dir like a long-used install: a big archive, journal and thumbnail cache"""
+    data_dir = os.path.join(home, ".youtube_music_downloader")
+    DownloadArchive(os.path.join(data_dir, "archive.db")).close()
+    conn = sqlite3.connect(os.path.join(data_dir, "archive.db"))
+    with conn:
+        conn.executemany("INSERT INTO archive (video_id, format, path, size, sha256, added, mtime_ns) "
+                         "VALUES (?, 'mp3', ?, 4000000, NULL, 0, 0)",
+                         ((f"bench{n:06d}", os.path.join(home, "Downloads", f"Track {n}.mp3"))
+                          for n in range(archive_rows)))
+    conn.close()
+
+    journal = QueueJournal(os.path.join(data_dir, "queue.db"))
+    for n in range(1000):
+        journal.record_queued({"id": f"item_{n}", "url": f"https://youtu.be/bench{n:06d}", "title": f"Track {n}"})
+        journal.record_state(f"item_{n}", "completed")
+    journal.close()
+
+    thumbnail_dir = os.path.join(data_dir, "thumbnails")
+    os.makedirs(thumbnail_dir)
+    for n in range(thumbnails):
+        with open(os.path.join(thumbnail_dir, f"bench{n:06d}.png"), "wb") as f:
+            f.write(b"\x89PNG" + bytes(2000))
+
+
+def measure_first_frame(home):
+    """Return (ms until the first frame, heavy modules loaded by then), or None without a display"""
+    script = FIRST_FRAME_SCRIPT.format(root=ROOT, heavy=HEAVY_MODULES)
+    started = time.time()
+    # A throwaway home, so the real queue journal and library aren't touched
+    result = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, timeout=60,
+                            env=dict(os.environ, HOME=home))
+    if result.returncode != 0 or not result.stdout.strip():
+        if "display" in result.stderr.lower():
+            return None
+        raise RuntimeError(result.stderr.strip() or "first frame script failed")
+    report = json.loads(result.stdout.strip().splitlines()[-1])
+    return (report["time"] - started) * 1000, report["loaded"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--import-budget-ms", type=float, default=150)
+    parser.add_argument("--frame-budget-ms", type=float, default=1500)
+    parser.add_argument("--top", type=int, default=8, help="number of slowest imports to list")
+    parser.add_argument("--archive-rows", type=int, default=50000, help="download archive size for the first frame")
+    parser.add_argument("--thumbnails", type=int, default=10000, help="cached thumbnails for the first frame")
+    args = parser.parse_args()
+
+    failures = []
+
+    runs = [measure_import() for _ in range(args.runs)]
+    import_ms = statistics.median(total for total, _, _ in runs)
+    _, children, names = runs[-1]
+    print(f"import      {import_ms:8.1f} ms   (budget {args.import_budget_ms:.0f} ms)")
+    for name, ms in sorted(children.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"  {name:<24} {ms:8.1f} ms")
+    eager = [name for name in HEAVY_MODULES if name in names]
+    if eager:
+        failures.append(f"imported eagerly: {', '.join(eager)}")
+    if import_ms > args.import_budget_ms:
+        failures.append(f"import took {import_ms:.1f} ms")
+
+    with tempfile.TemporaryDirectory() as home:
+        populate_data_dir(home, args.archive_rows, args.thumbnails)
+        frames = [measure_first_frame(home) for _ in range(args.runs)]
+    if None in frames:
+        print("first frame      skipped (no display; run it under xvfb-run)")
+    else:
+        frame_ms = statistics.median(ms for ms, _ in frames)
+        loaded = sorted({name for _, names in frames for name in names})
+        print(f"first frame {frame_ms:8.1f} ms   (budget {args.frame_budget_ms:.0f} ms)")
+        print(f"  loaded before the first frame: {', '.join(loaded) or 'none of the heavy modules'}")
+        if frame_ms > args.frame_budget_ms:
+            failures.append(f"first frame took {frame_ms:.1f} ms")
+
+    for failure in failures:
+        print(f"OVER BUDGET: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
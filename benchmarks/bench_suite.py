@@ -0,0 +1,325 @@
+"""Offline benchmark suite for the download engine's hot paths
+
+Nothing touches the network: extraction goes through the stub extractors in
+benchmarks/fake_extractor.py and media comes from the local server in
+benchmarks/media_server.py. Benchmarks:
+
+  queue      jobs through DownloadEngine.submit and the dispatcher workers
+             (extract, download, keep-as-m4a) from a throttled server with
+             50 ms latency, at several concurrency levels
+  progress   cost of one yt-dlp progress callback through _on_progress to
+             the ProgressBus, and of draining the bus for a UI tick
+  library    LibraryIndex scans of 10k and 100k file folders: cold, unchanged
+             and with 1% of the files touched, plus loading the song list
+  search     time to the first result and to 100 results from the search
+             cache, and inserting/redrawing them in a VirtualTreeview (needs
+             a display)
+  transcode  wall time of FFmpegExtractAudioPP per target format and quality
+             (needs ffmpeg)
+
+Results are written as JSON (metric -> value, unit, and whether lower is
+better). --compare takes two such files and reports the change of every
+metric, exiting with status 1 when one regressed by more than --threshold
+percent.
+
+Usage: python benchmarks/bench_suite.py [--only queue,search] [--output results.json] [--quick]
+       python benchmarks/bench_suite.py --compare before.json after.json [--threshold 10]
+Requires yt-dlp.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_extractor import FakeExtractors, video_url
+from media_server import MediaServer
+from youtube_music_downloader import (DownloadEngine, DownloadHandle, LibraryIndex, ProgressBus,
+                                      VirtualTreeview)
+
+BENCHMARKS = ("queue", "progress", "library", "search", "transcode")
+
+
+class Results:
+    """Collects metrics and prints them as they come in"""
+
+    def __init__(self):
+        self.metrics = {}
+
+    def add(self, name, value, unit, lower_is_better=True):
+        self.metrics[name] = {"value": value, "unit": unit, "lower_is_better": lower_is_better}
+        print(f"  {name:<40} {value:>12.3f} {unit}")
+
+    def skip(self, name, reason):
+        print(f"  {name:<40} skipped ({reason})")
+
+
+def bench_queue(results, workdir, jobs, concurrency_levels):
+    """Push jobs through the engine with the fake extractor and the media server"""
+    # 50 ms to the first byte and 8 MB/s per connection, so concurrency has something to hide
+    with MediaServer(track_size=1024 * 1024, latency=0.05, rate=8 * 1024 * 1024) as server, \
+            FakeExtractors(server):
+        for level in concurrency_levels:
+            engine = DownloadEngine(max_concurrent=level, data_dir=tempfile.mkdtemp(dir=workdir),
+                                    persist_info=False, preview_cache_size=0, thumbnail_cache_size=0)
+            output_dir = tempfile.mkdtemp(dir=workdir)
+            try:
+                started = time.perf_counter()
+                handles = [engine.submit(video_url(n), audio_format="m4a", quality="128",
+                                         output_dir=output_dir, skip_duplicates=False)
+                           for n in range(jobs)]
+                for handle in handles:
+                    handle.wait()
+                elapsed = time.perf_counter() - started
+            finally:
+                engine.close()
+
+            failed = [handle for handle in handles if handle.state != "completed"]
+            if failed:
+                raise RuntimeError(f"{len(failed)} queue jobs failed, e.g. {failed[0].error}")
+            results.add(f"queue.jobs_per_s.workers_{level}", jobs / elapsed, "jobs/s", lower_is_better=False)
+            results.add(f"queue.ms_per_job.workers_{level}", elapsed / jobs * 1000, "ms")
+
+
+def bench_progress(results, workdir, calls, jobs=50):
+    """Time the progress path the GUI uses, from the yt-dlp hook to a drained bus"""
+    engine = DownloadEngine(data_dir=workdir, use_journal=False, use_archive=False, persist_info=False,
+                            preview_cache_size=0, thumbnail_cache_size=0)
+    bus = ProgressBus()
+    # Same work as YouTubeMusicDownloader.on_engine_event does for a queued job
+    engine.subscribe(lambda handle, event: bus.publish(handle.id, progress=f"{event['percent']:.1f}%")
+                     if event["type"] == "progress" else None)
+    handles = [DownloadHandle(f"job{i}", video_url(i), "Bench", "m4a", "128", workdir) for i in range(jobs)]
+    total = 100 * 1024 * 1024
+    try:
+        started = time.perf_counter()
+        for i in range(calls):
+            engine._on_progress(handles[i % jobs], {
+                "status": "downloading", "downloaded_bytes": (i // jobs + 1) * 1024,
+                "total_bytes": total, "speed": 1e6, "eta": 10,
+            })
+        elapsed = time.perf_counter() - started
+        results.add("progress.us_per_callback", elapsed / calls * 1e6, "us")
+
+        drains = []
+        for _ in range(200):
+            for handle in handles:
+                bus.publish(handle.id, progress="50.0%")
+            started = time.perf_counter()
+            bus.drain()
+            drains.append(time.perf_counter() - started)
+        results.add(f"progress.us_per_drain.jobs_{jobs}", statistics.median(drains) * 1e6, "us")
+    finally:
+        engine.close()
+
+
+def make_library(directory, files):
+    os.makedirs(directory)
+    for i in range(files):
+        extension = LibraryIndex.AUDIO_EXTENSIONS[i % len(LibraryIndex.AUDIO_EXTENSIONS)]
+        with open(os.path.join(directory, f"Artist {i % 500} - Track {i}{extension}"), "wb") as f:
+            f.write(b"\0" * 64)
+
+
+def bench_library(results, workdir, sizes):
+    """Scan folders of empty audio files the way update_song_list does"""
+    for files in sizes:
+        directory = os.path.join(workdir, f"library_{files}")
+        make_library(directory, files)
+        index = LibraryIndex(os.path.join(workdir, f"library_{files}.db"))
+        try:
+            started = time.perf_counter()
+            index.scan(directory)
+            results.add(f"library.cold_scan_s.files_{files}", time.perf_counter() - started, "s")
+
+            started = time.perf_counter()
+            index.scan(directory)
+            results.add(f"library.unchanged_scan_s.files_{files}", time.perf_counter() - started, "s")
+
+            # Touch 1% of the files with a new size and mtime
+            for entry in list(os.scandir(directory))[::100]:
+                with open(entry.path, "ab") as f:
+                    f.write(b"\0")
+            started = time.perf_counter()
+            changes = index.scan(directory)
+            results.add(f"library.rescan_1pct_s.files_{files}", time.perf_counter() - started, "s")
+            assert len(changes["changed"]) == (files + 99) // 100
+
+            started = time.perf_counter()
+            index.tracks(directory)
+            results.add(f"library.load_tracks_s.files_{files}", time.perf_counter() - started, "s")
+        finally:
+            index.close()
+            shutil.rmtree(directory)
+
+
+def bench_search(results, workdir, count=100, rows=10000):
+    """Fetch results through the search cache, then render them in a VirtualTreeview"""
+    with MediaServer(track_size=1024) as server, FakeExtractors(server):
+        engine = DownloadEngine(data_dir=workdir, use_journal=False, use_archive=False, persist_info=False,
+                                preview_cache_size=0, thumbnail_cache_size=0)
+        try:
+            first = []
+            started = time.perf_counter()
+            search = engine.search("bench query")
+            search.fetch(0, count, on_result=lambda index, result: first or first.append(time.perf_counter()))
+            elapsed = time.perf_counter() - started
+            results.add("search.first_result_ms", (first[0] - started) * 1000, "ms")
+            results.add(f"search.results_{count}_ms", elapsed * 1000, "ms")
+
+            started = time.perf_counter()
+            engine.search("bench query").fetch(0, count)
+            results.add(f"search.cached_results_{count}_ms", (time.perf_counter() - started) * 1000, "ms")
+            entries = list(search.results)
+        finally:
+            engine.close()
+
+    try:
+        import tkinter as tk
+        root = tk.Tk()
+    except Exception as e:
+        results.skip("search.render", f"no display: {e}")
+        return
+    try:
+        tree = VirtualTreeview(root, columns=("title", "duration", "channel"), show="tree headings")
+        tree.pack(fill=tk.BOTH, expand=True)
+        root.update()
+        started = time.perf_counter()
+        for index in range(rows):
+            entry = entries[index % len(entries)]
+            tree.insert("", tk.END, iid=str(index),
+                        values=(entry["title"], f"{entry['duration'] // 60}:{entry['duration'] % 60:02d}",
+                                entry["channel"]))
+        root.update()
+        results.add(f"search.render_rows_{rows}_ms", (time.perf_counter() - started) * 1000, "ms")
+
+        started = time.perf_counter()
+        steps = 100
+        for step in range(steps):
+            tree.yview("moveto", step / steps)
+            root.update()
+        results.add("search.scroll_step_ms", (time.perf_counter() - started) / steps * 1000, "ms")
+    finally:
+        root.destroy()
+
+
+def bench_transcode(results, workdir, formats, qualities, seconds):
+    """Convert a synthetic Opus track with FFmpegExtractAudioPP for each format and quality"""
+    if not shutil.which("ffmpeg"):
+        results.skip("transcode", "ffmpeg was not found on PATH")
+        return
+    import yt_dlp
+
+    source = os.path.join(workdir, "source.webm")
+    subprocess.run(["ffmpeg", "-y", "-loglevel", "error",
+                    "-f", "lavfi", "-i", f"sine=frequency=440:duration={seconds}",
+                    "-f", "lavfi", "-i", f"anoisesrc=duration={seconds}:amplitude=0.1",
+                    "-filter_complex", "amix=inputs=2", "-ac", "2", "-c:a", "libopus", "-b:a", "128k", source],
+                   check=True)
+    with yt_dlp.YoutubeDL({"quiet": True, "no_warnings": True}) as ydl:
+        for audio_format in formats:
+            for quality in qualities:
+                path = os.path.join(workdir, "track.webm")
+                shutil.copy(source, path)
+                pp = yt_dlp.postprocessor.FFmpegExtractAudioPP(ydl, preferredcodec=audio_format,
+                                                                preferredquality=quality)
+                started = time.perf_counter()
+                _, info = pp.run({"filepath": path, "ext": "webm"})
+                elapsed = time.perf_counter() - started
+                os.remove(info["filepath"])
+                results.add(f"transcode.s_per_minute.{audio_format}_{quality}k", elapsed / seconds * 60, "s/min")
+
+
+def compare(before_path, after_path, threshold):
+    """Print the change of every metric between two result files; return 1 on a regression"""
+    with open(before_path) as f:
+        before = json.load(f)["metrics"]
+    with open(after_path) as f:
+        after = json.load(f)["metrics"]
+
+    regressions = []
+    print(f"{'metric':<40} {'before':>12} {'after':>12} {'change':>9}")
+    for name in sorted(set(before) | set(after)):
+        if name not in before or name not in after:
+            print(f"{name:<40} {'only in ' + ('after' if name in after else 'before'):>35}")
+            continue
+        old, new = before[name]["value"], after[name]["value"]
+        change = (new - old) / old * 100 if old else 0.0
+        worse = change if after[name]["lower_is_better"] else -change
+        flag = "  REGRESSION" if worse > threshold else ""
+        if flag:
+            regressions.append(name)
+        print(f"{name:<40} {old:>12.3f} {new:>12.3f} {change:>+8.1f}%{flag}")
+
+    if regressions:
+        print(f"{len(regressions)} metric(s) regressed by more than {threshold}%", file=sys.stderr)
+    return 1 if regressions else 0
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--only", default=",".join(BENCHMARKS), help="comma-separated benchmarks to run")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--quick", action="store_true", help="smaller inputs, for a smoke test")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"), help="compare two result files")
+    parser.add_argument("--threshold", type=float, default=10.0, help="percent change counted as a regression")
+    args = parser.parse_args()
+
+    if args.compare:
+        return compare(*args.compare, args.threshold)
+
+    selected = [name.strip() for name in args.only.split(",") if name.strip()]
+    unknown = set(selected) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(sorted(unknown))}")
+
+    results = Results()
+    with tempfile.TemporaryDirectory() as workdir:
+        runs = {
+            "queue": lambda: bench_queue(results, workdir, 20 if args.quick else 200, (1, 2, 4)),
+            "progress": lambda: bench_progress(results, workdir, 20000 if args.quick else 200000),
+            "library": lambda: bench_library(results, workdir, (1000,) if args.quick else (10000, 100000)),
+            "search": lambda: bench_search(results, workdir),
+            "transcode": lambda: bench_transcode(results, workdir, ("mp3", "m4a"),
+                                                 ("128",) if args.quick else ("128", "192", "256", "320"),
+                                                 10 if args.quick else 60),
+        }
+        for name in selected:
+            print(f"{name}:")
+            runs[name]()
+
+    report = {
+        "meta": {
+            "date": datetime.datetime.now().isoformat(timespec="seconds"),
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "quick": args.quick,
+        },
+        "metrics": results.metrics,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,110 @@
+"""Measure the CPU time saved per track by codec-aware conversion
+
+Generates synthetic source tracks with ffmpeg (an AAC .m4a and an Opus .webm,
+both 128 kbps) and converts each one to MP3 and M4A twice:
+
+  always-encode  the old behaviour, a full re-encode at the requested quality
+  planned        DownloadEngine.plan_conversion: keep, stream-copy, or an
+                 encode capped at the source bitrate
+
+CPU time is the user+system time of the ffmpeg child processes.
+
+Usage: python benchmarks/bench_transcode.py [--seconds 180] [--quality 320] [--repeat 3]
+Requires ffmpeg on PATH.
+"""
+import argparse
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from youtube_music_downloader import DownloadEngine
+
+ENCODERS = {"mp3": "libmp3lame", "m4a": "aac"}
+
+SOURCES = {
+    "aac.m4a": ({"acodec": "mp4a.40.2", "ext": "m4a", "abr": 128},
+                ["-c:a", "aac", "-b:a", "128k"]),
+    "opus.webm": ({"acodec": "opus", "ext": "webm", "abr": 128},
+                  ["-c:a", "libopus", "-b:a", "128k"]),
+}
+
+
+def ffmpeg(*args):
+    subprocess.run(["ffmpeg", "-y", "-loglevel", "error", *args], check=True)
+
+
+def make_sources(workdir, seconds):
+    """Write the synthetic source tracks and return {name: (info, path)}"""
+    sources = {}
+    for name, (info, codec_args) in SOURCES.items():
+        path = os.path.join(workdir, name)
+        ffmpeg("-f", "lavfi", "-i", f"sine=frequency=440:duration={seconds}",
+               "-f", "lavfi", "-i", f"anoisesrc=duration={seconds}:amplitude=0.1",
+               "-filter_complex", "amix=inputs=2", "-ac", "2", *codec_args, path)
+        sources[name] = (info, path)
+    return sources
+
+
+def convert(src, dst, action, audio_format, quality):
+    """Run the ffmpeg command FFmpegExtractAudioPP would run for this action"""
+    if action == "keep":
+        return
+    if action == "remux":
+        codec_args = ["-c:a", "copy"] + (["-bsf:a", "aac_adtstoasc"] if audio_format == "m4a" else [])
+    else:
+        codec_args = ["-c:a", ENCODERS[audio_format], "-b:a", f"{quality}k"]
+    ffmpeg("-i", src, "-vn", *codec_args, dst)
+
+
+def child_cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def measure(src, dst, action, audio_format, quality, repeat):
+    """Return (cpu seconds per track, output bytes)"""
+    started = child_cpu_seconds()
+    for _ in range(repeat):
+        convert(src, dst, action, audio_format, quality)
+    cpu = (child_cpu_seconds() - started) / repeat
+    size = os.path.getsize(dst if action != "keep" else src)
+    return cpu, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--seconds", type=int, default=180, help="length of each synthetic track")
+    parser.add_argument("--quality", default="320", help="requested bitrate in kbps")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    if not shutil.which("ffmpeg"):
+        print("ffmpeg was not found on PATH", file=sys.stderr)
+        return 1
+
+    with tempfile.TemporaryDirectory() as workdir:
+        sources = make_sources(workdir, args.seconds)
+        print(f"{'source':<11} {'target':<7} {'plan':<14} {'old cpu':>9} {'new cpu':>9} {'saved':>7} "
+              f"{'old size':>10} {'new size':>10}")
+
+        for name, (info, src) in sources.items():
+            for audio_format in ("mp3", "m4a"):
+                dst = os.path.join(workdir, f"out.{audio_format}")
+                old_cpu, old_size = measure(src, dst, "encode", audio_format, args.quality, args.repeat)
+                action, quality = DownloadEngine.plan_conversion(info, audio_format, args.quality)
+                new_cpu, new_size = measure(src, dst, action, audio_format, quality, args.repeat)
+
+                plan = action if action != "encode" else f"encode@{quality}k"
+                saved = (1 - new_cpu / old_cpu) * 100 if old_cpu else 0.0
+                print(f"{name:<11} {audio_format:<7} {plan:<14} {old_cpu:>8.3f}s {new_cpu:>8.3f}s "
+                      f"{saved:>6.1f}% {old_size:>10} {new_size:>10}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,89 @@
+"""Compare ttk.Treeview with VirtualTreeview on a large list
+
+For each widget: insert N rows, redraw, scroll through the list in steps,
+then delete every row. Reports wall time for each phase and the growth in
+resident memory after the insert.
+
+Usage: python benchmarks/bench_virtual_tree.py [--rows 100000] [--scroll-steps 200]
+Needs a display (on a headless box, run it under xvfb-run).
+"""
+import argparse
+import gc
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import tkinter as tk
+from tkinter import ttk
+
+from youtube_music_downloader import VirtualTreeview, current_rss_bytes
+
+COLUMNS = ("title", "path", "duration")
+
+
+def run(root, factory, rows, scroll_steps):
+    """Time one widget through insert, scroll and delete"""
+    frame = ttk.Frame(root)
+    frame.pack(fill=tk.BOTH, expand=True)
+    tree = factory(frame)
+    tree.pack(fill=tk.BOTH, expand=True)
+    root.update()
+
+    gc.collect()
+    rss_before = current_rss_bytes()
+    started = time.perf_counter()
+    for i in range(rows):
+        tree.insert("", tk.END, iid=str(i),
+                    values=(f"Track {i}", f"/music/track_{i}.mp3", f"{i % 10}:{i % 60:02d}"))
+    root.update()
+    insert_seconds = time.perf_counter() - started
+    rss_growth = current_rss_bytes() - rss_before if rss_before else None
+
+    started = time.perf_counter()
+    for step in range(scroll_steps):
+        tree.yview("moveto", step / scroll_steps)
+        root.update()
+    scroll_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    tree.delete(*tree.get_children())
+    root.update()
+    delete_seconds = time.perf_counter() - started
+
+    frame.destroy()
+    return insert_seconds, scroll_seconds / scroll_steps * 1000, delete_seconds, rss_growth
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--scroll-steps", type=int, default=200)
+    args = parser.parse_args()
+
+    try:
+        root = tk.Tk()
+    except tk.TclError as e:
+        print(f"No display available: {e}", file=sys.stderr)
+        return 1
+    root.geometry("800x600")
+
+    widgets = [
+        ("ttk.Treeview", lambda master: ttk.Treeview(master, columns=COLUMNS, show="headings")),
+        ("VirtualTreeview", lambda master: VirtualTreeview(master, columns=COLUMNS, show="headings")),
+    ]
+
+    print(f"{args.rows} rows")
+    print(f"{'widget':<16} {'insert':>9} {'scroll/step':>12} {'delete':>9} {'rss growth':>12}")
+    for name, factory in widgets:
+        insert_s, scroll_ms, delete_s, rss = run(root, factory, args.rows, args.scroll_steps)
+        rss_text = f"{rss / 1024 / 1024:.1f} MB" if rss is not None else "n/a"
+        print(f"{name:<16} {insert_s:>8.2f}s {scroll_ms:>10.2f}ms {delete_s:>8.2f}s {rss_text:>12}")
+
+    root.destroy()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
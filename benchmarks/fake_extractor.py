@@ -0,0 +1,90 @@
+"""Stub yt-dlp extractors that keep the benchmarks off the network
+
+Inside `with FakeExtractors(server):` every YoutubeDL created, including the
+engine's pooled sessions, knows only two extractors:
+
+  bench         https://bench.invalid/watch?v=<11 chars> resolves to one
+                m4a (AAC) format served by a local MediaServer
+  bench:search  ytsearch<N>:<query> yields an endless list of bench videos
+                with titles, durations and thumbnails
+
+Everything after extraction (downloading, progress hooks, post-processing)
+is the real yt-dlp code.
+
+    with MediaServer() as server, FakeExtractors(server):
+        engine.submit(video_url(0), audio_format="m4a")
+"""
+import itertools
+
+import yt_dlp
+from yt_dlp.extractor.common import InfoExtractor, SearchInfoExtractor
+
+
+def video_id(n):
+    return f"bench{n:06d}"
+
+
+def video_url(n):
+    return f"https://bench.invalid/watch?v={video_id(n)}"
+
+
+class BenchVideoIE(InfoExtractor):
+    IE_NAME = "bench"
+    _VALID_URL = r"https?://bench\.invalid/watch\?v=(?P<id>[0-9A-Za-z_-]{11})"
+    server = None
+
+    def _real_extract(self, url):
+        video_id = self._match_id(url)
+        return {
+            "id": video_id,
+            "title": f"Bench track {video_id}",
+            "duration": 180,
+            "url": self.server.url(f"/track.m4a?v={video_id}"),
+            "ext": "m4a",
+            "acodec": "mp4a.40.2",
+            "vcodec": "none",
+            "abr": 128,
+            "filesize": len(self.server.track),
+        }
+
+
+class BenchSearchIE(SearchInfoExtractor):
+    IE_NAME = "bench:search"
+    _SEARCH_KEY = "ytsearch"
+    _MAX_RESULTS = float("inf")
+
+    def _search_results(self, query):
+        for n in itertools.count():
+            yield {
+                "_type": "url",
+                "ie_key": BenchVideoIE.ie_key(),
+                "id": video_id(n),
+                "url": video_url(n),
+                "title": f"{query} result {n}",
+                "duration": 120 + n % 240,
+                "channel": f"Channel {n % 50}",
+                "thumbnails": [{"url": f"https://bench.invalid/thumb/{video_id(n)}.jpg",
+                                "width": 168, "height": 94}],
+            }
+
+
+class FakeExtractors:
+    """Context manager that swaps yt-dlp's extractor list for the bench ones"""
+
+    def __init__(self, server):
+        self.server = server
+        self._original = None
+
+    def __enter__(self):
+        BenchVideoIE.server = self.server
+        self._original = yt_dlp.YoutubeDL.add_default_info_extractors
+
+        def add_default_info_extractors(ydl):
+            for ie in (BenchVideoIE, BenchSearchIE):
+                ydl.add_info_extractor(ie())
+
+        yt_dlp.YoutubeDL.add_default_info_extractors = add_default_info_extractors
+        return self
+
+    def __exit__(self, *exc):
+        yt_dlp.YoutubeDL.add_default_info_extractors = self._original
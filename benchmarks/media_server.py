@@ -0,0 +1,174 @@
+"""Local HTTP stand-in for a media CDN, used by the download benchmarks
+
+Serves a single progressive track and an HLS playlist of fragments from
+memory. Range requests are honoured (206 + Content-Range), every request
+waits `latency` seconds before the first byte and each connection is
+throttled to `rate` bytes/s, so high-latency links can be emulated on
+localhost. cut_next() drops the next track response part way through, like
+a network failure. Bytes sent and requests served are counted per path
+prefix.
+
+    with MediaServer(track_size=8 * 1024 * 1024, latency=0.1) as server:
+        url = server.url("/track.m4a")
+"""
+import collections
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+RANGE_RE = re.compile(r"bytes=(\d*)-(\d*)")
+
+
+class MediaServer:
+    def __init__(self, track_size=4 * 1024 * 1024, segments=40, segment_size=256 * 1024,
+                 segment_seconds=2, latency=0.0, rate=0):
+        self.latency = latency
+        self.rate = rate
+        self.track = bytes(i % 251 for i in range(track_size))
+        self.segment = bytes(i % 241 for i in range(segment_size))
+        self.segments = segments
+        self.segment_seconds = segment_seconds
+        self.bytes_sent = collections.Counter()
+        self.requests = collections.Counter()
+        self._cut = None
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+    
+    def url(self, path):
+        host, port = self._server.server_address
+        return f"http://{host}:{port}{path}"
+    
+    def playlist(self):
+        lines = ["#EXTM3U", "#EXT-X-VERSION:3", f"#EXT-X-TARGETDURATION:{self.segment_seconds}",
+                 "#EXT-X-MEDIA-SEQUENCE:0"]
+        for i in range(self.segments):
+            lines += [f"#EXTINF:{self.segment_seconds:.1f},", f"seg{i}.ts"]
+        lines.append("#EXT-X-ENDLIST")
+        return ("\n".join(lines) + "\n").encode()
+    
+    def cut_next(self, nbytes, skip=0):
+        """Close a later /track response after nbytes of its body, passing over `skip` responses first"""
+        self._cut = (nbytes, skip)
+    
+    def reset_counters(self):
+        with self._lock:
+            self.bytes_sent.clear()
+            self.requests.clear()
+    
+    def _count(self, path, nbytes):
+        prefix = path.split("/")[1] if "/" in path else path
+        with self._lock:
+            self.bytes_sent[prefix] += nbytes
+    
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+    
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+    
+    def __enter__(self):
+        return self.start()
+    
+    def __exit__(self, *exc):
+        self.stop()
+    
+    def _handler_class(self):
+        server = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            
+            def log_message(self, *args):
+                pass
+            
+            def _body(self):
+                path = self.path.split("?")[0]
+                if path.startswith("/track"):
+                    return server.track, "audio/mp4"
+                if path == "/hls/index.m3u8":
+                    return server.playlist(), "application/vnd.apple.mpegurl"
+                match = re.fullmatch(r"/hls/seg(\d+)\.ts", path)
+                if match and int(match.group(1)) < server.segments:
+                    return server.segment, "video/mp2t"
+                return None, None
+            
+            def do_HEAD(self):
+                self._respond(head=True)
+            
+            def do_GET(self):
+                self._respond(head=False)
+            
+            def _respond(self, head):
+                with server._lock:
+                    server.requests[self.path.split("/")[1]] += 1
+                body, content_type = self._body()
+                if body is None:
+                    self.send_error(404)
+                    return
+                
+                start, end = 0, len(body) - 1
+                match = RANGE_RE.fullmatch(self.headers.get("Range", ""))
+                if match and (match.group(1) or match.group(2)):
+                    if match.group(1):
+                        start = int(match.group(1))
+                        end = min(int(match.group(2)), end) if match.group(2) else end
+                    else:
+                        start = max(0, len(body) - int(match.group(2)))
+                    if start >= len(body):
+                        self.send_response(416)
+                        self.send_header("Content-Range", f"bytes */{len(body)}")
+                        self.send_header("Content-Length", "0")
+                        self.end_headers()
+                        return
+                    self.send_response(206)
+                    self.send_header("Content-Range", f"bytes {start}-{end}/{len(body)}")
+                else:
+                    self.send_response(200)
+                
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(end - start + 1))
+                self.send_header("Accept-Ranges", "bytes")
+                self.end_headers()
+                if head:
+                    return
+                
+                if server.latency:
+                    time.sleep(server.latency)
+                self._send(body, start, end + 1)
+            
+            def _send(self, body, start, stop):
+                chunk_size = 64 * 1024
+                started = time.monotonic()
+                sent = 0
+                with server._lock:
+                    cut, server._cut = server._cut, None
+                    if cut is not None and self.path.startswith("/track"):
+                        nbytes, skip = cut
+                        if skip:
+                            server._cut = (nbytes, skip - 1)
+                        else:
+                            stop = min(stop, start + nbytes)
+                            self.close_connection = True
+                    elif cut is not None:
+                        server._cut = cut
+                try:
+                    for offset in range(start, stop, chunk_size):
+                        chunk = body[offset:min(offset + chunk_size, stop)]
+                        self.wfile.write(chunk)
+                        sent += len(chunk)
+                        server._count(self.path, len(chunk))
+                        if server.rate:
+                            # Per-connection throttle
+                            ahead = sent / server.rate - (time.monotonic() - started)
+                            if ahead > 0:
+                                time.sleep(ahead)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+        
+        return Handler
@@ -0,0 +1,36 @@
+import pytest
+
+from youtube_music_downloader import DownloadEngine
+
+
+@pytest.mark.parametrize("typed, expected", [
+    ("192", "192"),
+    (" 192k ", "192"),
+    ("320 kbps", "320"),
+    ("128K", "128"),
+    (256, "256"),
+])
+def test_typed_qualities_are_normalized(typed, expected):
+    assert DownloadEngine.normalize_quality(typed) == expected
+
+
+@pytest.mark.parametrize("typed", ["best", "", "0", "192.5", "-128", "9999"])
+def test_bad_qualities_are_rejected(typed):
+    with pytest.raises(ValueError):
+        DownloadEngine.normalize_quality(typed)
+
+
+def test_submit_rejects_a_bad_quality_before_queueing(tmp_path):
+    engine = DownloadEngine(data_dir=str(tmp_path), persist_info=False, use_journal=False,
+                            preview_cache_size=0, thumbnail_cache_size=0)
+    engine.pause()
+    try:
+        with pytest.raises(ValueError):
+            engine.submit("https://www.youtube.com/watch?v=dQw4w9WgXcQ", "mp3", "best")
+        assert engine.pending_count == 0
+        
+        handle = engine.submit("https://www.youtube.com/watch?v=dQw4w9WgXcQ", "mp3", "128k")
+        assert handle.quality == "128"
+        assert DownloadEngine.plan_conversion({"acodec": "opus", "abr": 160}, "mp3", handle.quality) == ("encode", "128")
+    finally:
+        engine.close()
@@ -0,0 +1,61 @@
+import threading
+import time
+
+from youtube_music_downloader import BandwidthLimiter
+
+CHUNK = 16 * 1024
+
+
+def read(limiter, key, total, weight=1):
+    for _ in range(total // CHUNK):
+        limiter.consume(key, CHUNK, weight)
+
+
+def test_unlimited_never_blocks():
+    limiter = BandwidthLimiter(rate=0)
+    started = time.monotonic()
+    read(limiter, "a", 64 * 1024 * 1024)
+    assert time.monotonic() - started < 0.5
+
+
+def test_single_flow_is_held_to_the_rate():
+    limiter = BandwidthLimiter(rate=1024 * 1024)
+    started = time.monotonic()
+    read(limiter, "a", 512 * 1024)
+    assert 0.4 < time.monotonic() - started < 1.0
+
+
+def test_weighted_flows_split_the_rate():
+    limiter = BandwidthLimiter(rate=2 * 1024 * 1024)
+    received = {"heavy": 0, "light": 0}
+    stop = threading.Event()
+    
+    def flow(key, weight):
+        while not stop.is_set():
+            limiter.consume(key, CHUNK, weight)
+            received[key] += CHUNK
+    
+    threads = [threading.Thread(target=flow, args=("heavy", 3)), threading.Thread(target=flow, args=("light", 1))]
+    for thread in threads:
+        thread.start()
+    time.sleep(1.0)
+    stop.set()
+    limiter.set_rate(0)
+    for thread in threads:
+        thread.join(timeout=2)
+    
+    total = received["heavy"] + received["light"]
+    assert total < 2 * 1024 * 1024 * 1.5
+    assert 2 < received["heavy"] / received["light"] < 4.5
+
+
+def test_set_rate_and_release_wake_a_waiting_flow():
+    for wake in (lambda limiter: limiter.set_rate(0), lambda limiter: limiter.release("a")):
+        limiter = BandwidthLimiter(rate=1024)
+        thread = threading.Thread(target=limiter.consume, args=("a", 1024 * 1024))
+        thread.start()
+        time.sleep(0.1)
+        assert thread.is_alive()
+        wake(limiter)
+        thread.join(timeout=1)
+        assert not thread.is_alive()
@@ -0,0 +1,33 @@
+import json
+import sys
+
+import pytest
+
+from youtube_music_downloader import BatchRunner, DownloadEngine
+
+
+def test_ydl_opts_keep_yt_dlp_off_stdout(tmp_path):
+    opts = DownloadEngine.build_ydl_opts("mp3", "192", str(tmp_path))
+    # quiet doesn't imply noprogress in the Python API; the progress bar would land among the JSON lines
+    assert opts["quiet"] and opts["noprogress"]
+
+
+def test_stdout_is_only_json_lines(tmp_path, capfd):
+    pytest.importorskip("yt_dlp")
+    from fake_extractor import FakeExtractors, video_url
+    from media_server import MediaServer
+    
+    engine = DownloadEngine(data_dir=str(tmp_path / "state"), use_journal=False, persist_info=False,
+                            preview_cache_size=0, thumbnail_cache_size=0)
+    runner = BatchRunner(engine, "m4a", "192", str(tmp_path / "out"), out=sys.stdout, progress_interval=0)
+    try:
+        with MediaServer(track_size=512 * 1024, rate=2 * 1024 * 1024) as server, FakeExtractors(server):
+            runner.run([video_url(0), video_url(1)])
+    finally:
+        engine.close()
+    
+    records = [json.loads(line) for line in capfd.readouterr().out.splitlines()]
+    events = [record["event"] for record in records]
+    assert events.count("queued") == 2
+    assert "progress" in events
+    assert events[-1] == "summary"
@@ -0,0 +1,83 @@
+import os
+import sqlite3
+
+from youtube_music_downloader import DownloadArchive
+
+
+def count_hashes(monkeypatch):
+    calls = []
+    original = DownloadArchive.file_hash
+    monkeypatch.setattr(DownloadArchive, "file_hash",
+                        staticmethod(lambda path: calls.append(path) or original(path)))
+    return calls
+
+
+def test_missing_or_resized_file_is_not_a_duplicate(tmp_path):
+    song = tmp_path / "song.mp3"
+    song.write_bytes(b"a" * 100)
+    archive = DownloadArchive(str(tmp_path / "archive.db"))
+    archive.add("dQw4w9WgXcQ", "mp3", str(song))
+    assert archive.contains("dQw4w9WgXcQ", "mp3")
+    assert not archive.contains("dQw4w9WgXcQ", "m4a")
+    
+    song.write_bytes(b"a" * 50)
+    assert not archive.contains("dQw4w9WgXcQ", "mp3")
+    song.unlink()
+    assert not archive.contains("dQw4w9WgXcQ", "mp3")
+    archive.close()
+
+
+def test_unchanged_files_are_not_hashed_again(tmp_path, monkeypatch):
+    song = tmp_path / "song.mp3"
+    song.write_bytes(b"a" * 100)
+    archive = DownloadArchive(str(tmp_path / "archive.db"), verify_files=True)
+    hashes = count_hashes(monkeypatch)
+    archive.add("dQw4w9WgXcQ", "mp3", str(song))
+    for _ in range(3):
+        assert archive.contains("dQw4w9WgXcQ", "mp3")
+    assert len(hashes) == 1
+    archive.close()
+    
+    # The recorded mtime survives a restart
+    archive = DownloadArchive(str(tmp_path / "archive.db"), verify_files=True)
+    assert archive.contains("dQw4w9WgXcQ", "mp3")
+    assert len(hashes) == 1
+    archive.close()
+
+
+def test_rewritten_file_is_hashed_and_checked(tmp_path, monkeypatch):
+    song = tmp_path / "song.mp3"
+    song.write_bytes(b"a" * 100)
+    archive = DownloadArchive(str(tmp_path / "archive.db"), verify_files=True)
+    hashes = count_hashes(monkeypatch)
+    archive.add("dQw4w9WgXcQ", "mp3", str(song))
+    
+    # Same content, newer mtime: hashed once, then trusted again
+    stat = os.stat(song)
+    os.utime(song, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert archive.contains("dQw4w9WgXcQ", "mp3")
+    assert archive.contains("dQw4w9WgXcQ", "mp3")
+    assert len(hashes) == 2
+    
+    # Another song of the same size written to the path
+    song.write_bytes(b"b" * 100)
+    os.utime(song, ns=(stat.st_atime_ns, stat.st_mtime_ns + 2 * 10 ** 9))
+    assert not archive.contains("dQw4w9WgXcQ", "mp3")
+    archive.close()
+
+
+def test_archive_without_mtimes_is_upgraded(tmp_path):
+    song = tmp_path / "song.mp3"
+    song.write_bytes(b"a" * 100)
+    path = str(tmp_path / "archive.db")
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.execute("CREATE TABLE archive (video_id TEXT, format TEXT, path TEXT, size INTEGER, sha256 TEXT, "
+                     "added REAL, PRIMARY KEY (video_id, format))")
+        conn.execute("INSERT INTO archive VALUES (?, 'mp3', ?, 100, ?, 0)",
+                     ("dQw4w9WgXcQ", str(song), DownloadArchive.file_hash(str(song))))
+    conn.close()
+    
+    archive = DownloadArchive(path, verify_files=True)
+    assert archive.contains("dQw4w9WgXcQ", "mp3")
+    archive.close()
@@ -0,0 +1,98 @@
+import random
+
+import pytest
+
+from youtube_music_downloader import DownloadDispatcher, DownloadQueue
+
+
+def make_queue(*item_ids):
+    queue = DownloadQueue()
+    for item_id in item_ids:
+        queue.push({"id": item_id})
+    return queue
+
+
+def ids(items):
+    return [item["id"] for item in items]
+
+
+def test_pop_runs_in_push_order():
+    queue = make_queue("a", "b", "c")
+    assert [queue.pop()["id"] for _ in range(3)] == ["a", "b", "c"]
+    with pytest.raises(IndexError):
+        queue.pop()
+
+
+def test_push_rejects_duplicate_ids():
+    queue = make_queue("a")
+    with pytest.raises(ValueError):
+        queue.push({"id": "a"})
+
+
+def test_remove_from_the_middle_keeps_order():
+    queue = make_queue("a", "b", "c", "d", "e")
+    assert queue.remove("c") == {"id": "c"}
+    assert "c" not in queue
+    assert len(queue) == 4
+    assert ids(queue.ordered()) == ["a", "b", "d", "e"]
+
+
+def test_move_to_top_and_swap():
+    queue = make_queue("a", "b", "c", "d")
+    queue.move_to_top("c")
+    assert ids(queue.ordered()) == ["c", "a", "b", "d"]
+    queue.move_to_top("d")
+    assert ids(queue.ordered()) == ["d", "c", "a", "b"]
+    queue.swap("a", "b")
+    assert ids(queue.ordered()) == ["d", "c", "b", "a"]
+    assert queue.pop()["id"] == "d"
+
+
+def test_clear_returns_items_in_order():
+    queue = make_queue("a", "b", "c")
+    queue.swap("a", "c")
+    assert ids(queue.clear()) == ["c", "b", "a"]
+    assert len(queue) == 0
+    assert queue.get("a") is None
+
+
+def test_heap_index_survives_random_operations():
+    rng = random.Random(4)
+    queue = DownloadQueue()
+    expected = []
+    for n in range(300):
+        op = rng.random()
+        if op < 0.45 or not expected:
+            queue.push({"id": n})
+            expected.append(n)
+        elif op < 0.6:
+            item_id = rng.choice(expected)
+            queue.remove(item_id)
+            expected.remove(item_id)
+        elif op < 0.75:
+            item_id = rng.choice(expected)
+            queue.move_to_top(item_id)
+            expected.remove(item_id)
+            expected.insert(0, item_id)
+        elif op < 0.9:
+            first, second = rng.sample(expected, 2) if len(expected) > 1 else (expected[0],) * 2
+            queue.swap(first, second)
+            i, j = expected.index(first), expected.index(second)
+            expected[i], expected[j] = expected[j], expected[i]
+        else:
+            assert queue.pop()["id"] == expected.pop(0)
+        assert ids(queue.ordered()) == expected
+        assert all(queue._heap[queue._pos[item_id]][1] == item_id for item_id in expected)
+
+
+def test_dispatcher_only_reorders_pending_items():
+    dispatcher = DownloadDispatcher(lambda item: None)
+    dispatcher.pause()
+    dispatcher.submit({"id": "a"})
+    dispatcher.submit({"id": "b"})
+    assert dispatcher.swap("a", "b")
+    assert dispatcher.move_to_top("b")
+    assert not dispatcher.swap("a", "gone")
+    assert not dispatcher.move_to_top("gone")
+    assert ids(dispatcher.clear()) == ["b", "a"]
+    dispatcher.shutdown()
@@ -0,0 +1,42 @@
+from youtube_music_downloader import DownloadEngine
+
+URL = "https://www.youtube.com/watch?v=dQw4w9WgXcQ"
+
+
+def make_engine(tmp_path):
+    engine = DownloadEngine(data_dir=str(tmp_path), persist_info=False, use_journal=False,
+                            preview_cache_size=0, thumbnail_cache_size=0)
+    # Nothing is downloaded; jobs stay pending
+    engine.pause()
+    return engine
+
+
+def test_queued_video_is_a_duplicate_in_the_same_format(tmp_path):
+    engine = make_engine(tmp_path)
+    try:
+        first = engine.submit(URL, "mp3")
+        assert first.state == "queued"
+        assert engine.find_duplicate("dQw4w9WgXcQ", "mp3") == "queued"
+        assert engine.find_duplicate("dQw4w9WgXcQ", "m4a") is None
+        assert engine.find_duplicate("dQw4w9WgXcQ", "mp3", exclude=first) is None
+        
+        second = engine.submit(URL, "mp3")
+        assert second.state == "skipped" and second.skip_reason == "queued"
+    finally:
+        engine.close()
+
+
+def test_finished_jobs_leave_the_index(tmp_path):
+    engine = make_engine(tmp_path)
+    try:
+        first = engine.submit(URL, "mp3")
+        forced = engine.submit(URL, "mp3", skip_duplicates=False)
+        assert forced.state == "queued"
+        
+        assert engine.remove(first.id)
+        assert engine.find_duplicate("dQw4w9WgXcQ", "mp3") == "queued"
+        assert engine.remove(forced.id)
+        assert engine.find_duplicate("dQw4w9WgXcQ", "mp3") is None
+        assert not engine._active_keys and not engine._job_keys
+    finally:
+        engine.close()
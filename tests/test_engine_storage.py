@@ -0,0 +1,30 @@
+import os
+
+from youtube_music_downloader import DownloadEngine
+
+
+def test_storage_is_opened_on_first_use(tmp_path):
+    engine = DownloadEngine(data_dir=str(tmp_path), persist_info=False)
+    assert os.listdir(tmp_path) == []
+    
+    assert engine.archive is not None
+    assert {"archive.db", "previews", "queue.db", "thumbnails"} <= set(os.listdir(tmp_path))
+    assert engine.journal is not None and engine.previews is not None
+    assert engine.thumbnails.cache is not None
+    engine.close()
+
+
+def test_closed_engine_does_not_reopen_storage(tmp_path):
+    engine = DownloadEngine(data_dir=str(tmp_path), persist_info=False)
+    engine.close()
+    assert engine.journal is None and engine.archive is None
+    assert os.listdir(tmp_path) == []
+
+
+def test_switched_off_storage(tmp_path):
+    engine = DownloadEngine(data_dir=str(tmp_path), use_journal=False, use_archive=False, persist_info=False,
+                            preview_cache_size=0, thumbnail_cache_size=0)
+    engine.open_storage()
+    assert engine.journal is None and engine.archive is None and engine.previews is None
+    assert engine.thumbnails.cache is None
+    engine.close()
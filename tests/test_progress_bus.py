@@ -0,0 +1,21 @@
+from youtube_music_downloader import ProgressBus
+
+
+def test_publish_keeps_the_newest_value_per_field():
+    bus = ProgressBus()
+    bus.publish("a", progress="10%", status="Downloading")
+    bus.publish("a", progress="20%")
+    bus.publish("b", status="Queued")
+    assert bus.drain() == {"a": {"progress": "20%", "status": "Downloading"}, "b": {"status": "Queued"}}
+    assert bus.drain() == {}
+
+
+def test_append_collects_every_item_until_the_drain():
+    bus = ProgressBus()
+    bus.append("search", "results", 1)
+    bus.publish("search", finished="done")
+    bus.append("search", "results", 2)
+    assert bus.drain() == {"search": {"results": [1, 2], "finished": "done"}}
+    
+    bus.append("search", "results", 3)
+    assert bus.drain() == {"search": {"results": [3]}}
@@ -0,0 +1,70 @@
+import os
+import sqlite3
+import time
+
+from youtube_music_downloader import QueueJournal
+
+
+def item(item_id, **extra):
+    return dict({"id": item_id, "url": f"https://youtu.be/{item_id}", "title": item_id, "format": "mp3",
+                 "quality": "192", "output_dir": "/music", "added": "2024-01-01 00:00:00"}, **extra)
+
+
+def test_restore_unfinished_items_in_queue_order(tmp_path):
+    path = str(tmp_path / "queue.sqlite3")
+    journal = QueueJournal(path, flush_interval=0.01)
+    for item_id in ("a", "b", "c", "d", "e"):
+        journal.record_queued(item(item_id))
+    journal.record_state("a", "downloading")
+    journal.record_state("b", "completed")
+    journal.record_state("c", "failed", error="HTTP Error 403")
+    journal.record_removed("d")
+    journal.record_state("e", "retrying")
+    journal.close()
+    
+    journal = QueueJournal(path)
+    restored = journal.load_unfinished()
+    journal.close()
+    assert [row["id"] for row in restored] == ["a", "e"]
+    assert restored[0] == dict(item("a"), state="downloading")
+    assert restored[1]["state"] == "retrying"
+
+
+def test_requeued_item_moves_to_the_back(tmp_path):
+    path = str(tmp_path / "queue.sqlite3")
+    journal = QueueJournal(path, flush_interval=0.01)
+    journal.record_queued(item("a"))
+    journal.record_queued(item("b"))
+    journal.record_queued(item("a"))
+    journal.flush()
+    assert [row["id"] for row in journal.load_unfinished()] == ["b", "a"]
+    journal.close()
+
+
+def test_old_finished_items_are_pruned_on_open(tmp_path):
+    path = str(tmp_path / "queue.sqlite3")
+    journal = QueueJournal(path, flush_interval=0.01)
+    journal.record_queued(item("old"))
+    journal.record_queued(item("new"))
+    journal.record_state("old", "completed")
+    journal.record_state("new", "completed")
+    journal.close()
+    
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.execute("UPDATE items SET updated = ? WHERE id = 'old'", (time.time() - 8 * 86400,))
+    conn.close()
+    
+    QueueJournal(path, keep_days=7).close()
+    conn = sqlite3.connect(path)
+    try:
+        assert [row[0] for row in conn.execute("SELECT id FROM items")] == ["new"]
+        assert {row[0] for row in conn.execute("SELECT item_id FROM transitions")} == {"new"}
+    finally:
+        conn.close()
+
+
+def test_creates_missing_directory(tmp_path):
+    path = str(tmp_path / "state" / "queue.sqlite3")
+    QueueJournal(path).close()
+    assert os.path.exists(path)
@@ -0,0 +1,42 @@
+import threading
+
+import pytest
+
+from youtube_music_downloader import DownloadEngine, QueueJournal
+
+
+def test_restored_job_continues_its_part_file(tmp_path):
+    pytest.importorskip("yt_dlp")
+    from fake_extractor import FakeExtractors, video_id, video_url
+    from media_server import MediaServer
+    
+    state_dir = str(tmp_path / "state")
+    output_dir = tmp_path / "music"
+    output_dir.mkdir()
+    
+    with MediaServer(track_size=1024 * 1024) as server, FakeExtractors(server):
+        # A previous session got half way through the download before it was closed
+        half = len(server.track) // 2
+        (output_dir / f"Bench track {video_id(0)}.m4a.part").write_bytes(server.track[:half])
+        journal = QueueJournal(f"{state_dir}/queue.db")
+        journal.record_queued({"id": "item_0", "url": video_url(0), "title": "Bench track", "format": "m4a",
+                               "quality": "192", "output_dir": str(output_dir), "added": "2024-01-01 00:00:00"})
+        journal.record_state("item_0", "downloading")
+        journal.close()
+        
+        engine = DownloadEngine(data_dir=state_dir, persist_info=False, use_archive=False,
+                                preview_cache_size=0, thumbnail_cache_size=0)
+        downloaded = threading.Event()
+        engine.subscribe(lambda handle, event: event["type"] == "state"
+                         and event["state"] not in ("queued", "downloading") and downloaded.set())
+        try:
+            handles = engine.restore()
+            assert [handle.id for handle in handles] == ["item_0"]
+            assert downloaded.wait(10)
+        finally:
+            engine.close()
+        
+        # Only the missing half was fetched, with a Range request
+        assert handles[0].error is None
+        assert sum(server.bytes_sent.values()) == len(server.track) - half
+        assert (output_dir / f"Bench track {video_id(0)}.m4a").read_bytes() == server.track
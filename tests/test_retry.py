@@ -0,0 +1,146 @@
+import threading
+import time
+
+import pytest
+
+from youtube_music_downloader import CircuitBreaker, RetryPolicy, RetryScheduler, classify_error
+
+
+@pytest.mark.parametrize("message, stage, expected", [
+    ("ERROR: [youtube] abc: HTTP Error 429: Too Many Requests", "download", "rate_limit"),
+    ("ERROR: unable to download video data: HTTP Error 403: Forbidden", "download", "auth"),
+    ("ERROR: [youtube] abc: Sign in to confirm you're not a bot. Use --cookies-from-browser", "download", "auth"),
+    ("ERROR: [youtube] abc: Sign in to confirm your age. This video may be inappropriate", "download", "auth"),
+    ("ERROR: [youtube] abc: Video unavailable", "download", "unavailable"),
+    ("ERROR: [youtube] abc: Private video. Sign in if you've been granted access", "download", "unavailable"),
+    ("ERROR: [youtube] abc: This video has been removed by the uploader", "download", "unavailable"),
+    ("ERROR: [youtube] abc: The uploader has not made this video available in your country", "download",
+     "unavailable"),
+    ("ERROR: [youtube] abc: This video is not available in your country", "download", "unavailable"),
+    ("ERROR: Unsupported URL: https://example.com/song", "download", "unavailable"),
+    ("ERROR: unable to download video data: HTTP Error 404: Not Found", "download", "unavailable"),
+    ("ERROR: [youtube] abc: Premieres in 3 hours", "download", "unavailable"),
+    ("ERROR: [youtube] abc: Requested format is not available. Use --list-formats", "download", "other"),
+    ("ERROR: Postprocessing: ffprobe and ffmpeg not found. Please install", "download", "ffmpeg"),
+    ("ERROR: Postprocessing: ffprobe and ffmpeg not found. Please install", "transcode", "ffmpeg"),
+    ("Conversion failed!", "transcode", "ffmpeg"),
+    ("[Errno 2] No such file or directory: 'song.webm'", "transcode", "ffmpeg"),
+    ("ERROR: unable to download video data: HTTP Error 404: Not Found", "transcode", "ffmpeg"),
+    ("ERROR: Got error: Downloaded 307200 bytes, expected 1048576 bytes", "download", "network"),
+    ("ERROR: Content too short", "download", "network"),
+    ("ERROR: Unable to download webpage: <urlopen error [Errno -3] Temporary failure in name resolution>",
+     "download", "network"),
+    ("ERROR: Read timed out.", "download", "network"),
+    ("ERROR: unable to download video data: HTTP Error 503: Service Unavailable", "download", "network"),
+    ("ERROR: [youtube] abc: Connection reset by peer", "download", "network"),
+    ("ERROR: Did not get any data blocks", "download", "network"),
+    ("something odd happened", "download", "other"),
+])
+def test_classify_error(message, stage, expected):
+    assert classify_error(message, stage) == expected
+
+
+def test_classify_error_by_exception_type():
+    assert classify_error(ConnectionResetError("reset")) == "network"
+    assert classify_error(TimeoutError()) == "network"
+    assert classify_error(ValueError("HTTP Error 429")) == "rate_limit"
+
+
+def test_retry_policy_backs_off_and_gives_up():
+    policy = RetryPolicy(retries=3, base_delay=2, factor=2, max_delay=5, jitter=0)
+    assert [policy.delay(attempt) for attempt in (1, 2, 3, 4)] == [2, 4, 5, None]
+    jittered = RetryPolicy(retries=1, base_delay=10, jitter=0.5)
+    assert all(5 <= jittered.delay(1) <= 10 for _ in range(100))
+    assert RetryPolicy(retries=0, base_delay=0).delay(1) is None
+
+
+def test_scheduler_runs_callbacks_in_due_order():
+    scheduler = RetryScheduler()
+    fired = []
+    done = threading.Event()
+    scheduler.schedule("late", 0.15, lambda: (fired.append("late"), done.set()))
+    scheduler.schedule("early", 0.05, lambda: fired.append("early"))
+    scheduler.schedule("cancelled", 0.02, lambda: fired.append("cancelled"))
+    assert scheduler.cancel("cancelled")
+    assert not scheduler.cancel("cancelled")
+    assert len(scheduler) == 2 and "late" in scheduler
+    assert done.wait(2)
+    assert fired == ["early", "late"]
+    assert len(scheduler) == 0
+    scheduler.close()
+
+
+def test_rescheduling_a_key_replaces_its_timer():
+    scheduler = RetryScheduler()
+    fired = []
+    scheduler.schedule("job", 0.02, lambda: fired.append("first"))
+    scheduler.schedule("job", 0.1, lambda: fired.append("second"))
+    time.sleep(0.25)
+    assert fired == ["second"]
+    scheduler.close()
+
+
+def test_closed_scheduler_drops_timers():
+    scheduler = RetryScheduler()
+    fired = []
+    scheduler.schedule("job", 0.05, lambda: fired.append("job"))
+    scheduler.close()
+    scheduler.schedule("later", 0.01, lambda: fired.append("later"))
+    time.sleep(0.15)
+    assert fired == [] and len(scheduler) == 0
+
+
+class Breaker:
+    def __init__(self, **kwargs):
+        self.scheduler = RetryScheduler()
+        self.events = []
+        self.breaker = CircuitBreaker(self.scheduler, lambda cooldown: self.events.append(("open", cooldown)),
+                                      lambda: self.events.append(("close",)), **kwargs)
+    
+    def half_open(self):
+        # Skip the cooldown
+        self.scheduler.cancel(CircuitBreaker.TIMER_KEY)
+        self.breaker._half_open()
+
+
+def test_breaker_opens_after_repeated_rate_limits():
+    breaker = Breaker(threshold=3, cooldown=60)
+    for error_class in ("rate_limit", "network", "rate_limit", None, "auth"):
+        breaker.breaker.record(error_class)
+    assert breaker.breaker.state == "closed"
+    breaker.breaker.record("rate_limit")
+    assert breaker.breaker.state == "open"
+    assert breaker.events == [("open", 60)]
+    assert 59 < breaker.breaker.reopens_in <= 60
+    breaker.scheduler.close()
+
+
+def test_breaker_only_counts_failures_within_the_window():
+    breaker = Breaker(threshold=2, window=0.05)
+    breaker.breaker.record("rate_limit")
+    time.sleep(0.1)
+    breaker.breaker.record("rate_limit")
+    assert breaker.breaker.state == "closed"
+    breaker.scheduler.close()
+
+
+def test_half_open_breaker_closes_on_success_and_backs_off_on_failure():
+    breaker = Breaker(threshold=1, cooldown=60, max_cooldown=200)
+    breaker.breaker.record("rate_limit")
+    breaker.half_open()
+    assert breaker.breaker.state == "half-open"
+    assert breaker.events[-1] == ("close",)
+    
+    # A rate limit straight after reopening doubles the cooldown, up to max_cooldown
+    breaker.breaker.record("rate_limit")
+    breaker.half_open()
+    breaker.breaker.record("rate_limit")
+    breaker.half_open()
+    breaker.breaker.record("rate_limit")
+    assert [event[1] for event in breaker.events if event[0] == "open"] == [60, 120, 200, 200]
+    
+    breaker.half_open()
+    breaker.breaker.record(None)
+    assert breaker.breaker.state == "closed"
+    assert breaker.breaker._cooldown == 60
+    breaker.scheduler.close()
@@ -0,0 +1,102 @@
+import types
+
+import pytest
+
+from youtube_music_downloader import SearchCache, normalize_query
+
+
+class FakeYDL:
+    def __init__(self, pool):
+        self.pool = pool
+    
+    def extract_info(self, url, download=True, process=True):
+        assert url.startswith("ytsearchall:") and not download and not process
+        self.pool.extractions += 1
+        return {"entries": self.pool.entries(url[len("ytsearchall:"):])}
+
+
+class FakeSessionPool:
+    def __init__(self, count=25, fail_after=None):
+        self.count = count
+        self.fail_after = fail_after
+        self.extractions = 0
+        self.pulled = 0
+        self.held = 0
+        self.errors = []
+    
+    def entries(self, query):
+        for n in range(self.count):
+            if self.fail_after is not None and self.pulled == self.fail_after:
+                self.fail_after = None
+                raise OSError("connection reset")
+            self.pulled += 1
+            yield {"id": f"{n:011d}", "title": f"{query} {n}", "url": f"https://youtu.be/{n:011d}"}
+    
+    def acquire(self, opts, browser=None):
+        self.held += 1
+        return types.SimpleNamespace(ydl=FakeYDL(self))
+    
+    def release(self, session, error=None):
+        self.held -= 1
+        self.errors.append(error)
+
+
+def test_normalize_query():
+    assert normalize_query("  Daft   PUNK ") == "daft punk"
+
+
+def test_pages_are_pulled_lazily_and_not_repeated():
+    pool = FakeSessionPool(count=25)
+    results = SearchCache(pool).get("daft punk", {})
+    assert results.fetch(0, 10) == 10
+    assert pool.pulled == 10
+    
+    seen = []
+    assert results.fetch(5, 10, on_result=lambda index, result: seen.append(index)) == 15
+    assert seen == list(range(5, 15))
+    assert pool.pulled == 15
+    assert pool.extractions == 1
+    
+    assert results.fetch(15, 20) == 25
+    assert results.exhausted
+    assert pool.held == 0
+
+
+def test_same_query_is_served_from_the_cache():
+    pool = FakeSessionPool()
+    cache = SearchCache(pool)
+    first = cache.get("Daft Punk", {})
+    first.fetch(0, 10)
+    second = cache.get("daft  punk", {})
+    assert second is first
+    assert second.fetch(0, 10) == 10
+    assert pool.extractions == 1
+
+
+def test_expired_and_evicted_results_release_their_session():
+    pool = FakeSessionPool()
+    cache = SearchCache(pool, max_entries=2, ttl=900)
+    for query in ("a", "b", "c"):
+        cache.get(query, {}).fetch(0, 5)
+    assert pool.held == 2
+    
+    expired = cache.get("b", {})
+    expired.created -= 900
+    assert cache.get("b", {}) is not expired
+    assert pool.held == 1
+    
+    cache.clear()
+    assert pool.held == 0
+
+
+def test_failed_page_restarts_after_the_known_results():
+    pool = FakeSessionPool(fail_after=7)
+    results = SearchCache(pool).get("query", {})
+    with pytest.raises(OSError):
+        results.fetch(0, 10)
+    assert len(results.results) == 7
+    assert pool.held == 0
+    
+    assert results.fetch(0, 10) == 10
+    assert [result["title"] for result in results.results] == [f"query {n}" for n in range(10)]
+    assert pool.extractions == 2
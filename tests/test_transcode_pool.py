@@ -0,0 +1,44 @@
+import threading
+import time
+
+from youtube_music_downloader import TranscodePool
+
+
+def test_shutdown_does_not_wait_for_a_full_queue():
+    release = threading.Event()
+    done = []
+    
+    def handler(job):
+        release.wait()
+        done.append(job)
+    
+    pool = TranscodePool(handler, workers=2, queue_size=2)
+    for job in range(4):
+        pool.submit(job)
+    assert pool.depth == 2
+    
+    started = time.monotonic()
+    pool.shutdown()
+    assert time.monotonic() - started < 0.5
+    
+    # The running conversions finish; the queued ones are left for the journal to restore
+    release.set()
+    for thread in pool._threads:
+        thread.join(timeout=2)
+        assert not thread.is_alive()
+    assert sorted(done) == [0, 1]
+
+
+def test_idle_workers_exit_on_shutdown():
+    done = threading.Event()
+    pool = TranscodePool(lambda job: done.set(), workers=3)
+    pool.submit("job")
+    assert done.wait(2)
+    # Every worker was started with the first job and is now idle, waiting on the queue
+    assert len(pool._threads) == 3
+    assert all(thread.is_alive() for thread in pool._threads)
+    
+    pool.shutdown()
+    for thread in pool._threads:
+        thread.join(timeout=2)
+        assert not thread.is_alive()
@@ -1,18 +1,3472 @@
-import tkinter as tk
-from tkinter import ttk, filedialog, messagebox
 import threading
 import os
 import sys
-import yt_dlp
-import pygame
-from PIL import Image, ImageTk
+import argparse
+import importlib
 import io
-import urllib.request
+import urllib.parse
 import time
 import queue
 import webbrowser
+import collections
+import contextlib
+import copy
+import hashlib
+import heapq
+import itertools
+import json
+import logging
+import random
+import re
+import shutil
+import sqlite3
+import subprocess
 from datetime import datetime
 
+# Diagnostics from worker threads and optional subsystems; stdout is kept for the batch CLI's JSON lines
+logger = logging.getLogger("youtube_music_downloader")
+
+# Progress bus job ids for the Download tab's direct download, the queue (status line and new rows),
+# search results and loaded thumbnails
+DIRECT_DOWNLOAD_JOB = "direct"
+QUEUE_STATUS_JOB = "queue"
+SEARCH_JOB = "search"
+THUMBNAILS_JOB = "thumbnails"
+
+class _LazyModule:
+    """Module proxy that imports the real module on first attribute access"""
+    
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+    
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+
+# yt-dlp is the slowest import, and headless use of the engine never needs Tk, pygame or PIL
+yt_dlp = _LazyModule("yt_dlp")
+# Only previews, thumbnails and the metrics endpoint use these, and they pull in the email package
+http_client = _LazyModule("http.client")
+urllib_request = _LazyModule("urllib.request")
+http_server = _LazyModule("http.server")
+# Only loaded when profiling is switched on
+cProfile = _LazyModule("cProfile")
+pstats = _LazyModule("pstats")
+tracemalloc = _LazyModule("tracemalloc")
+tk = _LazyModule("tkinter")
+ttk = _LazyModule("tkinter.ttk")
+filedialog = _LazyModule("tkinter.filedialog")
+messagebox = _LazyModule("tkinter.messagebox")
+pygame = _LazyModule("pygame")
+Image = _LazyModule("PIL.Image")
+ImageTk = _LazyModule("PIL.ImageTk")
+
+# Number of search results fetched per page
+SEARCH_PAGE_SIZE = 10
+
+# Per-user location for the queue journal and other app state
+APP_DATA_DIR = os.path.join(os.path.expanduser("~"), ".youtube_music_downloader")
+
+YOUTUBE_ID_RE = re.compile(
+    r"(?:youtube\.com/(?:watch\?(?:.*&)?v=|embed/|shorts/|live/|v/)|youtu\.be/)([0-9A-Za-z_-]{11})")
+
+
+def extract_video_id(url):
+    """Return the YouTube video id in a URL, or None if it isn't a video URL"""
+    match = YOUTUBE_ID_RE.search(url)
+    return match.group(1) if match else None
+
+
+PLAYLIST_URL_RE = re.compile(r"youtube\.com/(?:playlist\?|@|channel/|c/|user/)|[?&]list=")
+
+
+def is_playlist_url(url):
+    """Return True for YouTube playlist and channel URLs (queued entry by entry)"""
+    return bool(PLAYLIST_URL_RE.search(url))
+
+
+class DownloadQueue:
+    """Indexed priority queue of pending download items keyed by item id (O(log n) updates, O(1) lookups)"""
+    
+    def __init__(self):
+        self._heap = []  # [rank, item_id] pairs
+        self._pos = {}  # item_id -> index in self._heap
+        self._items = {}  # item_id -> item dict
+        self._next_rank = itertools.count()
+        self._top_rank = 0
+    
+    def __len__(self):
+        return len(self._heap)
+    
+    def __contains__(self, item_id):
+        return item_id in self._pos
+    
+    def get(self, item_id):
+        return self._items.get(item_id)
+    
+    def push(self, item, rank=None):
+        """Add an item at the back of the queue (or at an explicit rank)"""
+        item_id = item["id"]
+        if item_id in self._pos:
+            raise ValueError(f"Item already queued: {item_id}")
+        if rank is None:
+            rank = next(self._next_rank)
+        self._items[item_id] = item
+        self._heap.append([rank, item_id])
+        self._pos[item_id] = len(self._heap) - 1
+        self._sift_up(len(self._heap) - 1)
+    
+    def pop(self):
+        """Remove and return the item with the lowest rank"""
+        if not self._heap:
+            raise IndexError("pop from an empty queue")
+        return self.remove(self._heap[0][1])
+    
+    def remove(self, item_id):
+        """Remove an item by id and return it"""
+        index = self._pos.pop(item_id)
+        last = self._heap.pop()
+        if index < len(self._heap):
+            self._heap[index] = last
+            self._pos[last[1]] = index
+            self._sift_up(index)
+            self._sift_down(self._pos[last[1]])
+        return self._items.pop(item_id)
+    
+    def set_rank(self, item_id, rank):
+        """Change the rank of a queued item"""
+        index = self._pos[item_id]
+        self._heap[index][0] = rank
+        self._sift_up(index)
+        self._sift_down(self._pos[item_id])
+    
+    def rank(self, item_id):
+        return self._heap[self._pos[item_id]][0]
+    
+    def move_to_top(self, item_id):
+        """Make an item the next one to run"""
+        self._top_rank -= 1
+        self.set_rank(item_id, self._top_rank)
+    
+    def swap(self, first_id, second_id):
+        """Exchange the positions of two queued items"""
+        first_rank = self.rank(first_id)
+        self.set_rank(first_id, self.rank(second_id))
+        self.set_rank(second_id, first_rank)
+    
+    def clear(self):
+        """Remove all items and return them in queue order"""
+        items = self.ordered()
+        self._heap.clear()
+        self._pos.clear()
+        self._items.clear()
+        return items
+    
+    def ordered(self):
+        """Return all items in the order they will run"""
+        return [self._items[item_id] for rank, item_id in sorted(self._heap)]
+    
+    def _swap_entries(self, i, j):
+        heap = self._heap
+        heap[i], heap[j] = heap[j], heap[i]
+        self._pos[heap[i][1]] = i
+        self._pos[heap[j][1]] = j
+    
+    def _sift_up(self, index):
+        heap = self._heap
+        while index > 0:
+            parent = (index - 1) // 2
+            if heap[index] < heap[parent]:
+                self._swap_entries(index, parent)
+                index = parent
+            else:
+                break
+    
+    def _sift_down(self, index):
+        heap = self._heap
+        size = len(heap)
+        while True:
+            smallest = index
+            for child in (2 * index + 1, 2 * index + 2):
+                if child < size and heap[child] < heap[smallest]:
+                    smallest = child
+            if smallest == index:
+                break
+            self._swap_entries(index, smallest)
+            index = smallest
+
+
+class DownloadDispatcher:
+    """Bounded worker pool that starts queued jobs as soon as a slot frees"""
+    
+    def __init__(self, handler, max_workers=2, on_change=None):
+        self.handler = handler
+        self.on_change = on_change
+        self._max_workers = max(1, int(max_workers))
+        self._pending = DownloadQueue()
+        self._active = 0
+        self._paused = False
+        self._shutdown = False
+        self._workers = []
+        self._cond = threading.Condition()
+    
+    @property
+    def active_count(self):
+        with self._cond:
+            return self._active
+    
+    @property
+    def pending_count(self):
+        with self._cond:
+            return len(self._pending)
+    
+    @property
+    def paused(self):
+        return self._paused
+    
+    @property
+    def max_workers(self):
+        return self._max_workers
+    
+    def submit(self, item, rank=None):
+        """Queue an item and wake a worker if a slot is free"""
+        with self._cond:
+            self._pending.push(item, rank)
+            self._spawn_workers()
+            self._cond.notify()
+        self._notify_change()
+    
+    def is_pending(self, item_id):
+        with self._cond:
+            return item_id in self._pending
+    
+    def remove(self, item_id):
+        """Drop a pending item; returns None if it already started"""
+        with self._cond:
+            if item_id not in self._pending:
+                return None
+            item = self._pending.remove(item_id)
+        self._notify_change()
+        return item
+    
+    def move_to_top(self, item_id):
+        """Make a pending item the next one to start"""
+        with self._cond:
+            if item_id not in self._pending:
+                return False
+            self._pending.move_to_top(item_id)
+        return True
+    
+    def swap(self, first_id, second_id):
+        """Exchange the start order of two pending items"""
+        with self._cond:
+            if first_id not in self._pending or second_id not in self._pending:
+                return False
+            self._pending.swap(first_id, second_id)
+        return True
+    
+    def set_max_workers(self, max_workers):
+        """Change the number of jobs allowed to run at the same time"""
+        with self._cond:
+            self._max_workers = max(1, int(max_workers))
+            self._spawn_workers()
+            self._cond.notify_all()
+        self._notify_change()
+    
+    def pause(self):
+        """Stop starting new jobs (running jobs are not interrupted)"""
+        with self._cond:
+            self._paused = True
+        self._notify_change()
+    
+    def resume(self):
+        """Start handing out pending jobs again"""
+        with self._cond:
+            self._paused = False
+            self._cond.notify_all()
+        self._notify_change()
+    
+    def clear(self):
+        """Drop all pending jobs and return them"""
+        with self._cond:
+            items = self._pending.clear()
+        self._notify_change()
+        return items
+    
+    def shutdown(self):
+        """Let the workers exit once their current job is done"""
+        with self._cond:
+            self._shutdown = True
+            self._cond.notify_all()
+    
+    def _spawn_workers(self):
+        # Called with the lock held; workers are created lazily up to the limit
+        while len(self._workers) < self._max_workers:
+            worker = threading.Thread(target=self._worker, daemon=True)
+            self._workers.append(worker)
+            worker.start()
+    
+    def _can_start(self):
+        return not self._paused and len(self._pending) > 0 and self._active < self._max_workers
+    
+    def _worker(self):
+        while True:
+            with self._cond:
+                while not self._shutdown and not self._can_start():
+                    self._cond.wait()
+                if self._shutdown:
+                    return
+                item = self._pending.pop()
+                self._active += 1
+            self._notify_change()
+            
+            try:
+                self.handler(item)
+            except Exception:
+                # The handler reports its own errors; keep the worker alive
+                pass
+            finally:
+                with self._cond:
+                    self._active -= 1
+                    self._cond.notify()
+                self._notify_change()
+    
+    def _notify_change(self):
+        if self.on_change:
+            self.on_change()
+
+
+class InfoCache:
+    """LRU cache of sanitized yt-dlp info dicts keyed by video id, with a TTL and an optional copy on disk"""
+    
+    def __init__(self, max_entries=256, ttl=1800, persist_dir=None):
+        self.max_entries = max_entries
+        # Well below the lifetime of YouTube's signed stream URLs (about 6 hours)
+        self.ttl = ttl
+        self.persist_dir = persist_dir
+        self._entries = collections.OrderedDict()  # video_id -> (info, stored_at)
+        self._lock = threading.Lock()
+        
+        if persist_dir and not os.path.exists(persist_dir):
+            os.makedirs(persist_dir)
+    
+    def get(self, video_id):
+        """Return a copy of the cached info for a video id, or None"""
+        if not video_id:
+            return None
+        
+        with self._lock:
+            entry = self._entries.get(video_id)
+            if entry:
+                if time.time() - entry[1] < self.ttl:
+                    self._entries.move_to_end(video_id)
+                    return copy.deepcopy(entry[0])
+                del self._entries[video_id]
+        
+        entry = self._load(video_id)
+        if entry is None:
+            return None
+        with self._lock:
+            self._store(video_id, entry)
+        return copy.deepcopy(entry[0])
+    
+    def put(self, info):
+        """Cache an info dict returned by extract_info(download=False)"""
+        video_id = info.get('id')
+        if not video_id or info.get('_type', 'video') != 'video':
+            # Playlists and id-less results are not worth caching
+            return
+        
+        info = yt_dlp.YoutubeDL.sanitize_info(info, remove_private_keys=True)
+        entry = (info, time.time())
+        with self._lock:
+            self._store(video_id, entry)
+        self._save(video_id, info)
+    
+    def invalidate(self, video_id):
+        """Forget a video (e.g. after its stream URLs stopped working)"""
+        with self._lock:
+            self._entries.pop(video_id, None)
+        path = self._path(video_id)
+        if path and os.path.exists(path):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+    
+    def _store(self, video_id, entry):
+        # Called with the lock held
+        self._entries[video_id] = entry
+        self._entries.move_to_end(video_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+    
+    def _path(self, video_id):
+        if not self.persist_dir:
+            return None
+        return os.path.join(self.persist_dir, f"{video_id}.json")
+    
+    def _load(self, video_id):
+        path = self._path(video_id)
+        if not path:
+            return None
+        try:
+            stored_at = os.path.getmtime(path)
+            if time.time() - stored_at >= self.ttl:
+                os.remove(path)
+                return None
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f), stored_at
+        except (OSError, ValueError):
+            return None
+    
+    def _save(self, video_id, info):
+        path = self._path(video_id)
+        if not path:
+            return
+        try:
+            # Write to a temporary file first so readers never see half an entry
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(info, f)
+            os.replace(tmp_path, path)
+            self._prune_disk()
+        except (OSError, TypeError, ValueError):
+            pass
+    
+    def _prune_disk(self):
+        # Keep the on-disk cache to the same bound as the in-memory one
+        files = [entry for entry in os.scandir(self.persist_dir) if entry.name.endswith(".json")]
+        if len(files) <= self.max_entries:
+            return
+        files.sort(key=lambda entry: entry.stat().st_mtime)
+        for entry in files[:len(files) - self.max_entries]:
+            os.remove(entry.path)
+
+
+def normalize_query(query):
+    """Normalize a search query so trivially different spellings share a cache entry"""
+    return " ".join(query.lower().split())
+
+
+class SearchResults:
+    """Results of one search query, pulled a page at a time from yt-dlp's lazy entries"""
+    
+    def __init__(self, query, session_pool, opts, browser=None):
+        self.query = query
+        self.results = []
+        self.exhausted = False
+        self.created = time.time()
+        self._session_pool = session_pool
+        self._opts = opts
+        self._browser = browser
+        self._session = None
+        self._entries = None
+        self._lock = threading.Lock()
+    
+    def fetch(self, start, count, on_result=None):
+        """Fetch results[start:start + count], calling on_result(index, result) for each; returns the count available"""
+        with self._lock:
+            for index in range(start, min(start + count, len(self.results))):
+                if on_result:
+                    on_result(index, self.results[index])
+            
+            try:
+                while not self.exhausted and len(self.results) < start + count:
+                    if self._entries is None:
+                        self._start()
+                    
+                    entry = next(self._entries, None)
+                    if entry is None:
+                        self.exhausted = True
+                        self._finish()
+                        break
+                    
+                    result = {
+                        'id': entry.get('id', ''),
+                        'title': entry.get('title', 'Unknown'),
+                        'duration': entry.get('duration', 0),
+                        'channel': entry.get('channel', 'Unknown'),
+                        'url': entry.get('url', ''),
+                        'thumbnails': entry.get('thumbnails') or [],
+                    }
+                    self.results.append(result)
+                    if on_result:
+                        on_result(len(self.results) - 1, result)
+            except Exception as e:
+                # Start over on the next call, skipping the results we already have
+                self._finish(e)
+                raise
+            
+            return len(self.results)
+    
+    def _start(self):
+        self._session = self._session_pool.acquire(self._opts, browser=self._browser)
+        info = self._session.ydl.extract_info(f"ytsearchall:{self.query}", download=False, process=False)
+        entries = (entry for entry in (info or {}).get('entries') or [] if entry)
+        self._entries = itertools.islice(entries, len(self.results), None)
+    
+    def _finish(self, error=None):
+        self._entries = None
+        if self._session:
+            self._session_pool.release(self._session, error)
+            self._session = None
+    
+    def close(self):
+        """Give the held session back to the pool"""
+        with self._lock:
+            self._finish()
+
+
+class SearchCache:
+    """LRU of SearchResults keyed by normalized query, with a TTL"""
+    
+    def __init__(self, session_pool, max_entries=32, ttl=900):
+        self.session_pool = session_pool
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, query, opts, browser=None):
+        """Return the cached results for a query, or a new (empty) result set"""
+        key = (normalize_query(query), browser)
+        evicted = []
+        with self._lock:
+            results = self._entries.get(key)
+            if results and time.time() - results.created >= self.ttl:
+                evicted.append(self._entries.pop(key))
+                results = None
+            if results is None:
+                results = SearchResults(key[0], self.session_pool, opts, browser)
+                self._entries[key] = results
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                evicted.append(self._entries.popitem(last=False)[1])
+        
+        for old in evicted:
+            old.close()
+        return results
+    
+    def clear(self):
+        with self._lock:
+            evicted = list(self._entries.values())
+            self._entries.clear()
+        for old in evicted:
+            old.close()
+
+
+class ProgressBus:
+    """Thread-safe store of the latest progress state per job, drained by the UI once per tick"""
+    
+    def __init__(self, interval_ms=100):
+        self.interval_ms = interval_ms
+        self._dirty = {}  # job_id -> fields changed since the last drain
+        self._lock = threading.Lock()
+    
+    def publish(self, job_id, **fields):
+        """Record new state for a job (safe to call from any thread)"""
+        with self._lock:
+            self._dirty.setdefault(job_id, {}).update(fields)
+    
+    def append(self, job_id, field, item):
+        """Add item to a list field that collects every value until the next drain (safe from any thread)"""
+        with self._lock:
+            self._dirty.setdefault(job_id, {}).setdefault(field, []).append(item)
+    
+    def drain(self):
+        """Return and reset the changes accumulated since the last drain"""
+        with self._lock:
+            dirty, self._dirty = self._dirty, {}
+        return dirty
+    
+    def attach(self, root, callback):
+        """Flush changes to callback(updates) on the Tk thread at a fixed rate"""
+        def tick():
+            updates = self.drain()
+            if updates:
+                try:
+                    callback(updates)
+                except Exception:
+                    logger.exception("Progress update failed")
+            root.after(self.interval_ms, tick)
+        
+        root.after(self.interval_ms, tick)
+
+
+class QueueJournal:
+    """Write-ahead journal of queue items and their state transitions, committed to SQLite in batches"""
+    
+    UNFINISHED_STATES = ("queued", "downloading", "converting", "retrying")
+    
+    def __init__(self, path, flush_interval=0.5, batch_size=500, keep_days=7):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._records = queue.Queue()
+        
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        
+        # Create the schema and prune old finished items before the writer starts
+        conn = self._connect()
+        try:
+            with conn:
+                conn.executescript("""
+                    CREATE TABLE IF NOT EXISTS items (
+                        id TEXT PRIMARY KEY,
+                        seq INTEGER,
+                        url TEXT,
+                        title TEXT,
+                        format TEXT,
+                        quality TEXT,
+                        output_dir TEXT,
+                        added TEXT,
+                        state TEXT,
+                        error TEXT,
+                        updated REAL
+                    );
+                    CREATE TABLE IF NOT EXISTS transitions (
+                        item_id TEXT,
+                        state TEXT,
+                        at REAL,
+                        error TEXT
+                    );
+                    CREATE INDEX IF NOT EXISTS items_state ON items (state);
+                """)
+                cutoff = time.time() - keep_days * 86400
+                placeholders = ", ".join("?" * len(self.UNFINISHED_STATES))
+                conn.execute(
+                    "DELETE FROM transitions WHERE item_id IN "
+                    f"(SELECT id FROM items WHERE state NOT IN ({placeholders}) AND updated < ?)",
+                    self.UNFINISHED_STATES + (cutoff,))
+                conn.execute(f"DELETE FROM items WHERE state NOT IN ({placeholders}) AND updated < ?",
+                             self.UNFINISHED_STATES + (cutoff,))
+        finally:
+            conn.close()
+        
+        self._writer_thread = threading.Thread(target=self._writer, daemon=True)
+        self._writer_thread.start()
+    
+    def _connect(self):
+        conn = sqlite3.connect(self.path)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+    
+    def record_queued(self, item):
+        """Journal a newly queued item"""
+        self._records.put(("queued", dict(item), time.time()))
+    
+    def record_state(self, item_id, state, error=None):
+        """Journal a state transition (downloading, converting, retrying, completed, failed)"""
+        self._records.put((state, {"id": item_id, "error": error}, time.time()))
+    
+    def record_removed(self, item_id):
+        """Forget an item that was taken off the queue before it finished"""
+        self._records.put(("removed", {"id": item_id}, time.time()))
+    
+    def load_unfinished(self):
+        """Return items that were queued or in progress, in the order they were added"""
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                "SELECT id, url, title, format, quality, output_dir, added, state FROM items "
+                f"WHERE state IN ({', '.join('?' * len(self.UNFINISHED_STATES))}) ORDER BY seq",
+                self.UNFINISHED_STATES).fetchall()
+        finally:
+            conn.close()
+        
+        keys = ("id", "url", "title", "format", "quality", "output_dir", "added", "state")
+        return [dict(zip(keys, row)) for row in rows]
+    
+    def flush(self, timeout=None):
+        """Block until every record handed to the journal is committed"""
+        done = threading.Event()
+        self._records.put(("flush", done, None))
+        return done.wait(timeout)
+    
+    def close(self, timeout=5):
+        """Commit outstanding records and stop the writer thread"""
+        self._records.put(("close", None, None))
+        self._writer_thread.join(timeout)
+    
+    def _writer(self):
+        conn = self._connect()
+        seq = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM items").fetchone()[0]
+        running = True
+        
+        while running:
+            # Block for the first record, then gather whatever arrives within the flush interval
+            batch = [self._records.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size and batch[-1][0] not in ("flush", "close"):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._records.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            
+            waiters = []
+            try:
+                with conn:
+                    for kind, data, at in batch:
+                        if kind == "flush":
+                            waiters.append(data)
+                        elif kind == "close":
+                            running = False
+                        elif kind == "queued":
+                            seq += 1
+                            conn.execute(
+                                "INSERT OR REPLACE INTO items "
+                                "(id, seq, url, title, format, quality, output_dir, added, state, error, updated) "
+                                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, 'queued', NULL, ?)",
+                                (data["id"], seq, data.get("url"), data.get("title"), data.get("format"),
+                                 data.get("quality"), data.get("output_dir"), data.get("added"), at))
+                            conn.execute("INSERT INTO transitions VALUES (?, 'queued', ?, NULL)",
+                                         (data["id"], at))
+                        elif kind == "removed":
+                            conn.execute("DELETE FROM items WHERE id = ?", (data["id"],))
+                            conn.execute("DELETE FROM transitions WHERE item_id = ?", (data["id"],))
+                        else:
+                            conn.execute("UPDATE items SET state = ?, error = ?, updated = ? WHERE id = ?",
+                                         (kind, data.get("error"), at, data["id"]))
+                            conn.execute("INSERT INTO transitions VALUES (?, ?, ?, ?)",
+                                         (data["id"], kind, at, data.get("error")))
+            except sqlite3.Error as e:
+                logger.error("Queue journal write failed: %s", e)
+            finally:
+                for waiter in waiters:
+                    waiter.set()
+        
+        conn.close()
+
+
+class LibraryIndex:
+    """Persistent index of the audio files in the library folders, keyed by path"""
+    
+    AUDIO_EXTENSIONS = (".mp3", ".m4a")
+    COLUMNS = ("path", "title", "mtime", "size", "duration", "bitrate", "codec")
+    
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._known_tags = {}
+        
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        
+        # One shared connection; every access goes through self._lock
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        if path != ":memory:":
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+        with self._conn:
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS tracks (
+                    path TEXT PRIMARY KEY,
+                    directory TEXT,
+                    title TEXT,
+                    mtime REAL,
+                    size INTEGER,
+                    duration REAL,
+                    bitrate INTEGER,
+                    codec TEXT,
+                    probed INTEGER DEFAULT 0
+                );
+                CREATE INDEX IF NOT EXISTS tracks_directory ON tracks (directory);
+            """)
+    
+    @staticmethod
+    def _title(path):
+        return os.path.splitext(os.path.basename(path))[0]
+    
+    def _row(self, values):
+        return dict(zip(self.COLUMNS, values))
+    
+    def tracks(self, directory):
+        """Return the indexed tracks of a folder, sorted by title"""
+        directory = os.path.abspath(directory)
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT path, title, mtime, size, duration, bitrate, codec FROM tracks "
+                "WHERE directory = ? ORDER BY title COLLATE NOCASE", (directory,)).fetchall()
+        return [self._row(row) for row in rows]
+    
+    def _list_files(self, directory):
+        files = {}
+        if not os.path.isdir(directory):
+            return files
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                name = entry.name
+                if name.lower().endswith(self.AUDIO_EXTENSIONS) and name != "preview.mp3" and entry.is_file():
+                    stat = entry.stat()
+                    files[entry.path] = (stat.st_mtime, stat.st_size)
+        return files
+    
+    def scan(self, directory):
+        """Bring a folder's index up to date and return {"added": [track], "changed": [track], "removed": [path]}"""
+        directory = os.path.abspath(directory)
+        files = self._list_files(directory)
+        
+        with self._lock:
+            known = {path: (mtime, size) for path, mtime, size in self._conn.execute(
+                "SELECT path, mtime, size FROM tracks WHERE directory = ?", (directory,))}
+            
+            added = sorted((path for path in files if path not in known), key=lambda path: self._title(path).lower())
+            changed = [path for path in files if path in known and known[path] != files[path]]
+            removed = [path for path in known if path not in files]
+            
+            tags = {path: self._known_tags.pop(path, None) for path in added + changed}
+            
+            with self._conn:
+                self._conn.executemany("DELETE FROM tracks WHERE path = ?", [(path,) for path in removed])
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO tracks (path, directory, title, mtime, size, duration, bitrate, codec, "
+                    "probed) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    [(path, directory, self._title(path)) + files[path] + (tags[path] or (None, None, None))
+                     + (1 if tags[path] else 0,) for path in added + changed])
+        
+        def track(path):
+            return self._row((path, self._title(path)) + files[path] + (tags[path] or (None, None, None)))
+        
+        return {
+            "added": [track(path) for path in added],
+            "changed": [track(path) for path in changed],
+            "removed": removed,
+        }
+    
+    def remember_tags(self, path, duration=None, bitrate=None, codec=None):
+        """Keep the tags of a file we just wrote so the next scan needn't probe it"""
+        with self._lock:
+            self._known_tags[os.path.abspath(path)] = (duration, bitrate, codec)
+    
+    @staticmethod
+    def probe_tags(path):
+        """Return (duration, bitrate in kbps, codec) read with ffprobe"""
+        result = subprocess.run(
+            ["ffprobe", "-v", "error", "-select_streams", "a:0",
+             "-show_entries", "format=duration,bit_rate:stream=codec_name", "-of", "json", path],
+            capture_output=True, text=True, timeout=30)
+        data = json.loads(result.stdout or "{}")
+        fmt = data.get("format") or {}
+        stream = (data.get("streams") or [{}])[0]
+        duration = float(fmt["duration"]) if fmt.get("duration") else None
+        bitrate = int(fmt["bit_rate"]) // 1000 if fmt.get("bit_rate") else None
+        return duration, bitrate, stream.get("codec_name")
+    
+    def fill_tags(self, directory, batch_size=100):
+        """Probe files that have no tags yet, yielding the updated tracks batch by batch"""
+        if not shutil.which("ffprobe"):
+            return
+        directory = os.path.abspath(directory)
+        
+        while True:
+            with self._lock:
+                pending = self._conn.execute(
+                    "SELECT path, title, mtime, size FROM tracks WHERE directory = ? AND probed = 0 LIMIT ?",
+                    (directory, batch_size)).fetchall()
+            if not pending:
+                return
+            
+            updates = []
+            for path, title, mtime, size in pending:
+                try:
+                    tags = self.probe_tags(path)
+                except Exception:
+                    # Unreadable file; keep it listed without tags
+                    tags = (None, None, None)
+                updates.append((path, title, mtime, size) + tags)
+            
+            with self._lock, self._conn:
+                self._conn.executemany(
+                    "UPDATE tracks SET duration = ?, bitrate = ?, codec = ?, probed = 1 WHERE path = ?",
+                    [row[4:] + (row[0],) for row in updates])
+            yield [self._row(row) for row in updates]
+    
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class DownloadArchive:
+    """Record of finished downloads keyed by (video id, audio format), held in memory"""
+    
+    def __init__(self, path, verify_files=False):
+        self.path = path
+        self.verify_files = verify_files
+        self._lock = threading.Lock()
+        
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        if path != ":memory:":
+            self._conn.execute("PRAGMA journal_mode=WAL")
+        with self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS archive (
+                    video_id TEXT,
+                    format TEXT,
+                    path TEXT,
+                    size INTEGER,
+                    sha256 TEXT,
+                    added REAL,
+                    mtime_ns INTEGER,
+                    PRIMARY KEY (video_id, format)
+                )
+            """)
+            # Archives written before mtimes were recorded get verified once more
+            if "mtime_ns" not in {row[1] for row in self._conn.execute("PRAGMA table_info(archive)")}:
+                self._conn.execute("ALTER TABLE archive ADD COLUMN mtime_ns INTEGER")
+        self._entries = {(video_id, audio_format): (path, size, sha256, mtime_ns)
+                         for video_id, audio_format, path, size, sha256, mtime_ns in self._conn.execute(
+                             "SELECT video_id, format, path, size, sha256, mtime_ns FROM archive")}
+    
+    def __len__(self):
+        return len(self._entries)
+    
+    @staticmethod
+    def file_hash(path, chunk_size=1024 * 1024):
+        """Return the SHA-256 hex digest of a file"""
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+    
+    def contains(self, video_id, audio_format):
+        """Return True if this video was already downloaded in this format"""
+        entry = self._entries.get((video_id, audio_format))
+        if entry is None:
+            return False
+        
+        path, size, sha256, mtime_ns = entry
+        try:
+            stat = os.stat(path)
+            if stat.st_size != size:
+                return False
+            # Titles can collide, so another song may have been written to this path since; files
+            # are only hashed again if their mtime changed since they were last verified
+            if self.verify_files and sha256 and stat.st_mtime_ns != mtime_ns:
+                if self.file_hash(path) != sha256:
+                    return False
+                self._set_verified(video_id, audio_format, entry, stat.st_mtime_ns)
+        except OSError:
+            # The file was deleted or moved; allow downloading it again
+            return False
+        return True
+    
+    def _set_verified(self, video_id, audio_format, entry, mtime_ns):
+        with self._lock:
+            self._entries[(video_id, audio_format)] = entry[:3] + (mtime_ns,)
+            with self._conn:
+                self._conn.execute("UPDATE archive SET mtime_ns = ? WHERE video_id = ? AND format = ?",
+                                   (mtime_ns, video_id, audio_format))
+    
+    def add(self, video_id, audio_format, path):
+        """Archive a finished download"""
+        stat = os.stat(path)
+        sha256 = self.file_hash(path) if self.verify_files else None
+        with self._lock:
+            self._entries[(video_id, audio_format)] = (path, stat.st_size, sha256, stat.st_mtime_ns)
+            with self._conn:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO archive (video_id, format, path, size, sha256, added, mtime_ns) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (video_id, audio_format, path, stat.st_size, sha256, time.time(), stat.st_mtime_ns))
+    
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class MediaCache:
+    """Size-capped LRU folder of per-video files (previews, thumbnails), with recency kept in each file's mtime"""
+    
+    VIDEO_ID_RE = re.compile(r"[0-9A-Za-z_-]{11}")
+    
+    def __init__(self, directory, max_size=200 * 1024 * 1024):
+        self.directory = directory
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._entries = {}  # video_id -> [path, size, last used]
+        
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                video_id, ext = os.path.splitext(entry.name)
+                if ext == ".part":
+                    # Left over from an interrupted write
+                    os.remove(entry.path)
+                elif self.VIDEO_ID_RE.fullmatch(video_id) and entry.is_file():
+                    stat = entry.stat()
+                    self._entries[video_id] = [entry.path, stat.st_size, stat.st_mtime]
+    
+    @property
+    def size(self):
+        with self._lock:
+            return sum(entry[1] for entry in self._entries.values())
+    
+    def get(self, video_id):
+        """Return the cached file of a video, or None"""
+        with self._lock:
+            entry = self._entries.get(video_id)
+            if entry is None:
+                return None
+            if not os.path.exists(entry[0]):
+                del self._entries[video_id]
+                return None
+            entry[2] = time.time()
+        try:
+            os.utime(entry[0])
+        except OSError:
+            pass
+        return entry[0]
+    
+    def part_path(self, video_id, ext):
+        """Return the path a new file is written to before add()"""
+        if not self.VIDEO_ID_RE.fullmatch(video_id):
+            raise ValueError(f"Not a video id: {video_id}")
+        return os.path.join(self.directory, f"{video_id}.{ext}.part")
+    
+    def add(self, video_id, part_path):
+        """Move a finished file into the cache and evict old ones"""
+        path = part_path[:-len(".part")]
+        os.replace(part_path, path)
+        with self._lock:
+            self._entries[video_id] = [path, os.path.getsize(path), time.time()]
+            total = sum(entry[1] for entry in self._entries.values())
+            for old_id, (old_path, size, used) in sorted(self._entries.items(), key=lambda item: item[1][2]):
+                if total <= self.max_size:
+                    break
+                if old_id == video_id:
+                    continue
+                try:
+                    os.remove(old_path)
+                except OSError:
+                    pass
+                del self._entries[old_id]
+                total -= size
+        return path
+
+
+class ThumbnailLoader:
+    """Fetches thumbnails on worker threads and shrinks them to small PNGs, cached on disk"""
+    
+    def __init__(self, cache, size=(80, 45), workers=4):
+        self.cache = cache
+        self.size = size
+        self.workers = workers
+        self._queue = queue.LifoQueue()
+        self._callbacks = {}
+        self._lock = threading.Lock()
+        self._threads = []
+        # Videos whose thumbnail couldn't be loaded aren't tried again this session
+        self._failed = set()
+        self._decoder_missing = False
+    
+    @staticmethod
+    def thumbnail_url(entry, min_width=120):
+        """Pick the smallest thumbnail of a search entry that is at least min_width wide"""
+        thumbnails = [thumb for thumb in entry.get('thumbnails') or [] if thumb.get('url')]
+        wide_enough = [thumb for thumb in thumbnails if (thumb.get('width') or 0) >= min_width]
+        if wide_enough:
+            return min(wide_enough, key=lambda thumb: thumb['width'])['url']
+        if thumbnails:
+            return thumbnails[-1]['url']
+        if entry.get('id'):
+            return f"https://i.ytimg.com/vi/{entry['id']}/mqdefault.jpg"
+        return None
+    
+    def request(self, video_id, url, callback):
+        """Load a thumbnail in the background; duplicate requests share one load"""
+        # callback(video_id, png_bytes or None) runs on a worker; the newest requests (rows on screen) go first
+        with self._lock:
+            if video_id in self._failed:
+                return
+            if video_id in self._callbacks:
+                self._callbacks[video_id].append(callback)
+                return
+            self._callbacks[video_id] = [callback]
+            if len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._worker, daemon=True)
+                thread.start()
+                self._threads.append(thread)
+        self._queue.put((video_id, url))
+    
+    def _worker(self):
+        connections = {}
+        while True:
+            video_id, url = self._queue.get()
+            try:
+                data = self._load(video_id, url, connections)
+            except ImportError as e:
+                # Without PIL only cached thumbnails can be shown
+                if not self._decoder_missing:
+                    logger.warning("Thumbnails need Pillow: %s", e)
+                self._decoder_missing = True
+                data = None
+            except Exception as e:
+                logger.info("Thumbnail failed for %s: %s", video_id, e)
+                data = None
+            with self._lock:
+                callbacks = self._callbacks.pop(video_id, [])
+                if data is None:
+                    self._failed.add(video_id)
+            for callback in callbacks:
+                callback(video_id, data)
+    
+    def _load(self, video_id, url, connections):
+        cacheable = self.cache is not None and MediaCache.VIDEO_ID_RE.fullmatch(video_id)
+        path = self.cache.get(video_id) if cacheable else None
+        if path:
+            with open(path, "rb") as f:
+                return f.read()
+        if not url or self._decoder_missing:
+            return None
+        
+        data = self._downscale(self._fetch(url, connections))
+        if cacheable:
+            part_path = self.cache.part_path(video_id, "png")
+            with open(part_path, "wb") as f:
+                f.write(data)
+            self.cache.add(video_id, part_path)
+        return data
+    
+    def _fetch(self, url, connections):
+        """GET url over this worker's keep-alive connection to its host"""
+        parts = urllib.parse.urlsplit(url)
+        key = (parts.scheme, parts.netloc)
+        path = parts.path + (f"?{parts.query}" if parts.query else "")
+        for attempt in range(2):
+            connection = connections.get(key)
+            if connection is None:
+                connection_class = http_client.HTTPSConnection if parts.scheme == "https" else http_client.HTTPConnection
+                connection = connections[key] = connection_class(parts.netloc, timeout=10)
+            try:
+                connection.request("GET", path, headers={"User-Agent": "Mozilla/5.0"})
+                response = connection.getresponse()
+                body = response.read()
+            except (http_client.HTTPException, OSError):
+                # The server closed the idle connection; reconnect once
+                connection.close()
+                del connections[key]
+                if attempt:
+                    raise
+                continue
+            if response.status != 200:
+                raise OSError(f"HTTP {response.status} for {url}")
+            return body
+    
+    def _downscale(self, raw):
+        """Return raw image bytes as a PNG that fits in self.size"""
+        image = Image.open(io.BytesIO(raw))
+        # JPEGs are decoded at 1/2, 1/4 or 1/8 scale when that's still big enough
+        image.draft("RGB", self.size)
+        image = image.convert("RGB")
+        image.thumbnail(self.size)
+        output = io.BytesIO()
+        image.save(output, format="PNG")
+        return output.getvalue()
+
+
+class BrowserCookieCache:
+    """Browser cookies extracted once per browser and shared between sessions until they expire"""
+    
+    def __init__(self, ttl=1800):
+        self.ttl = ttl
+        self._jars = {}  # browser -> (jar, loaded_at, generation)
+        self._generation = itertools.count(1)
+        self._lock = threading.Lock()
+        self._browser_locks = collections.defaultdict(threading.Lock)
+    
+    def get(self, browser):
+        """Return (cookie jar, generation) for a browser, extracting it if needed"""
+        with self._lock:
+            browser_lock = self._browser_locks[browser]
+        
+        # Only one thread extracts a given browser's cookies; the rest wait for it
+        with browser_lock:
+            with self._lock:
+                cached = self._jars.get(browser)
+            if cached and time.monotonic() - cached[1] < self.ttl:
+                return cached[0], cached[2]
+            
+            jar = yt_dlp.cookies.extract_cookies_from_browser(browser)
+            with self._lock:
+                entry = (jar, time.monotonic(), next(self._generation))
+                self._jars[browser] = entry
+            return entry[0], entry[2]
+    
+    def generation(self, browser):
+        """Return the generation of the cached jar, or None if it is missing or stale"""
+        with self._lock:
+            cached = self._jars.get(browser)
+        if cached and time.monotonic() - cached[1] < self.ttl:
+            return cached[2]
+        return None
+    
+    def invalidate(self, browser=None):
+        """Drop cached cookies so the next session re-reads them from the browser"""
+        with self._lock:
+            if browser is None:
+                self._jars.clear()
+            else:
+                self._jars.pop(browser, None)
+
+
+class YoutubeDLSession:
+    """A YoutubeDL instance owned by YoutubeDLPool"""
+    
+    def __init__(self, ydl, key, browser=None, cookie_generation=None):
+        self.ydl = ydl
+        self.key = key
+        self.browser = browser
+        self.cookie_generation = cookie_generation
+        self.progress_hooks = []
+        ydl.add_progress_hook(self._dispatch_progress)
+    
+    def _dispatch_progress(self, d):
+        # The instance is reused, so per-job hooks are swapped in on checkout
+        for hook in self.progress_hooks:
+            hook(d)
+
+
+class YoutubeDLPool:
+    """Pool of pre-configured YoutubeDL sessions keyed by their options, each used by one job at a time"""
+    
+    def __init__(self, cookie_cache=None, max_idle_per_key=4):
+        self.cookie_cache = cookie_cache or BrowserCookieCache()
+        self.max_idle_per_key = max_idle_per_key
+        self._idle = collections.defaultdict(list)
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def _key(opts, browser):
+        return json.dumps(opts, sort_keys=True, default=repr) + f"|{browser}"
+    
+    def _checkout(self, opts, browser):
+        key = self._key(opts, browser)
+        generation = self.cookie_cache.generation(browser) if browser else None
+        
+        with self._lock:
+            idle = self._idle[key]
+            while idle:
+                session = idle.pop()
+                if session.cookie_generation == generation:
+                    return session
+                # Cookies were refreshed since this session was built
+                self._close_session(session)
+        
+        ydl = yt_dlp.YoutubeDL(dict(opts))
+        if browser:
+            jar, generation = self.cookie_cache.get(browser)
+            # Share the already decrypted jar instead of reading the browser again
+            ydl.cookiejar = jar
+        return YoutubeDLSession(ydl, key, browser, generation)
+    
+    def _release(self, session):
+        session.progress_hooks = []
+        with self._lock:
+            idle = self._idle[session.key]
+            if len(idle) < self.max_idle_per_key:
+                idle.append(session)
+                return
+        self._close_session(session)
+    
+    @staticmethod
+    def _close_session(session):
+        try:
+            session.ydl.__exit__(None, None, None)
+        except Exception:
+            pass
+    
+    def acquire(self, opts, progress_hook=None, browser=None):
+        """Check out a session; it must be handed back with release()"""
+        # opts key the pool, so they must not carry progress_hooks or cookiesfrombrowser
+        session = self._checkout(opts, browser)
+        if progress_hook:
+            session.progress_hooks = [progress_hook]
+        return session
+    
+    def release(self, session, error=None):
+        """Return a session to the pool, or drop it if error points at stale cookies"""
+        if session.browser and error is not None and classify_error(error) == "auth":
+            # Cookies may have expired; re-read them for the next job
+            self.cookie_cache.invalidate(session.browser)
+            self._close_session(session)
+        else:
+            self._release(session)
+    
+    @contextlib.contextmanager
+    def session(self, opts, progress_hook=None, browser=None):
+        """Borrow a YoutubeDL configured with opts for the duration of a job"""
+        session = self.acquire(opts, progress_hook, browser)
+        try:
+            yield session.ydl
+        except Exception as e:
+            self.release(session, e)
+            raise
+        else:
+            self.release(session)
+    
+    def close(self):
+        """Close every idle session"""
+        with self._lock:
+            sessions = [session for idle in self._idle.values() for session in idle]
+            self._idle.clear()
+        for session in sessions:
+            self._close_session(session)
+
+
+class StageStats:
+    """Throughput counters for one stage of the download pipeline"""
+    
+    def __init__(self, name):
+        self.name = name
+        self.items = 0
+        self.failed = 0
+        self.bytes = 0
+        self.busy_seconds = 0.0
+        self.active = 0
+        self.started = time.monotonic()
+        self._lock = threading.Lock()
+    
+    @contextlib.contextmanager
+    def track(self):
+        """Count the time spent on one item; the item counts as failed if the block raises"""
+        with self._lock:
+            self.active += 1
+        started = time.monotonic()
+        ok = False
+        try:
+            yield
+            ok = True
+        finally:
+            with self._lock:
+                self.active -= 1
+                self.busy_seconds += time.monotonic() - started
+                if ok:
+                    self.items += 1
+                else:
+                    self.failed += 1
+    
+    def add_bytes(self, nbytes):
+        with self._lock:
+            self.bytes += nbytes
+    
+    def snapshot(self):
+        """Return the counters plus items/min and MB/s since the stage started"""
+        with self._lock:
+            elapsed = max(time.monotonic() - self.started, 1e-6)
+            return {
+                "stage": self.name,
+                "items": self.items,
+                "failed": self.failed,
+                "active": self.active,
+                "bytes": self.bytes,
+                "busy_seconds": round(self.busy_seconds, 3),
+                "items_per_minute": round(self.items * 60 / elapsed, 2),
+                "mb_per_second": round(self.bytes / elapsed / 1024 / 1024, 3),
+            }
+
+
+class MetricsRegistry:
+    """Labelled counters, gauges and histograms, exported as Prometheus text or JSON"""
+    
+    def __init__(self):
+        self._metrics = {}  # name -> {"type", "help", "buckets", "read", "values": {labels: value}}
+        self._lock = threading.Lock()
+    
+    def _declare(self, name, kind, help_text, buckets=None, read=None):
+        with self._lock:
+            self._metrics[name] = {"type": kind, "help": help_text, "buckets": buckets, "read": read,
+                                   "values": {}}
+    
+    def counter(self, name, help_text):
+        self._declare(name, "counter", help_text)
+    
+    def gauge(self, name, help_text, read):
+        self._declare(name, "gauge", help_text, read=read)
+    
+    def histogram(self, name, help_text, buckets):
+        self._declare(name, "histogram", help_text, buckets=tuple(sorted(buckets)))
+    
+    @staticmethod
+    def _key(labels):
+        return tuple(sorted((key, str(value)) for key, value in labels.items()))
+    
+    def inc(self, name, amount=1, **labels):
+        """Add to a counter"""
+        key = self._key(labels)
+        with self._lock:
+            values = self._metrics[name]["values"]
+            values[key] = values.get(key, 0) + amount
+    
+    def observe(self, name, value, **labels):
+        """Record one sample in a histogram"""
+        key = self._key(labels)
+        with self._lock:
+            metric = self._metrics[name]
+            # Per bucket counts (not cumulative), then sum and count
+            sample = metric["values"].setdefault(key, [[0] * len(metric["buckets"]), 0.0, 0])
+            index = next((i for i, bound in enumerate(metric["buckets"]) if value <= bound), None)
+            if index is not None:
+                sample[0][index] += 1
+            sample[1] += value
+            sample[2] += 1
+    
+    def _copy(self):
+        with self._lock:
+            metrics = {name: dict(metric, values=copy.deepcopy(metric["values"]))
+                       for name, metric in self._metrics.items()}
+        for metric in metrics.values():
+            if metric["read"]:
+                try:
+                    metric["values"] = {(): metric["read"]()}
+                except Exception:
+                    logger.exception("Metric read failed")
+        return metrics
+    
+    @staticmethod
+    def _format_labels(labels, extra=()):
+        pairs = list(labels) + list(extra)
+        if not pairs:
+            return ""
+        escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+                   for _, value in pairs)
+        return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + "}"
+    
+    def to_prometheus(self):
+        """Return the metrics in the Prometheus text exposition format"""
+        lines = []
+        for name, metric in self._copy().items():
+            lines.append(f"# HELP {name} {metric['help']}")
+            lines.append(f"# TYPE {name} {metric['type']}")
+            for labels, value in metric["values"].items():
+                if metric["type"] != "histogram":
+                    lines.append(f"{name}{self._format_labels(labels)} {value}")
+                    continue
+                counts, total, count = value
+                cumulative = 0
+                for bound, bucket_count in zip(metric["buckets"], counts):
+                    cumulative += bucket_count
+                    lines.append(f"{name}_bucket{self._format_labels(labels, [('le', bound)])} {cumulative}")
+                lines.append(f"{name}_bucket{self._format_labels(labels, [('le', '+Inf')])} {count}")
+                lines.append(f"{name}_sum{self._format_labels(labels)} {round(total, 6)}")
+                lines.append(f"{name}_count{self._format_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+    
+    def to_json(self):
+        """Return the metrics as a dict of name -> type, help and labelled values"""
+        result = {}
+        for name, metric in self._copy().items():
+            values = []
+            for labels, value in metric["values"].items():
+                entry = {"labels": dict(labels)}
+                if metric["type"] == "histogram":
+                    counts, total, count = value
+                    entry.update(buckets=dict(zip((str(bound) for bound in metric["buckets"]), counts)),
+                                 sum=round(total, 6), count=count)
+                else:
+                    entry["value"] = value
+                values.append(entry)
+            result[name] = {"type": metric["type"], "help": metric["help"], "values": values}
+        return result
+
+
+class MetricsServer:
+    """Local HTTP endpoint serving /metrics (Prometheus text) and /metrics.json"""
+    
+    def __init__(self, prometheus_text, json_dump, port=0, host="127.0.0.1"):
+        routes = {
+            "/metrics": (lambda: prometheus_text().encode(), "text/plain; version=0.0.4; charset=utf-8"),
+            "/metrics.json": (lambda: json.dumps(json_dump(), indent=2).encode(), "application/json"),
+        }
+        
+        class Handler(http_server.BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+            
+            def do_GET(self):
+                route = routes.get(self.path.split("?")[0])
+                if route is None:
+                    self.send_error(404)
+                    return
+                body = route[0]()
+                self.send_response(200)
+                self.send_header("Content-Type", route[1])
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+        
+        self._server = http_server.ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+    
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class TranscodePool:
+    """CPU-bound stage of the pipeline: ffmpeg conversions on their own workers"""
+    
+    def __init__(self, handler, workers=None, queue_size=None):
+        self.handler = handler
+        self.workers = workers or os.cpu_count() or 2
+        self._queue = queue.Queue(maxsize=queue_size or self.workers * 2)
+        self._stopped = threading.Event()
+        self._threads = []
+        self._lock = threading.Lock()
+    
+    @property
+    def depth(self):
+        return self._queue.qsize()
+    
+    def submit(self, job):
+        """Hand a job to the transcode workers, blocking while the queue is full"""
+        with self._lock:
+            # Workers are started with the first job, as the dispatcher's are
+            while len(self._threads) < self.workers and not self._stopped.is_set():
+                thread = threading.Thread(target=self._worker, daemon=True)
+                thread.start()
+                self._threads.append(thread)
+        self._queue.put(job)
+    
+    def shutdown(self):
+        """Stop the workers after their current conversion, without waiting for the queue to drain"""
+        with self._lock:
+            self._stopped.set()
+        # A full queue means every worker is busy and will see the event when its job ends
+        for _ in self._threads:
+            try:
+                self._queue.put_nowait(None)
+            except queue.Full:
+                break
+    
+    def _worker(self):
+        while not self._stopped.is_set():
+            job = self._queue.get()
+            if job is None or self._stopped.is_set():
+                return
+            try:
+                self.handler(job)
+            except Exception:
+                logger.exception("Transcode worker error")
+
+
+class BandwidthLimiter:
+    """Process-wide download rate cap, shared between the running downloads by weight"""
+    
+    # A flow that hasn't read for this long hands its share to the others
+    IDLE_SECONDS = 1.0
+    # Unused share a flow can save up, in seconds of its rate
+    BURST_SECONDS = 0.25
+    
+    def __init__(self, rate=0):
+        self.rate = rate
+        self._flows = {}
+        self._cond = threading.Condition()
+    
+    def set_rate(self, rate):
+        """Change the cap in bytes/s (0 = unlimited)"""
+        with self._cond:
+            self.rate = max(0, int(rate))
+            self._cond.notify_all()
+    
+    def consume(self, key, nbytes, weight=1):
+        """Account nbytes read by flow `key`, blocking while it is over its share"""
+        # Each flow is a token bucket refilled at its share; sleeping here holds back yt-dlp's read loop
+        with self._cond:
+            now = time.monotonic()
+            flow = self._flows.get(key)
+            if flow is None:
+                flow = self._flows[key] = {"tokens": 0.0, "updated": now}
+            flow["weight"] = weight
+            flow["seen"] = now
+            if not self.rate:
+                return
+            
+            flow["tokens"] -= nbytes
+            while self.rate and flow["tokens"] < 0 and key in self._flows:
+                share = self._share(flow, now)
+                flow["tokens"] = min(flow["tokens"] + (now - flow["updated"]) * share,
+                                     share * self.BURST_SECONDS)
+                flow["updated"] = now
+                if flow["tokens"] >= 0:
+                    break
+                self._cond.wait(-flow["tokens"] / share)
+                now = time.monotonic()
+                # Still a live flow while it waits for its turn
+                flow["seen"] = now
+    
+    def release(self, key):
+        """Forget a finished flow so its share goes to the others"""
+        with self._cond:
+            self._flows.pop(key, None)
+            self._cond.notify_all()
+    
+    def _share(self, flow, now):
+        """Bytes/s this flow may use right now"""
+        active = sum(other["weight"] for other in self._flows.values()
+                     if other is flow or now - other["seen"] < self.IDLE_SECONDS)
+        return self.rate * flow["weight"] / active
+
+
+# Failure classes, most specific first; the first pattern that matches wins
+ERROR_PATTERNS = (
+    ("rate_limit", re.compile(r"\b429\b|too many requests|rate[- ]limit", re.IGNORECASE)),
+    ("auth", re.compile(r"\b403\b|forbidden|sign in to confirm|login required|cookies|"
+                        r"age[- ]restricted|members[- ]only", re.IGNORECASE)),
+    # Ahead of "unavailable", whose patterns would match "ffmpeg not found"
+    ("ffmpeg", re.compile(r"ffmpeg|ffprobe|postprocess|conversion failed", re.IGNORECASE)),
+    # Only phrases about the video itself; "requested format is not available" isn't one
+    ("unavailable", re.compile(r"video unavailable|private video|has been removed|"
+                               r"video is (?:not|no longer) available|not made this video available|not available in your country|"
+                               r"copyright|http error 404|unsupported url|"
+                               r"premieres in|live event will begin", re.IGNORECASE)),
+    ("network", re.compile(r"timed? ?out|connection (?:reset|refused|aborted)|remote end closed|"
+                           r"incompleteread|name resolution|network is unreachable|urlopen error|"
+                           r"\b50[0234]\b|bad gateway|service unavailable|"
+                           r"downloaded \d+ bytes, expected|content too short|got error|"
+                           r"did not get any data|unable to download", re.IGNORECASE)),
+)
+
+
+ERROR_CLASS_LABELS = {
+    "rate_limit": "rate limited",
+    "auth": "sign-in required",
+    "unavailable": "unavailable",
+    "ffmpeg": "conversion failed",
+    "network": "network error",
+    "other": "error",
+}
+
+
+def classify_error(error, stage="download"):
+    """Sort a failure (an exception or its message) into rate_limit, auth, unavailable, ffmpeg, network or other"""
+    # Nothing in the transcode stage touches the network, whatever the message says
+    if stage == "transcode":
+        return "ffmpeg"
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return "network"
+    message = str(error)
+    for error_class, pattern in ERROR_PATTERNS:
+        if pattern.search(message):
+            return error_class
+    return "other"
+
+
+class RetryPolicy:
+    """How often and how soon one class of failure is retried"""
+    
+    def __init__(self, retries, base_delay, factor=2.0, max_delay=600.0, jitter=0.5):
+        self.retries = retries
+        self.base_delay = base_delay
+        self.factor = factor
+        self.max_delay = max_delay
+        self.jitter = jitter
+    
+    def delay(self, attempt):
+        """Seconds to wait before retry number `attempt`, or None once retries are used up"""
+        if attempt > self.retries:
+            return None
+        # Jitter keeps jobs that failed together from coming back together
+        delay = min(self.base_delay * self.factor ** (attempt - 1), self.max_delay)
+        return delay * (1 - self.jitter * random.random())
+
+
+class RetryScheduler:
+    """Runs keyed callbacks after a delay from one timer thread"""
+    
+    def __init__(self):
+        self._heap = []  # [due, seq, key] entries
+        self._timers = {}  # key -> (due, seq, callback)
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._closed = False
+    
+    def __len__(self):
+        return len(self._timers)
+    
+    def __contains__(self, key):
+        return key in self._timers
+    
+    def due(self, key):
+        """Return the time.monotonic() at which key's timer fires, or None"""
+        timer = self._timers.get(key)
+        return timer[0] if timer else None
+    
+    def schedule(self, key, delay, callback):
+        """Call callback() in `delay` seconds"""
+        with self._cond:
+            if self._closed:
+                return
+            due, seq = time.monotonic() + delay, next(self._seq)
+            self._timers[key] = (due, seq, callback)
+            heapq.heappush(self._heap, [due, seq, key])
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+            self._cond.notify()
+    
+    def cancel(self, key):
+        """Drop key's timer; returns False if there was none"""
+        with self._cond:
+            # The heap entry is skipped when it comes up
+            return self._timers.pop(key, None) is not None
+    
+    def keys(self):
+        with self._cond:
+            return list(self._timers)
+    
+    def close(self):
+        """Drop every timer and stop the timer thread"""
+        with self._cond:
+            self._closed = True
+            self._timers.clear()
+            self._heap.clear()
+            self._cond.notify()
+    
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._closed:
+                        return
+                    now = time.monotonic()
+                    if self._heap and self._heap[0][0] <= now:
+                        due, seq, key = heapq.heappop(self._heap)
+                        timer = self._timers.get(key)
+                        if timer is None or timer[1] != seq:
+                            # Cancelled or rescheduled
+                            continue
+                        del self._timers[key]
+                        callback = timer[2]
+                        break
+                    self._cond.wait(self._heap[0][0] - now if self._heap else None)
+            try:
+                callback()
+            except Exception:
+                logger.exception("Retry callback failed")
+
+
+class CircuitBreaker:
+    """Pauses the whole queue while YouTube keeps rate-limiting us"""
+    
+    TIMER_KEY = "circuit-breaker"
+    
+    def __init__(self, scheduler, on_open, on_close, threshold=3, window=60.0, cooldown=60.0,
+                 max_cooldown=900.0):
+        self.scheduler = scheduler
+        self.on_open = on_open
+        self.on_close = on_close
+        self.threshold = threshold
+        self.window = window
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.state = "closed"
+        self._cooldown = cooldown
+        self._failures = collections.deque()
+        self._lock = threading.Lock()
+    
+    @property
+    def reopens_in(self):
+        """Seconds until the queue runs again, or None if the breaker isn't open"""
+        due = self.scheduler.due(self.TIMER_KEY)
+        return max(0.0, due - time.monotonic()) if due is not None else None
+    
+    def record(self, error_class):
+        """Note the outcome of a download (error_class None for a success)"""
+        with self._lock:
+            if error_class is None:
+                if self.state == "half-open":
+                    self.state = "closed"
+                    self._cooldown = self.base_cooldown
+                return
+            if error_class != "rate_limit" or self.state == "open":
+                return
+            
+            now = time.monotonic()
+            self._failures.append(now)
+            while self._failures and now - self._failures[0] > self.window:
+                self._failures.popleft()
+            # Half-open, the first download decides: a success closes the breaker (above), another
+            # rate limit opens it again for twice as long; closed, it takes threshold within the window
+            if self.state == "half-open":
+                self._cooldown = min(self._cooldown * 2, self.max_cooldown)
+            elif len(self._failures) < self.threshold:
+                return
+            self.state = "open"
+            self._failures.clear()
+            cooldown = self._cooldown
+        self.scheduler.schedule(self.TIMER_KEY, cooldown, self._half_open)
+        self.on_open(cooldown)
+    
+    def _half_open(self):
+        with self._lock:
+            self.state = "half-open"
+        self.on_close()
+
+
+class ConcurrencyController:
+    """AIMD tuning of how many queued downloads run at once, from the speeds and errors of each window"""
+    
+    # Smallest rise in aggregate speed that justifies a step up
+    MIN_GAIN = 0.1
+    # Per-download speed below this fraction of the previous window counts as a collapse
+    SPEED_DROP = 0.5
+    FAILURE_RATE = 0.25
+    # Windows to wait after a step back or a decrease before probing again
+    HOLD_WINDOWS = 3
+    START_LEVEL = 2
+    
+    def __init__(self, apply, has_demand, interval=5.0):
+        self.apply = apply
+        self.has_demand = has_demand
+        self.interval = interval
+        self.level = None
+        self.ceiling = None
+        self.reason = None
+        self.history = collections.deque(maxlen=50)
+        self._listeners = []
+        self._speeds = {}
+        self._throttled = 0
+        self._failed = 0
+        self._completed = 0
+        self._probe = None
+        self._hold = 0
+        self._previous_per_job = None
+        self._lock = threading.Lock()
+        self._stop = None
+    
+    @property
+    def enabled(self):
+        return self._stop is not None
+    
+    def subscribe(self, callback):
+        """Call callback(level, reason) after every change of level"""
+        self._listeners.append(callback)
+    
+    def start(self, ceiling, level=None):
+        """Begin tuning between 1 and ceiling, from level (or START_LEVEL)"""
+        with self._lock:
+            self.ceiling = max(1, int(ceiling))
+            self._probe = None
+            self._hold = 0
+            self._previous_per_job = None
+        level = min(level or self.START_LEVEL, self.ceiling)
+        self._change(level, f"started at {level}")
+        if self._stop is None:
+            self._stop = threading.Event()
+            threading.Thread(target=self._loop, args=(self._stop,), daemon=True).start()
+    
+    def stop(self):
+        if self._stop is not None:
+            self._stop.set()
+            self._stop = None
+    
+    def set_ceiling(self, ceiling):
+        """Change the upper bound; a level above it drops straight down"""
+        with self._lock:
+            self.ceiling = max(1, int(ceiling))
+            over = self.level is not None and self.level > self.ceiling
+        if over:
+            self._change(self.ceiling, f"limit lowered to {self.ceiling}")
+    
+    def record_speed(self, job_id, speed):
+        """Note the latest download speed (bytes/s) of a running job"""
+        if speed:
+            with self._lock:
+                self._speeds[job_id] = (speed, time.monotonic())
+    
+    def record_result(self, job_id, error_class=None):
+        """Note how a job's download ended (error_class None for a success)"""
+        with self._lock:
+            self._speeds.pop(job_id, None)
+            if error_class is None:
+                self._completed += 1
+            elif error_class in ("rate_limit", "auth"):
+                self._throttled += 1
+            else:
+                self._failed += 1
+    
+    def forget(self, job_id):
+        """Stop counting a job that has left the download stage"""
+        with self._lock:
+            self._speeds.pop(job_id, None)
+    
+    def _loop(self, stop):
+        while not stop.wait(self.interval):
+            try:
+                self.evaluate()
+            except Exception:
+                logger.exception("Concurrency controller error")
+    
+    def evaluate(self):
+        """Close the current window and adjust the level if it calls for it"""
+        with self._lock:
+            now = time.monotonic()
+            speeds = [speed for speed, seen in self._speeds.values() if now - seen < self.interval * 2]
+            throttled, failed, completed = self._throttled, self._failed, self._completed
+            self._throttled = self._failed = self._completed = 0
+            level, ceiling = self.level, self.ceiling
+            
+            total = sum(speeds)
+            per_job = total / len(speeds) if speeds else None
+            previous_per_job, self._previous_per_job = self._previous_per_job, per_job
+            if self._hold:
+                self._hold -= 1
+            
+            # Throttling, failures or a speed collapse halve the level; while there is demand and
+            # the aggregate speed keeps rising, one more download is tried and undone if it gains nothing
+            decision = None
+            if throttled:
+                decision = (max(1, level // 2), f"YouTube throttled {throttled} download(s) (HTTP 429/403)")
+            elif failed and failed / (failed + completed) >= self.FAILURE_RATE:
+                decision = (max(1, level // 2), f"{failed} of {failed + completed} downloads failed")
+            elif self._probe is not None:
+                probe_level, before = self._probe
+                if len(speeds) < probe_level and self.has_demand():
+                    # The extra download hasn't started yet
+                    return
+                self._probe = None
+                if total < before * (1 + self.MIN_GAIN):
+                    self._hold = self.HOLD_WINDOWS
+                    decision = (max(1, probe_level - 1),
+                                f"no gain at {probe_level} ({self._rate(before)} -> {self._rate(total)})")
+            elif (per_job and previous_per_job and len(speeds) > 1
+                  and per_job < previous_per_job * self.SPEED_DROP):
+                decision = (max(1, level // 2),
+                            f"per-download speed fell from {self._rate(previous_per_job)} to {self._rate(per_job)}")
+            elif (speeds and not self._hold and level < ceiling and len(speeds) >= level
+                  and self.has_demand()):
+                self._probe = (level + 1, total)
+                decision = (level + 1, f"trying {level + 1} at {self._rate(total)}")
+            
+            if decision is None or decision[0] == level:
+                return
+            if decision[0] < level:
+                self._probe = None
+                self._hold = self.HOLD_WINDOWS
+        self._change(*decision)
+    
+    def _change(self, level, reason):
+        with self._lock:
+            previous = self.level
+            self.level = level
+            self.reason = reason
+            self.history.append({"time": time.time(), "level": level, "previous": previous, "reason": reason})
+        self.apply(level)
+        for callback in self._listeners:
+            try:
+                callback(level, reason)
+            except Exception:
+                logger.exception("Concurrency listener failed")
+    
+    @staticmethod
+    def _rate(speed):
+        return f"{speed / 1024 / 1024:.2f} MB/s"
+    
+    def snapshot(self):
+        with self._lock:
+            return {"adaptive": self.enabled, "level": self.level, "ceiling": self.ceiling,
+                    "reason": self.reason, "history": list(self.history)}
+
+
+class JobProfiler:
+    """Opt-in cProfile and tracemalloc capture of sampled jobs"""
+    
+    def __init__(self, directory=None, sample=1):
+        self.directory = directory
+        self.sample = max(1, sample)
+        self._counters = collections.defaultdict(itertools.count)
+        self._lock = threading.Lock()
+    
+    @classmethod
+    def from_environment(cls):
+        try:
+            sample = int(os.environ.get("YTMD_PROFILE_SAMPLE") or 1)
+        except ValueError:
+            logger.warning("YTMD_PROFILE_SAMPLE must be a whole number; profiling every job")
+            sample = 1
+        return cls(os.environ.get("YTMD_PROFILE_DIR") or None, sample)
+    
+    @property
+    def enabled(self):
+        return bool(self.directory)
+    
+    def wrap(self, kind, func):
+        """Return func, profiled for the sampled calls when profiling is on"""
+        if not self.enabled:
+            return func
+        
+        def profiled(*args, **kwargs):
+            n = next(self._counters[kind])
+            # Never wait for another job's profile to finish
+            if n % self.sample or not self._lock.acquire(blocking=False):
+                return func(*args, **kwargs)
+            try:
+                return self._run(kind, n, func, args, kwargs)
+            finally:
+                self._lock.release()
+        
+        return profiled
+    
+    def _run(self, kind, n, func, args, kwargs):
+        # tracemalloc traces the whole process, so other threads' allocations show up too
+        was_tracing = tracemalloc.is_tracing()
+        if not was_tracing:
+            tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        profile = cProfile.Profile()
+        started = time.perf_counter()
+        profile.enable()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profile.disable()
+            elapsed = time.perf_counter() - started
+            snapshot = tracemalloc.take_snapshot()
+            peak = tracemalloc.get_traced_memory()[1]
+            if not was_tracing:
+                tracemalloc.stop()
+            try:
+                self._write(kind, n, elapsed, profile, before, snapshot, peak)
+            except Exception as e:
+                logger.warning("Could not write the %s profile: %s", kind, e)
+    
+    def _write(self, kind, n, elapsed, profile, before, snapshot, peak):
+        os.makedirs(self.directory, exist_ok=True)
+        base = os.path.join(self.directory, f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{kind}-{n}")
+        profile.dump_stats(base + ".prof")
+        snapshot.dump(base + ".tracemalloc")
+        
+        ytdlp_module = sys.modules.get("yt_dlp.version")
+        report = io.StringIO()
+        report.write(f"{kind} job #{n}: {elapsed:.3f}s, peak traced memory {peak / 1024 / 1024:.1f} MB\n")
+        report.write(f"yt-dlp {getattr(ytdlp_module, '__version__', 'not loaded')}, "
+                     f"Python {sys.version.split()[0]}\n\n")
+        pstats.Stats(profile, stream=report).sort_stats("cumulative").print_stats(30)
+        report.write("Top allocations during the job:\n")
+        for stat in snapshot.compare_to(before, "lineno")[:15]:
+            report.write(f"  {stat}\n")
+        with open(base + ".txt", "w", encoding="utf-8") as f:
+            f.write(report.getvalue())
+
+
+class JobTimings:
+    """Where one job's time went: phase durations, bytes and transfer speeds"""
+    
+    # queued: waiting for a worker or a retry; extract: yt-dlp metadata; convert: ffmpeg; library: archive
+    # and library index updates. A phase that runs more than once (e.g. after a retry) adds up
+    PHASES = ("queued", "extract", "download", "convert", "library")
+    
+    def __init__(self):
+        self.durations = {}
+        self.bytes = 0
+        self.peak_speed = 0.0
+        self.created = time.monotonic()
+        self.finished = None
+        self._open = {}
+        self._lock = threading.Lock()
+    
+    def begin(self, phase):
+        with self._lock:
+            self._open.setdefault(phase, time.monotonic())
+    
+    def end(self, phase):
+        with self._lock:
+            started = self._open.pop(phase, None)
+            if started is not None:
+                self.durations[phase] = self.durations.get(phase, 0.0) + time.monotonic() - started
+    
+    @contextlib.contextmanager
+    def phase(self, phase):
+        """Count the time spent in the block towards a phase"""
+        self.begin(phase)
+        try:
+            yield
+        finally:
+            self.end(phase)
+    
+    def add_transfer(self, nbytes, speed=None):
+        with self._lock:
+            self.bytes += nbytes
+            if speed and speed > self.peak_speed:
+                self.peak_speed = speed
+    
+    def finish(self):
+        """Close any open phase and stop the job's clock"""
+        for phase in list(self._open):
+            self.end(phase)
+        self.finished = time.monotonic()
+    
+    @property
+    def average_speed(self):
+        """Bytes per second over the time spent in the download phase"""
+        seconds = self.durations.get("download")
+        return self.bytes / seconds if seconds else None
+    
+    def snapshot(self):
+        with self._lock:
+            durations = dict(self.durations)
+        return {
+            "phases": {phase: round(durations[phase], 3) for phase in self.PHASES if phase in durations},
+            "total_seconds": round((self.finished or time.monotonic()) - self.created, 3),
+            "bytes": self.bytes,
+            "average_speed": round(self.average_speed, 1) if self.average_speed else None,
+            "peak_speed": round(self.peak_speed, 1) if self.peak_speed else None,
+        }
+
+
+class DownloadHandle:
+    """A job submitted to DownloadEngine, with its state, progress and per-phase timings"""
+    
+    FINISHED_STATES = ("completed", "failed", "removed", "skipped")
+    
+    def __init__(self, item_id, url, title, audio_format, quality, output_dir, added=None, direct=False):
+        self.id = item_id
+        self.url = url
+        self.title = title
+        self.format = audio_format
+        self.quality = quality
+        self.output_dir = output_dir
+        self.added = added or datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        self.direct = direct
+        self.state = "queued"
+        self.percent = None
+        self.error = None
+        self.error_class = None
+        # Retries so far per error class
+        self.attempts = collections.Counter()
+        self.filename = None
+        self.conversion = None
+        self.video_id = extract_video_id(url)
+        self.skip_duplicates = True
+        self.skip_reason = None
+        # Progress already reported to the bandwidth limiter for the current file
+        self.received = None
+        self.timings = JobTimings()
+        self.timings.begin("queued")
+        self._listeners = []
+        self._done = threading.Event()
+    
+    @property
+    def done(self):
+        return self._done.is_set()
+    
+    def subscribe(self, callback):
+        """Call callback(handle, event) from the worker thread for every event of this job"""
+        # event["type"] is "state" (with "state", plus "error"/"error_class", "reason" or
+        # "attempt"/"retries"/"delay" where they apply) or "progress" ("percent", "speed", "eta",
+        # "downloaded_bytes", "total_bytes")
+        self._listeners.append(callback)
+    
+    def wait(self, timeout=None):
+        """Block until the job has finished; returns False on timeout"""
+        return self._done.wait(timeout)
+    
+    def to_item(self):
+        """Return the job as a queue item dict (as stored in the journal)"""
+        return {
+            "id": self.id,
+            "url": self.url,
+            "title": self.title,
+            "format": self.format,
+            "quality": self.quality,
+            "output_dir": self.output_dir,
+            "added": self.added
+        }
+
+
+class DownloadEngine:
+    """Headless download core (queue, workers, sessions, caches, search and library), with no Tk dependency"""
+    
+    AUDIO_EXTENSIONS = LibraryIndex.AUDIO_EXTENSIONS
+    
+    def __init__(self, max_concurrent=2, data_dir=APP_DATA_DIR, use_journal=True, persist_info=True,
+                 info_cache_size=256, transcode_workers=None, use_archive=True, verify_files=False,
+                 connections=4, rate_limit=0, adaptive=False, retry_policies=None,
+                 preview_cache_size=200 * 1024 * 1024, thumbnail_cache_size=50 * 1024 * 1024, profiler=None):
+        self.data_dir = data_dir
+        self.cookie_browser = None
+        # Fragments fetched in parallel per DASH/HLS download
+        self.connections = connections
+        # One bandwidth cap (bytes/s, 0 = unlimited) shared by all running downloads
+        self.limiter = BandwidthLimiter(rate_limit)
+        self.on_queue_change = None
+        self._listeners = []
+        self._handles = {}
+        self._handles_lock = threading.Lock()
+        # Unfinished jobs per (video id, format), so duplicate checks don't scan every handle
+        self._active_keys = collections.Counter()
+        self._job_keys = {}
+        self._item_counter = itertools.count()
+        self._library = None
+        self._library_lock = threading.Lock()
+        self._queue_cond = threading.Condition()
+        
+        # Shared YoutubeDL sessions (cookies are read once per browser)
+        self.session_pool = YoutubeDLPool()
+        
+        # Extracted video info, reused between confirmation and download
+        self.info_cache = InfoCache(max_entries=info_cache_size,
+                                    persist_dir=os.path.join(data_dir, "info_cache") if persist_info else None)
+        
+        # Search results by query; later pages are fetched on demand
+        self.search_cache = SearchCache(self.session_pool)
+        
+        # Opt-in cProfile/tracemalloc capture of sampled jobs (YTMD_PROFILE_DIR)
+        self.profiler = profiler or JobProfiler.from_environment()
+        
+        # Two-stage pipeline: network downloads on the dispatcher's workers, ffmpeg
+        # conversions on a separate pool sized to the CPU count
+        self.download_stats = StageStats("download")
+        self.transcode_stats = StageStats("transcode")
+        self.transcoder = TranscodePool(self.profiler.wrap("transcode", self._transcode_job),
+                                        workers=transcode_workers)
+        self.dispatcher = DownloadDispatcher(self.profiler.wrap("download", self._run_job),
+                                             max_workers=max_concurrent, on_change=self._queue_changed)
+        
+        # With adaptive on, max_concurrent is the ceiling and the level follows throughput
+        self.concurrency = ConcurrencyController(self.dispatcher.set_max_workers,
+                                                 lambda: self.dispatcher.pending_count > 0)
+        if adaptive:
+            self.concurrency.start(ceiling=max_concurrent)
+        
+        # Failed jobs wait on a timer heap, not a worker, until their retry is due;
+        # sustained rate limiting pauses the whole queue
+        self.retry_policies = dict(self.RETRY_POLICIES, **(retry_policies or {}))
+        self.retries = RetryScheduler()
+        self.breaker = CircuitBreaker(self.retries, self._on_breaker_open, self._on_breaker_close)
+        self._breaker_paused = False
+        
+        # Aggregate counters for /metrics, plus the timings of recently finished jobs
+        self.metrics = MetricsRegistry()
+        self.recent_jobs = collections.deque(maxlen=200)
+        self.metrics_server = None
+        self._register_metrics()
+        
+        # The archive, journal and media caches read their indexes from disk, so they are
+        # opened on first use (or by open_storage() on a background thread)
+        self._storage_options = (use_archive, verify_files, use_journal, preview_cache_size, thumbnail_cache_size)
+        self._storage_lock = threading.Lock()
+        self._storage_open = False
+        self._archive = None
+        self._previews = None
+        self._thumbnails = None
+        self._journal = None
+    
+    # Storage
+    
+    def open_storage(self):
+        """Open the download archive, queue journal and media caches unless they are open already"""
+        with self._storage_lock:
+            if self._storage_open:
+                return
+            use_archive, verify_files, use_journal, preview_cache_size, thumbnail_cache_size = self._storage_options
+            
+            # Finished downloads, so the same video isn't fetched twice
+            if use_archive:
+                try:
+                    self._archive = DownloadArchive(os.path.join(self.data_dir, "archive.db"),
+                                                    verify_files=verify_files)
+                except (OSError, sqlite3.Error) as e:
+                    logger.warning("Download archive unavailable: %s", e)
+            
+            # Previews are cached per video outside the library folders
+            if preview_cache_size:
+                try:
+                    # Each file holds the start of the audio stream as downloaded
+                    self._previews = MediaCache(os.path.join(self.data_dir, "previews"), max_size=preview_cache_size)
+                except OSError as e:
+                    logger.warning("Preview cache unavailable: %s", e)
+            
+            # Search result thumbnails, fetched and downscaled once
+            thumbnail_cache = None
+            if thumbnail_cache_size:
+                try:
+                    thumbnail_cache = MediaCache(os.path.join(self.data_dir, "thumbnails"),
+                                                 max_size=thumbnail_cache_size)
+                except OSError as e:
+                    logger.warning("Thumbnail cache unavailable: %s", e)
+            self._thumbnails = ThumbnailLoader(thumbnail_cache)
+            
+            if use_journal:
+                try:
+                    self._journal = QueueJournal(os.path.join(self.data_dir, "queue.db"))
+                except (OSError, sqlite3.Error) as e:
+                    # The queue still works, it just won't survive a restart
+                    logger.warning("Queue journal unavailable: %s", e)
+            self._storage_open = True
+    
+    @property
+    def archive(self):
+        """The download archive, or None if it is switched off or unavailable"""
+        self.open_storage()
+        return self._archive
+    
+    @property
+    def previews(self):
+        """The preview cache, or None if it is switched off or unavailable"""
+        self.open_storage()
+        return self._previews
+    
+    @property
+    def thumbnails(self):
+        """The thumbnail loader (without a disk cache if that is unavailable)"""
+        self.open_storage()
+        return self._thumbnails
+    
+    @property
+    def journal(self):
+        """The queue journal, or None if it is switched off or unavailable"""
+        self.open_storage()
+        return self._journal
+    
+    # Queue
+    
+    @property
+    def pending_count(self):
+        return self.dispatcher.pending_count
+    
+    @property
+    def active_count(self):
+        return self.dispatcher.active_count
+    
+    @property
+    def paused(self):
+        return self.dispatcher.paused
+    
+    def subscribe(self, callback):
+        """Call callback(handle, event) for events of every job"""
+        self._listeners.append(callback)
+    
+    def get(self, item_id):
+        """Return the handle of a job by id"""
+        with self._handles_lock:
+            return self._handles.get(item_id)
+    
+    def submit(self, url, audio_format="mp3", quality="192", output_dir=None, title=None, direct=False,
+               on_event=None, skip_duplicates=True):
+        """Queue a download and return its DownloadHandle (direct jobs start on their own thread)"""
+        # A bad quality would only fail in the transcode stage, after the download
+        quality = self.normalize_quality(quality)
+        item_id = f"item_{int(time.time())}_{next(self._item_counter)}"
+        handle = DownloadHandle(item_id, url, title or url, audio_format, quality,
+                                output_dir or os.path.join(os.path.expanduser("~"), "Downloads"),
+                                direct=direct)
+        handle.skip_duplicates = skip_duplicates
+        # Subscribed before the job can start, so on_event sees every event
+        if on_event:
+            handle.subscribe(on_event)
+        
+        # Archived or already queued in this format: finish as "skipped" (URLs without a
+        # visible video id are checked again once extracted)
+        if skip_duplicates and handle.video_id:
+            handle.skip_reason = self.find_duplicate(handle.video_id, audio_format)
+            if handle.skip_reason:
+                self._set_state(handle, "skipped", reason=handle.skip_reason)
+                return handle
+        
+        self._enqueue(handle)
+        return handle
+    
+    def submit_playlist(self, url, audio_format="mp3", quality="192", output_dir=None, on_submit=None,
+                        on_done=None, max_pending=200):
+        """Queue a playlist's videos as they are listed; returns an Event that stops the listing"""
+        quality = self.normalize_quality(quality)
+        stop = threading.Event()
+        
+        def expand():
+            count = 0
+            error = None
+            entries = self.expand_playlist(url)
+            try:
+                for entry_url, title in entries:
+                    # Wait while max_pending jobs are queued, so a huge playlist isn't held in memory at once
+                    with self._queue_cond:
+                        while self.pending_count >= max_pending and not stop.is_set():
+                            self._queue_cond.wait(timeout=1.0)
+                    if stop.is_set():
+                        break
+                    handle = self.submit(entry_url, audio_format, quality, output_dir, title=title)
+                    count += 1
+                    if on_submit:
+                        on_submit(handle)
+            except Exception as e:
+                error = e
+            finally:
+                entries.close()
+            if on_done:
+                on_done(count, error)
+        
+        threading.Thread(target=expand, daemon=True).start()
+        return stop
+    
+    def expand_playlist(self, url, max_depth=2):
+        """Yield (url, title) for each video of a playlist or channel as yt-dlp lists it"""
+        # Flat and unprocessed, so yt-dlp fetches the listing a page at a time as it is consumed
+        opts = {'quiet': True, 'no_warnings': True, 'extract_flat': 'in_playlist', 'skip_download': True}
+        session = self.session_pool.acquire(opts, browser=self.cookie_browser)
+        error = None
+        try:
+            yield from self._flat_entries(session.ydl, url, max_depth)
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self.session_pool.release(session, error)
+    
+    def _flat_entries(self, ydl, url, depth):
+        info = ydl.extract_info(url, download=False, process=False)
+        if not info:
+            return
+        
+        if info.get('_type') in ('url', 'url_transparent') and depth > 0:
+            # Redirect to the page that holds the listing
+            yield from self._flat_entries(ydl, info['url'], depth - 1)
+            return
+        if info.get('_type') not in ('playlist', 'multi_video'):
+            yield info.get('webpage_url') or url, info.get('title')
+            return
+        
+        for entry in info.get('entries') or []:
+            if not entry:
+                continue
+            entry_url = entry.get('url') or entry.get('webpage_url') or ''
+            video_id = extract_video_id(entry_url) or (entry.get('id') if entry.get('ie_key') == 'Youtube' else None)
+            if video_id:
+                yield f"https://www.youtube.com/watch?v={video_id}", entry.get('title')
+            elif entry_url and depth > 0:
+                # A channel tab or a playlist inside the listing
+                yield from self._flat_entries(ydl, entry_url, depth - 1)
+    
+    def find_duplicate(self, video_id, audio_format, exclude=None):
+        """Return "downloaded" or "queued" if this video is already handled in this format (no network work)"""
+        if self.archive is not None and self.archive.contains(video_id, audio_format):
+            return "downloaded"
+        key = (video_id, audio_format)
+        with self._handles_lock:
+            count = self._active_keys[key]
+            if exclude is not None and self._job_keys.get(exclude.id) == key:
+                count -= 1
+        return "queued" if count > 0 else None
+    
+    def restore(self):
+        """Re-queue jobs left unfinished by a previous session and return their handles"""
+        if not self.journal:
+            return []
+        
+        handles = []
+        for item in self.journal.load_unfinished():
+            try:
+                quality = self.normalize_quality(item["quality"])
+            except ValueError:
+                # Journaled before qualities were checked
+                quality = "192"
+            # Items that were mid-download or waiting to retry start again (yt-dlp resumes .part files)
+            handle = DownloadHandle(item["id"], item["url"], item["title"], item["format"],
+                                    quality, item["output_dir"], item["added"])
+            self._enqueue(handle, journal=False)
+            handles.append(handle)
+        return handles
+    
+    def _enqueue(self, handle, journal=True):
+        with self._handles_lock:
+            self._handles[handle.id] = handle
+            self._track_job(handle)
+        
+        if handle.direct:
+            threading.Thread(target=self.profiler.wrap("download", self._run_job), args=(handle,),
+                             daemon=True).start()
+            return
+        
+        if journal and self.journal:
+            self.journal.record_queued(handle.to_item())
+        self.dispatcher.submit(handle.to_item())
+    
+    def _track_job(self, handle):
+        """Index an unfinished job under its (video id, format); the caller holds _handles_lock"""
+        self._untrack_job(handle)
+        if handle.video_id:
+            key = (handle.video_id, handle.format)
+            self._active_keys[key] += 1
+            self._job_keys[handle.id] = key
+    
+    def _untrack_job(self, handle):
+        key = self._job_keys.pop(handle.id, None)
+        if key is not None:
+            self._active_keys[key] -= 1
+            if not self._active_keys[key]:
+                del self._active_keys[key]
+    
+    def remove(self, item_id):
+        """Take a pending or retry-waiting job off the queue; returns False if it is running"""
+        if not self.dispatcher.remove(item_id) and not self.retries.cancel(item_id):
+            return False
+        self._set_state(self.get(item_id), "removed")
+        return True
+    
+    def clear(self):
+        """Remove every pending and retry-waiting job (running downloads keep going)"""
+        for item in self.dispatcher.clear():
+            self._set_state(self.get(item["id"]), "removed")
+        for item_id in self.retries.keys():
+            handle = self.get(item_id)
+            if handle is not None and self.retries.cancel(item_id):
+                self._set_state(handle, "removed")
+    
+    @property
+    def retrying_count(self):
+        """Number of failed jobs waiting for their retry"""
+        return len(self.retries) - (CircuitBreaker.TIMER_KEY in self.retries)
+    
+    def move_to_top(self, item_id):
+        return self.dispatcher.move_to_top(item_id)
+    
+    def swap(self, first_id, second_id):
+        return self.dispatcher.swap(first_id, second_id)
+    
+    def pause(self):
+        # A pause asked for by the user outlasts the circuit breaker
+        self._breaker_paused = False
+        self.dispatcher.pause()
+    
+    def resume(self):
+        self._breaker_paused = False
+        self.dispatcher.resume()
+    
+    def _on_breaker_open(self, cooldown):
+        if not self.dispatcher.paused:
+            self._breaker_paused = True
+            self.dispatcher.pause()
+    
+    def _on_breaker_close(self):
+        if self._breaker_paused:
+            self._breaker_paused = False
+            self.dispatcher.resume()
+    
+    def set_max_concurrent(self, max_downloads):
+        """Set the number of parallel downloads (the ceiling while adaptive)"""
+        if self.concurrency.enabled:
+            self.concurrency.set_ceiling(max_downloads)
+        else:
+            self.dispatcher.set_max_workers(max_downloads)
+    
+    def set_adaptive(self, enabled, max_downloads):
+        """Switch adaptive concurrency on or off; off runs max_downloads at once"""
+        if enabled:
+            self.concurrency.start(ceiling=max_downloads)
+        else:
+            self.concurrency.stop()
+            self.dispatcher.set_max_workers(max_downloads)
+    
+    def stage_stats(self):
+        """Return throughput counters for the download and transcode stages"""
+        download = self.download_stats.snapshot()
+        transcode = self.transcode_stats.snapshot()
+        transcode["queued"] = self.transcoder.depth
+        download["rate_limit"] = self.limiter.rate
+        download["max_concurrent"] = self.dispatcher.max_workers
+        return {"download": download, "transcode": transcode}
+    
+    # Metrics
+    
+    PHASE_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+    SPEED_BUCKETS = (64 * 1024, 256 * 1024, 1024 ** 2, 4 * 1024 ** 2, 16 * 1024 ** 2, 64 * 1024 ** 2)
+    
+    def _register_metrics(self):
+        metrics = self.metrics
+        metrics.counter("ytmd_jobs_total", "Jobs finished, by final state")
+        metrics.counter("ytmd_errors_total", "Download and conversion errors, by stage and error class")
+        metrics.counter("ytmd_retries_total", "Retries scheduled, by error class")
+        metrics.counter("ytmd_downloaded_bytes_total", "Bytes transferred by downloads")
+        metrics.histogram("ytmd_phase_seconds", "Time finished jobs spent in each phase", self.PHASE_BUCKETS)
+        metrics.histogram("ytmd_job_seconds", "Time from submit to completion", self.PHASE_BUCKETS)
+        metrics.histogram("ytmd_download_speed_bytes", "Average transfer speed of completed jobs (bytes/s)",
+                          self.SPEED_BUCKETS)
+        metrics.gauge("ytmd_queue_pending", "Jobs waiting for a download worker", lambda: self.pending_count)
+        metrics.gauge("ytmd_downloads_active", "Downloads running", lambda: self.active_count)
+        metrics.gauge("ytmd_transcodes_queued", "Downloads waiting for conversion", lambda: self.transcoder.depth)
+        metrics.gauge("ytmd_jobs_retrying", "Jobs waiting for a retry", lambda: self.retrying_count)
+        metrics.gauge("ytmd_concurrency_limit", "Downloads allowed to run at once",
+                      lambda: self.dispatcher.max_workers)
+        metrics.gauge("ytmd_rate_limit_bytes", "Shared bandwidth cap in bytes/s (0 = none)", lambda: self.limiter.rate)
+    
+    def _record_job(self, handle, state):
+        """Add a finished job to the metrics and the list of recent jobs"""
+        timings = handle.timings.snapshot()
+        self.metrics.inc("ytmd_jobs_total", state=state)
+        for phase, seconds in timings["phases"].items():
+            self.metrics.observe("ytmd_phase_seconds", seconds, phase=phase)
+        if state == "completed":
+            self.metrics.observe("ytmd_job_seconds", timings["total_seconds"])
+            if timings["average_speed"]:
+                self.metrics.observe("ytmd_download_speed_bytes", timings["average_speed"])
+        self.recent_jobs.append(dict(timings, id=handle.id, title=handle.title, url=handle.url, state=state,
+                                     error_class=handle.error_class, retries=sum(handle.attempts.values())))
+    
+    def metrics_json(self):
+        """Return the metrics, stage counters and recently finished jobs as one dict"""
+        return {
+            "metrics": self.metrics.to_json(),
+            "stages": self.stage_stats(),
+            "jobs": list(self.recent_jobs),
+        }
+    
+    def serve_metrics(self, port=0, host="127.0.0.1"):
+        """Serve /metrics and /metrics.json over HTTP; returns the port"""
+        if self.metrics_server is None:
+            self.metrics_server = MetricsServer(self.metrics.to_prometheus, self.metrics_json, port, host)
+        return self.metrics_server.port
+    
+    def close(self):
+        """Flush the journal and close pooled sessions"""
+        if self.metrics_server is not None:
+            self.metrics_server.close()
+        self.concurrency.stop()
+        # Jobs waiting to retry stay in the journal and are restored next time
+        self.retries.close()
+        self.dispatcher.shutdown()
+        self.transcoder.shutdown()
+        self.search_cache.clear()
+        # Waits for an open_storage() that is still running, but doesn't open anything
+        with self._storage_lock:
+            if self._journal:
+                self._journal.close()
+            if self._archive is not None:
+                self._archive.close()
+            # Nothing is opened again by jobs that finish after this
+            self._storage_open = True
+        if self._library:
+            self._library.close()
+        self.session_pool.close()
+    
+    def _queue_changed(self):
+        with self._queue_cond:
+            self._queue_cond.notify_all()
+        if self.on_queue_change:
+            self.on_queue_change()
+    
+    # Downloads
+    
+    # Stream selectors that prefer a source already in the target codec, so the
+    # transcode stage can keep or remux it instead of re-encoding
+    FORMAT_SELECTORS = {
+        "m4a": "bestaudio[ext=m4a]/bestaudio[acodec^=mp4a]/bestaudio/best",
+        "mp3": "bestaudio[acodec=mp3]/bestaudio/best",
+    }
+    
+    # Codec names yt-dlp reports for streams that already match each target
+    TARGET_CODECS = {
+        "m4a": ("mp4a", "aac"),
+        "mp3": ("mp3",),
+    }
+    
+    # Bitrates offered in the quality menu
+    STANDARD_BITRATES = (64, 96, 128, 160, 192, 256, 320)
+    # Bytes of the audio stream fetched for a preview (a minute or two of audio)
+    PREVIEW_BYTES = 3 * 1024 * 1024
+    # Share of the bandwidth cap a direct download gets relative to a queued one
+    DIRECT_WEIGHT = 8
+    # Retries per failure class (see classify_error); direct downloads aren't retried
+    RETRY_POLICIES = {
+        "network": RetryPolicy(retries=5, base_delay=2, max_delay=60),
+        "rate_limit": RetryPolicy(retries=4, base_delay=30, max_delay=600),
+        "auth": RetryPolicy(retries=1, base_delay=5),
+        "unavailable": RetryPolicy(retries=0, base_delay=0),
+        "ffmpeg": RetryPolicy(retries=1, base_delay=2),
+        "other": RetryPolicy(retries=1, base_delay=10),
+    }
+    
+    @staticmethod
+    def normalize_quality(quality):
+        """Return a typed audio quality such as "192k" or "192 kbps" as "192"; raises ValueError otherwise"""
+        match = re.fullmatch(r"\s*(\d+)\s*(?:k|kbps|kbit/s)?\s*", str(quality), re.IGNORECASE)
+        if not match or not 0 < int(match.group(1)) <= 512:
+            raise ValueError(f"Audio quality must be a bitrate in kbps, such as 192 (got {quality!r})")
+        return str(int(match.group(1)))
+    
+    @staticmethod
+    def build_ydl_opts(audio_format, audio_quality, output_dir, connections=1):
+        """Return the yt-dlp options used to download audio into output_dir (conversion runs later)"""
+        return {
+            'format': DownloadEngine.FORMAT_SELECTORS.get(audio_format, 'bestaudio/best'),
+            'outtmpl': os.path.join(output_dir, '%(title)s.%(ext)s'),
+            # yt-dlp's default, spelled out because retries and restored jobs rely on resuming .part files
+            'continuedl': True,
+            'concurrent_fragment_downloads': max(1, connections),
+            'quiet': True,
+            'no_warnings': True,
+            # quiet alone still prints the progress bar to stdout; progress comes from the hooks
+            'noprogress': True
+        }
+    
+    def get_video_info(self, url):
+        """Return video info for a URL, extracting it only on a cache miss"""
+        info = self.info_cache.get(extract_video_id(url))
+        if info is None:
+            with self.session_pool.session({'quiet': True}, browser=self.cookie_browser) as ydl:
+                info = ydl.extract_info(url, download=False)
+            self.info_cache.put(info)
+        return info
+    
+    def _extract_and_download(self, ydl, handle):
+        """Download a job's URL with a borrowed session; returns None if it turns out to be a duplicate"""
+        info = self.info_cache.get(extract_video_id(handle.url))
+        if info is not None:
+            if self._is_duplicate_job(handle, info):
+                return None
+            try:
+                with handle.timings.phase("download"):
+                    return ydl.process_ie_result(info, download=True)
+            except yt_dlp.utils.DownloadError:
+                # Cached stream URLs may have expired; fall back to a fresh extraction
+                self.info_cache.invalidate(info.get('id'))
+        
+        with handle.timings.phase("extract"):
+            info = ydl.extract_info(handle.url, download=False)
+        if self._is_duplicate_job(handle, info):
+            return None
+        with handle.timings.phase("download"):
+            return ydl.process_ie_result(info, download=True)
+    
+    @staticmethod
+    def _first_video(info):
+        if info.get('_type') == 'playlist':
+            # Search queries ("ytsearch1:...") come back as a one-entry playlist
+            return next(entry for entry in info.get('entries') or [] if entry)
+        return info
+    
+    def _is_duplicate_job(self, handle, info):
+        """Record the job's video id and say whether downloading it would be a duplicate"""
+        handle.video_id = self._first_video(info).get('id') or handle.video_id
+        with self._handles_lock:
+            if handle.id in self._handles:
+                self._track_job(handle)
+        if not handle.skip_duplicates or not handle.video_id:
+            return False
+        handle.skip_reason = self.find_duplicate(handle.video_id, handle.format, exclude=handle)
+        return handle.skip_reason is not None
+    
+    def _run_job(self, item):
+        """Download one job (runs on a dispatcher worker or a direct-download thread)"""
+        handle = item if isinstance(item, DownloadHandle) else self.get(item["id"])
+        handle.timings.end("queued")
+        self._set_state(handle, "downloading")
+        
+        try:
+            # Create output directory if it doesn't exist
+            if not os.path.exists(handle.output_dir):
+                os.makedirs(handle.output_dir)
+            
+            ydl_opts = self.build_ydl_opts(handle.format, handle.quality, handle.output_dir, self.connections)
+            progress_hook = lambda d: self._on_progress(handle, d)
+            
+            # Download the audio (with browser cookies if selected)
+            with self.download_stats.track():
+                with self.session_pool.session(ydl_opts, progress_hook, self.cookie_browser) as ydl:
+                    info = self._extract_and_download(ydl, handle)
+                    if info is None:
+                        self._set_state(handle, "skipped", reason=handle.skip_reason)
+                        return
+                    info = self._first_video(info)
+                    filepath = self._downloaded_filepath(ydl, info)
+                
+                if os.path.exists(filepath):
+                    self.download_stats.add_bytes(os.path.getsize(filepath))
+            
+            handle.title = info.get('title') or handle.title
+            if not handle.direct:
+                self.concurrency.record_result(handle.id)
+                self.breaker.record(None)
+            if handle.state != "converting":
+                self._set_state(handle, "converting")
+        
+        except Exception as e:
+            handle.error = str(e)
+            handle.error_class = classify_error(e)
+            self.metrics.inc("ytmd_errors_total", stage="download", error_class=handle.error_class)
+            if not handle.direct:
+                self.concurrency.record_result(handle.id, handle.error_class)
+                self.breaker.record(handle.error_class)
+            if not self._retry_later(handle, lambda: self._requeue(handle)):
+                self._set_state(handle, "failed", error=handle.error, error_class=handle.error_class)
+            return
+        finally:
+            self.limiter.release(handle.id)
+            self.concurrency.forget(handle.id)
+        
+        # Free this download slot as soon as the transcode queue has room
+        handle.timings.begin("queued")
+        self.transcoder.submit((handle, info, filepath))
+    
+    @staticmethod
+    def _downloaded_filepath(ydl, info):
+        """Return the path yt-dlp wrote the downloaded stream to"""
+        for download in info.get('requested_downloads') or []:
+            if download.get('filepath'):
+                return download['filepath']
+        return info.get('filepath') or ydl.prepare_filename(info)
+    
+    @staticmethod
+    def plan_conversion(info, audio_format, audio_quality):
+        """Return ("keep", "remux" or "encode", quality) for turning a downloaded stream into audio_format"""
+        downloads = info.get('requested_downloads') or [info]
+        stream = dict(info, **downloads[0])
+        acodec = (stream.get('acodec') or "").lower()
+        ext = (stream.get('ext') or "").lower()
+        
+        if acodec and acodec != "none" and acodec.startswith(DownloadEngine.TARGET_CODECS.get(audio_format, ())):
+            return ("keep" if ext == audio_format else "remux"), audio_quality
+        
+        # Encode no higher than the next standard bitrate above the source's (128 kbps doesn't become 320)
+        quality = audio_quality
+        source_kbps = stream.get('abr') or stream.get('tbr')
+        if source_kbps:
+            ceiling = next((rate for rate in DownloadEngine.STANDARD_BITRATES if rate >= source_kbps),
+                           DownloadEngine.STANDARD_BITRATES[-1])
+            quality = str(min(int(audio_quality), ceiling))
+        return "encode", quality
+    
+    def _transcode_job(self, job):
+        """Convert a downloaded stream to the requested format (runs on a transcode worker)"""
+        handle, info, filepath = job
+        handle.timings.end("queued")
+        try:
+            with self.transcode_stats.track(), handle.timings.phase("convert"):
+                action, quality = self.plan_conversion(info, handle.format, handle.quality)
+                handle.conversion = action
+                
+                if action == "keep":
+                    # Already the requested format; nothing for ffmpeg to do
+                    files_to_delete, info = [], dict(info, filepath=filepath)
+                else:
+                    # For "remux" FFmpegExtractAudioPP sees the matching codec and stream-copies
+                    with self.session_pool.session({'quiet': True, 'no_warnings': True}) as ydl:
+                        pp = yt_dlp.postprocessor.FFmpegExtractAudioPP(
+                            ydl, preferredcodec=handle.format, preferredquality=quality)
+                        files_to_delete, info = pp.run(dict(info, filepath=filepath))
+                
+                # Remove the raw download once the converted file exists
+                for path in files_to_delete:
+                    if path != info['filepath'] and os.path.exists(path):
+                        os.remove(path)
+                if os.path.exists(info['filepath']):
+                    self.transcode_stats.add_bytes(os.path.getsize(info['filepath']))
+            
+            handle.filename = info['filepath']
+            with handle.timings.phase("library"):
+                if self.archive is not None and handle.video_id:
+                    self.archive.add(handle.video_id, handle.format, handle.filename)
+                if self._library:
+                    # Index the new file with the tags we already know
+                    bitrate = int(quality) if action == "encode" else info.get('abr')
+                    self._library.remember_tags(handle.filename, info.get('duration'),
+                                                int(bitrate) if bitrate else None,
+                                                "aac" if handle.format == "m4a" else handle.format)
+            self._set_state(handle, "completed")
+        
+        except Exception as e:
+            handle.error = f"Conversion failed: {e}"
+            handle.error_class = classify_error(e, stage="transcode")
+            self.metrics.inc("ytmd_errors_total", stage="transcode", error_class=handle.error_class)
+            if not self._retry_later(handle, lambda: self._retry_transcode(job)):
+                self._set_state(handle, "failed", error=handle.error, error_class=handle.error_class)
+    
+    def _retry_later(self, handle, resume):
+        """Schedule resume() after the back-off for handle's error class; returns False if the job should fail"""
+        if handle.direct:
+            return False
+        policy = self.retry_policies.get(handle.error_class)
+        if policy is None:
+            return False
+        attempt = handle.attempts[handle.error_class] + 1
+        delay = policy.delay(attempt)
+        if delay is None:
+            return False
+        handle.attempts[handle.error_class] = attempt
+        handle.timings.begin("queued")
+        self.metrics.inc("ytmd_retries_total", error_class=handle.error_class)
+        
+        self._set_state(handle, "retrying", error=handle.error, error_class=handle.error_class,
+                        attempt=attempt, retries=policy.retries, delay=delay)
+        self.retries.schedule(handle.id, delay, resume)
+        return True
+    
+    def _requeue(self, handle):
+        """Put a job whose retry is due back at the end of the queue"""
+        if self.get(handle.id) is not handle:
+            return
+        handle.percent = None
+        handle.received = None
+        handle.error = handle.error_class = None
+        self._set_state(handle, "queued")
+        self.dispatcher.submit(handle.to_item())
+    
+    def _retry_transcode(self, job):
+        """Hand a failed conversion back to the transcode workers"""
+        handle = job[0]
+        if self.get(handle.id) is not handle:
+            return
+        handle.error = handle.error_class = None
+        self._set_state(handle, "converting")
+        # submit() can block on a full queue; keep the timer thread free
+        threading.Thread(target=self.transcoder.submit, args=(job,), daemon=True).start()
+    
+    def _on_progress(self, handle, d):
+        """Translate a yt-dlp progress callback into a handle event"""
+        if d['status'] == 'downloading':
+            # Calculate download progress
+            downloaded = d.get('downloaded_bytes', 0)
+            total = d.get('total_bytes', 0) or d.get('total_bytes_estimate', 0)
+            
+            # Sleeping here holds back yt-dlp's read loop while over the cap. The
+            # first report is the baseline: a resumed .part already counts its bytes
+            downloaded = downloaded or 0
+            if handle.received is None:
+                handle.received = downloaded
+            received = max(0, downloaded - handle.received)
+            handle.received += received
+            handle.timings.add_transfer(received, d.get('speed'))
+            if received:
+                self.metrics.inc("ytmd_downloaded_bytes_total", received)
+            if received and self.limiter.rate:
+                self.limiter.consume(handle.id, received, self.DIRECT_WEIGHT if handle.direct else 1)
+            if not handle.direct:
+                self.concurrency.record_speed(handle.id, d.get('speed'))
+            
+            if total > 0:
+                handle.percent = (downloaded / total) * 100
+                self._emit(handle, {
+                    "type": "progress",
+                    "percent": handle.percent,
+                    "speed": d.get('speed'),
+                    "eta": d.get('eta'),
+                    "downloaded_bytes": downloaded,
+                    "total_bytes": total
+                })
+        
+        elif d['status'] == 'finished':
+            # A format merge downloads its next file from zero
+            handle.received = None
+            if handle.state != "converting":
+                self._set_state(handle, "converting")
+    
+    def _set_state(self, handle, state, **extra):
+        if handle is None:
+            return
+        handle.state = state
+        
+        # Jobs skipped at submit time were never journaled
+        if self.journal and not handle.direct and handle.id in self._handles:
+            if state == "removed":
+                self.journal.record_removed(handle.id)
+            elif state == "queued":
+                # Back in the queue after a retry delay
+                self.journal.record_queued(handle.to_item())
+            else:
+                self.journal.record_state(handle.id, state, extra.get("error"))
+        
+        if state in DownloadHandle.FINISHED_STATES:
+            with self._handles_lock:
+                self._handles.pop(handle.id, None)
+                self._untrack_job(handle)
+            handle.timings.finish()
+            self._record_job(handle, state)
+        
+        self._emit(handle, dict(extra, type="state", state=state))
+        
+        if state in DownloadHandle.FINISHED_STATES:
+            handle._done.set()
+            self._queue_changed()
+    
+    def _emit(self, handle, event):
+        for callback in handle._listeners + self._listeners:
+            try:
+                callback(handle, event)
+            except Exception:
+                logger.exception("Download event listener failed")
+    
+    # Search, preview and library
+    
+    def search(self, query):
+        """Return the (possibly cached) SearchResults for a query"""
+        ydl_opts = {
+            'quiet': True,
+            'no_warnings': True,
+            'extract_flat': True,
+            'skip_download': True,
+        }
+        return self.search_cache.get(query, ydl_opts, self.cookie_browser)
+    
+    def preview_chunks(self, video_id, sample_rate=44100, channels=2, chunk_seconds=0.5, stop=None):
+        """Yield a video's audio as signed 16-bit PCM chunks while it downloads (needs ffmpeg)"""
+        path = self.previews.get(video_id) if self.previews is not None else None
+        stream = None if path else self._preview_stream(video_id)
+        
+        command = ["ffmpeg", "-loglevel", "quiet", "-i", path or "pipe:0", "-vn",
+                   "-f", "s16le", "-acodec", "pcm_s16le", "-ar", str(sample_rate), "-ac", str(channels), "pipe:1"]
+        process = subprocess.Popen(command, stdin=subprocess.PIPE if stream else subprocess.DEVNULL,
+                                   stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        if stream:
+            # Feeds ffmpeg and the preview cache at once, and finishes even if the caller stops early
+            # so the next preview of this video comes from the cache
+            threading.Thread(target=self._fetch_preview, args=(video_id, stream, process.stdin),
+                             daemon=True).start()
+        
+        chunk_size = int(sample_rate * chunk_seconds) * channels * 2
+        try:
+            while not (stop and stop.is_set()):
+                chunk = process.stdout.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            process.kill()
+            process.stdout.close()
+            process.wait()
+    
+    def _preview_stream(self, video_id):
+        """Return (url, headers, ext) of the audio stream to preview"""
+        ydl_opts = {
+            'quiet': True,
+            'no_warnings': True,
+            # WebM/Opus decodes from a pipe; an MP4 may keep its index at the end
+            'format': 'bestaudio[ext=webm]/bestaudio/best',
+        }
+        with self.session_pool.session(ydl_opts, browser=self.cookie_browser) as ydl:
+            info = ydl.extract_info(f"https://www.youtube.com/watch?v={video_id}", download=False)
+        info = self._first_video(info)
+        return info['url'], info.get('http_headers') or {}, info.get('ext') or "webm"
+    
+    def _fetch_preview(self, video_id, stream, sink):
+        """Download the start of a stream into ffmpeg's stdin and the preview cache"""
+        url, headers, ext = stream
+        part_path = self.previews.part_path(video_id, ext) if self.previews is not None else None
+        cache_file = None
+        try:
+            request = urllib_request.Request(url, headers=dict(headers, Range=f"bytes=0-{self.PREVIEW_BYTES - 1}"))
+            with urllib_request.urlopen(request, timeout=30) as response:
+                if part_path:
+                    cache_file = open(part_path, "wb")
+                received = 0
+                while received < self.PREVIEW_BYTES:
+                    data = response.read(min(64 * 1024, self.PREVIEW_BYTES - received))
+                    if not data:
+                        break
+                    received += len(data)
+                    if cache_file:
+                        cache_file.write(data)
+                    if sink is not None:
+                        try:
+                            sink.write(data)
+                            sink.flush()
+                        except (OSError, ValueError):
+                            # Playback was stopped; keep filling the cache
+                            sink = None
+            if cache_file:
+                cache_file.close()
+                cache_file = None
+                self.previews.add(video_id, part_path)
+        except Exception as e:
+            logger.warning("Preview download failed: %s", e)
+            if cache_file:
+                cache_file.close()
+            if part_path and os.path.exists(part_path):
+                os.remove(part_path)
+        finally:
+            if sink is not None:
+                try:
+                    sink.close()
+                except OSError:
+                    pass
+    
+    # Library
+    
+    @property
+    def library(self):
+        """The library index, opened on first use"""
+        with self._library_lock:
+            if self._library is None:
+                try:
+                    self._library = LibraryIndex(os.path.join(self.data_dir, "library.db"))
+                except (OSError, sqlite3.Error) as e:
+                    # Fall back to an index that is rebuilt every run
+                    logger.warning("Library index unavailable: %s", e)
+                    self._library = LibraryIndex(":memory:")
+            return self._library
+    
+    def scan_library(self, output_dir):
+        """Update the library index for output_dir and return the changes"""
+        return self.library.scan(output_dir)
+    
+    def list_library(self, output_dir):
+        """Return the paths of the downloaded audio files in output_dir"""
+        self.library.scan(output_dir)
+        return [track["path"] for track in self.library.tracks(output_dir)]
+
+
+class PhotoImageCache:
+    """Bounded LRU of Tk PhotoImages keyed by video id, used only on the Tk thread"""
+    
+    def __init__(self, max_entries=256, on_evict=None):
+        self.max_entries = max_entries
+        self.on_evict = on_evict
+        self._images = collections.OrderedDict()
+    
+    def __len__(self):
+        return len(self._images)
+    
+    def get(self, key):
+        """Return the image for a key, or None"""
+        image = self._images.get(key)
+        if image is not None:
+            self._images.move_to_end(key)
+        return image
+    
+    def put(self, key, image):
+        self._images[key] = image
+        self._images.move_to_end(key)
+        while len(self._images) > self.max_entries:
+            old_key, _ = self._images.popitem(last=False)
+            if self.on_evict:
+                self.on_evict(old_key)
+    
+    def clear(self):
+        self._images.clear()
+
+
+class VirtualTreeview:
+    """Drop-in for ttk.Treeview that only creates Tk items for the visible rows"""
+    
+    def __init__(self, master, columns=(), sortable=True, **kwargs):
+        kwargs.setdefault("height", 20)
+        self._tree = ttk.Treeview(master, columns=columns, **kwargs)
+        self._columns = tuple(columns)
+        self._rows = kwargs["height"]
+        self._order = []
+        self._values = {}
+        self._images = {}
+        self._positions = {}
+        self._selection = ()
+        self._focus = ""
+        self._top = 0
+        self._counter = itertools.count()
+        self._render_pending = False
+        self._yscrollcommand = None
+        self._sortable = sortable
+        self._sort_column = None
+        self._sort_reverse = False
+        self._resort = False
+        # Called with the ids of the rows on screen after every redraw
+        self.on_render = None
+        
+        self._tree.bind("<<TreeviewSelect>>", self._on_select, add="+")
+        self._tree.bind("<Configure>", self._on_configure, add="+")
+        self._tree.bind("<MouseWheel>", lambda e: self._scroll(-1 if e.delta > 0 else 1), add="+")
+        self._tree.bind("<Button-4>", lambda e: self._scroll(-1), add="+")
+        self._tree.bind("<Button-5>", lambda e: self._scroll(1), add="+")
+        self._tree.bind("<Up>", lambda e: self._step_focus(-1), add="+")
+        self._tree.bind("<Down>", lambda e: self._step_focus(1), add="+")
+        self._tree.bind("<Prior>", lambda e: self._step_focus(-self._rows), add="+")
+        self._tree.bind("<Next>", lambda e: self._step_focus(self._rows), add="+")
+    
+    def __getattr__(self, name):
+        # pack, grid, after, winfo_* and friends go straight to the widget
+        return getattr(self._tree, name)
+    
+    # Model
+    
+    def _position(self, iid):
+        if self._resort:
+            self._apply_sort()
+        if self._positions is None:
+            self._positions = {row: i for i, row in enumerate(self._order)}
+        return self._positions[iid]
+    
+    def insert(self, parent, index, iid=None, values=(), **kwargs):
+        """Add a row; only the model changes until the view is redrawn"""
+        if iid is None:
+            iid = f"I{next(self._counter):05X}"
+        if iid in self._values:
+            raise tk.TclError(f"Item {iid} already exists")
+        
+        self._values[iid] = list(values)
+        if kwargs.get("image"):
+            self._images[iid] = kwargs["image"]
+        if index == tk.END or index >= len(self._order):
+            self._order.append(iid)
+            if self._positions is not None:
+                self._positions[iid] = len(self._order) - 1
+        else:
+            self._order.insert(index, iid)
+            self._positions = None
+        if self._sort_column:
+            self._resort = True
+        self._schedule_render()
+        return iid
+    
+    def delete(self, *items):
+        """Remove rows; pass them all in one call, as each call rebuilds the row order"""
+        doomed = set(items)
+        if not doomed:
+            return
+        if len(doomed) >= len(self._values) and doomed.issuperset(self._values):
+            self.delete_all()
+            return
+        self._order = [iid for iid in self._order if iid not in doomed]
+        for iid in doomed:
+            self._values.pop(iid, None)
+            self._images.pop(iid, None)
+        self._positions = None
+        self._selection = tuple(iid for iid in self._selection if iid not in doomed)
+        if self._focus in doomed:
+            self._focus = ""
+        self._schedule_render()
+    
+    def delete_all(self):
+        """Remove every row without walking the row order"""
+        self._order = []
+        self._values = {}
+        self._images = {}
+        self._positions = {}
+        self._selection = ()
+        self._focus = ""
+        self._top = 0
+        self._resort = False
+        self._schedule_render()
+    
+    def get_children(self, item=""):
+        if self._resort:
+            self._apply_sort()
+        return tuple(self._order)
+    
+    def exists(self, item):
+        return item in self._values
+    
+    def index(self, item):
+        return self._position(item)
+    
+    def move(self, item, parent, index):
+        self._order.remove(item)
+        self._order.insert(index, item)
+        self._positions = None
+        self._schedule_render()
+    
+    def prev(self, item):
+        position = self._position(item)
+        return self._order[position - 1] if position > 0 else ""
+    
+    def next(self, item):
+        position = self._position(item)
+        return self._order[position + 1] if position + 1 < len(self._order) else ""
+    
+    def set(self, item, column=None, value=None):
+        values = self._values[item]
+        if column is None:
+            return dict(zip(self._columns, values))
+        
+        column_index = self._columns.index(column)
+        if value is None:
+            return values[column_index]
+        
+        values.extend([""] * (column_index + 1 - len(values)))
+        values[column_index] = value
+        if self._tree.exists(item):
+            self._tree.set(item, column, value)
+    
+    def item(self, item, option=None, **kwargs):
+        if "values" in kwargs:
+            self._values[item] = list(kwargs["values"])
+            if self._tree.exists(item):
+                self._tree.item(item, values=kwargs["values"])
+        if "image" in kwargs:
+            if kwargs["image"]:
+                self._images[item] = kwargs["image"]
+            else:
+                self._images.pop(item, None)
+            if self._tree.exists(item):
+                self._tree.item(item, image=kwargs["image"])
+        if option is None and not kwargs:
+            return {"text": "", "values": list(self._values[item]), "image": self._images.get(item, "")}
+        if option == "values":
+            return list(self._values[item])
+        if option == "image":
+            return self._images.get(item, "")
+    
+    def sort(self, column, reverse=False):
+        """Reorder the rows by a column's values; rows added later are kept in order"""
+        self._sort_column, self._sort_reverse = column, reverse
+        self._apply_sort()
+        self._schedule_render()
+    
+    def _apply_sort(self):
+        column_index = self._columns.index(self._sort_column)
+        
+        def key(iid):
+            values = self._values[iid]
+            return self._sort_key(values[column_index] if column_index < len(values) else "")
+        
+        self._order.sort(key=key, reverse=self._sort_reverse)
+        self._positions = None
+        self._resort = False
+    
+    @staticmethod
+    def _sort_key(value):
+        # Numbers and m:ss durations sort by value, everything else by text
+        text = str(value).strip()
+        if re.fullmatch(r"\d+(:\d{1,2})*(\.\d+)?", text):
+            seconds = 0.0
+            for part in text.split(":"):
+                seconds = seconds * 60 + float(part)
+            return (0, seconds, "")
+        return (1, 0, text.lower())
+    
+    # Selection
+    
+    def selection(self):
+        return self._selection
+    
+    def selection_set(self, *items):
+        if len(items) == 1 and isinstance(items[0], (list, tuple)):
+            items = items[0]
+        self._selection = tuple(iid for iid in items if iid in self._values)
+        self._tree.selection_set([iid for iid in self._selection if self._tree.exists(iid)])
+    
+    def focus(self, item=None):
+        if item is None:
+            return self._focus if self._focus in self._values else ""
+        self._focus = item
+        if self._tree.exists(item):
+            self._tree.focus(item)
+    
+    def see(self, item):
+        """Scroll so that item is visible"""
+        position = self._position(item)
+        if position < self._top:
+            self._top = position
+        elif position >= self._top + self._rows:
+            self._top = position - self._rows + 1
+        self._render()
+    
+    def _on_select(self, event):
+        selected = self._tree.selection()
+        visible = [iid for iid in self._selection if self._tree.exists(iid)]
+        if tuple(visible) == tuple(selected):
+            # Our own redraw restoring the selection
+            return
+        self._selection = tuple(selected)
+        self._focus = self._tree.focus() or self._focus
+    
+    def _step_focus(self, delta):
+        if not self._order:
+            return "break"
+        position = self._position(self._focus) + delta if self._focus in self._values else 0
+        iid = self._order[max(0, min(position, len(self._order) - 1))]
+        self.see(iid)
+        self.selection_set(iid)
+        self.focus(iid)
+        self._tree.event_generate("<<TreeviewSelect>>")
+        return "break"
+    
+    # Columns, headings and scrolling
+    
+    def heading(self, column, option=None, **kwargs):
+        if self._sortable and "text" in kwargs and "command" not in kwargs:
+            kwargs["command"] = lambda: self.sort(
+                column, reverse=self._sort_column == column and not self._sort_reverse)
+        return self._tree.heading(column, option, **kwargs)
+    
+    def column(self, column, option=None, **kwargs):
+        return self._tree.column(column, option, **kwargs)
+    
+    def bind(self, sequence=None, func=None, add=None):
+        return self._tree.bind(sequence, func, add)
+    
+    def configure(self, **kwargs):
+        if "yscrollcommand" in kwargs:
+            self._yscrollcommand = kwargs.pop("yscrollcommand")
+            self._update_scrollbar()
+        if kwargs:
+            return self._tree.configure(**kwargs)
+    
+    config = configure
+    
+    def yview(self, *args):
+        """Scrollbar protocol: no args returns (first, last), otherwise moveto/scroll"""
+        total = len(self._order)
+        if not args:
+            if not total:
+                return (0.0, 1.0)
+            return (self._top / total, min(1.0, (self._top + self._rows) / total))
+        
+        if args[0] == "moveto":
+            self._top = int(float(args[1]) * total)
+        elif args[0] == "scroll":
+            step = self._rows if args[2] == "pages" else 1
+            self._top += int(args[1]) * step
+        self._render()
+    
+    def _scroll(self, units):
+        self.yview("scroll", units, "units")
+        return "break"
+    
+    def _on_configure(self, event):
+        rowheight = int(ttk.Style().lookup(self._tree.cget("style") or "Treeview", "rowheight") or 20)
+        rows = max(1, (event.height - rowheight) // rowheight)
+        if rows != self._rows:
+            self._rows = rows
+            self._render()
+    
+    def _update_scrollbar(self):
+        if self._yscrollcommand:
+            self._yscrollcommand(*self.yview())
+    
+    def _schedule_render(self):
+        # Coalesce bursts of model changes into one redraw
+        if not self._render_pending:
+            self._render_pending = True
+            self._tree.after_idle(self._render)
+    
+    def _render(self):
+        """Fill the widget with the rows in the visible window"""
+        self._render_pending = False
+        if self._resort:
+            self._apply_sort()
+        total = len(self._order)
+        self._top = max(0, min(self._top, total - self._rows))
+        window = self._order[self._top:self._top + self._rows]
+        
+        if list(self._tree.get_children()) != window:
+            self._tree.delete(*self._tree.get_children())
+            for iid in window:
+                self._tree.insert("", tk.END, iid=iid, values=self._values[iid], image=self._images.get(iid, ""))
+        
+        self._tree.selection_set([iid for iid in self._selection if self._tree.exists(iid)])
+        if self._focus and self._tree.exists(self._focus):
+            self._tree.focus(self._focus)
+        self._update_scrollbar()
+        if self.on_render:
+            self.on_render(window)
+
+
 class YouTubeMusicDownloader:
     def __init__(self, root):
         self.root = root
@@ -25,10 +3479,15 @@ class YouTubeMusicDownloader:
         if os.path.exists(icon_path):
             self.root.iconbitmap(icon_path)
         
-        # Initialize pygame mixer for music playback
-        pygame.mixer.init()
+        # The pygame mixer is initialized in the background once the window is up
+        self.mixer_ready = threading.Event()
+        self.mixer_error = None
+        self._started = False
         self.currently_playing = None
         self.paused = False
+        # Streaming preview: set the event to stop it
+        self.preview_stop = None
+        self.preview_channel = None
         
         # Set default download directory
         self.output_dir = os.path.join(os.path.expanduser("~"), "Downloads")
@@ -37,14 +3496,36 @@ class YouTubeMusicDownloader:
         self.auth_method = tk.StringVar(value="none")
         self.browser_var = tk.StringVar(value="chrome")
         
-        # Download queue and worker thread
-        self.download_queue = queue.Queue()
-        self.queue_active = False
-        self.current_download = None
+        # Download queue and worker pool
         self.download_method = tk.StringVar(value="single")
         self.max_concurrent_downloads = tk.IntVar(value=2)
-        self.active_downloads = 0
-        self.download_threads = []
+        
+        # Headless engine that owns downloads, the queue, search and the library
+        self.engine = DownloadEngine(max_concurrent=self.max_concurrent_downloads.get())
+        self.engine.subscribe(self.on_engine_event)
+        self.engine.on_queue_change = lambda: self.progress_bus.publish(QUEUE_STATUS_JOB, changed=True)
+        self.max_concurrent_downloads.trace_add("write", self.on_max_concurrent_changed)
+        self.connections_var = tk.IntVar(value=self.engine.connections)
+        self.connections_var.trace_add("write", self.on_connections_changed)
+        self.rate_limit_var = tk.IntVar(value=self.engine.limiter.rate // 1024)
+        self.rate_limit_var.trace_add("write", self.on_rate_limit_changed)
+        
+        # Keep the engine's auth settings in step with the Settings tab
+        self.auth_method.trace_add("write", self.on_auth_changed)
+        self.browser_var.trace_add("write", self.on_auth_changed)
+        
+        # Progress from worker threads, applied to the UI ten times a second
+        self.progress_bus = ProgressBus(interval_ms=100)
+        
+        # Current search (later pages are fetched on demand)
+        self.current_search = None
+        self.search_generation = 0
+        # Thumbnails: decoded images for recent videos, and the result rows showing each video
+        self.thumbnail_images = PhotoImageCache(on_evict=self._thumbnail_evicted)
+        self.thumbnail_rows = collections.defaultdict(set)
+        # Rows shown before the thumbnail cache was open; they are loaded once it is
+        self._waiting_thumbnails = None
+        self._storage_open = False
         
         # Create main frame
         main_frame = ttk.Frame(root, padding="20 20 20 20")
@@ -94,11 +3575,93 @@ class YouTubeMusicDownloader:
         # Store search results
         self.search_results = []
         self.downloaded_songs = []
+        
+        # Playlists being listed into the queue
+        self.playlist_expansions = []
+        # Duplicate checks, submissions and archive settings run in order on the storage thread,
+        # once the engine's storage is open, so SQLite reads and file hashing stay off the Tk thread
+        self._storage_tasks = queue.Queue()
+        self._library_dir = None
+        self._library_scan_running = False
+        self._library_rescan = False
+        self._library_probe_running = False
+        
+        self.progress_bus.attach(self.root, self.apply_progress_updates)
+        
+        # Anything the first frame doesn't need waits until the window is on screen
+        self.root.bind("<Map>", self._on_first_map, add="+")
+        
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+    
+    def _on_first_map(self, event):
+        """Finish starting up once the main window has been mapped"""
+        if event.widget is not self.root or self._started:
+            return
+        self._started = True
+        # Idle callbacks run after Tk has drawn the window
+        self.root.after_idle(self.finish_startup)
+    
+    def finish_startup(self):
+        """Load the library, storage and saved queue, and start audio and yt-dlp, in the background"""
+        threading.Thread(target=self._warm_up, daemon=True).start()
         self.update_song_list()
         
-        # Start queue processor
+        # Local /metrics endpoint for monitoring, off unless a port is set
+        if os.environ.get("YTMD_METRICS_PORT"):
+            try:
+                self.engine.serve_metrics(int(os.environ["YTMD_METRICS_PORT"]))
+            except (ValueError, OSError) as e:
+                logger.warning("Metrics endpoint unavailable: %s", e)
+        
+        # The archive, journal and caches load their indexes off the Tk thread; the saved queue follows
+        threading.Thread(target=self._open_storage, daemon=True).start()
+    
+    def _open_storage(self):
+        """Open the engine's storage and re-queue the saved jobs, then run the storage tasks the UI hands over"""
+        self.engine.open_storage()
+        restored = self.engine.restore()
+        self.root.after(0, lambda: self._storage_opened(restored))
+        while True:
+            task = self._storage_tasks.get()
+            try:
+                task()
+            except Exception:
+                logger.exception("Storage task failed")
+    
+    def _storage_opened(self, restored):
+        """Show the restored items and load the thumbnails that waited for the cache, then start the queue"""
+        self._storage_open = True
+        self.restore_queue(restored)
+        if self._waiting_thumbnails:
+            self._request_thumbnails([iid for iid in self._waiting_thumbnails if self.results_tree.exists(iid)])
+            self._waiting_thumbnails = None
         self.start_queue_processor()
     
+    def _warm_up(self):
+        """Initialize the mixer and import yt-dlp off the Tk thread"""
+        try:
+            pygame.mixer.init()
+        except Exception as e:
+            self.mixer_error = str(e)
+            logger.warning("Audio playback unavailable: %s", e)
+        else:
+            self.root.after(0, lambda: self.set_volume(self.volume_scale.get()))
+        finally:
+            self.mixer_ready.set()
+        
+        # Otherwise the first search or download would wait for this import
+        importlib.import_module("yt_dlp")
+    
+    def audio_available(self):
+        """Return True if the mixer is up, otherwise tell the user why playback can't start"""
+        if not self.mixer_ready.is_set():
+            messagebox.showwarning("Playback", "Audio is still starting up, please try again in a moment")
+            return False
+        if self.mixer_error:
+            messagebox.showerror("Playback Error", f"Audio playback is unavailable: {self.mixer_error}")
+            return False
+        return True
+    
     def setup_search_tab(self):
         # Search Entry
         search_frame = ttk.Frame(self.search_tab)
@@ -118,8 +3681,11 @@ class YouTubeMusicDownloader:
         results_frame = ttk.LabelFrame(self.search_tab, text="Search Results")
         results_frame.pack(fill=tk.BOTH, expand=True, pady=10)
         
-        # Create treeview for search results
-        self.results_tree = ttk.Treeview(results_frame, columns=("title", "duration", "channel"), show="headings")
+        # Create treeview for search results, with a thumbnail in the tree column
+        ttk.Style().configure("Thumbnail.Treeview", rowheight=50)
+        self.results_tree = VirtualTreeview(results_frame, columns=("title", "duration", "channel"),
+                                            show="tree headings", style="Thumbnail.Treeview")
+        self.results_tree.column("#0", width=90, stretch=False)
         self.results_tree.heading("title", text="Title")
         self.results_tree.heading("duration", text="Duration")
         self.results_tree.heading("channel", text="Channel")
@@ -137,6 +3703,9 @@ class YouTubeMusicDownloader:
         # Double-click to select
         self.results_tree.bind("<Double-1>", self.select_search_result)
         
+        # Thumbnails are only loaded for the rows on screen
+        self.results_tree.on_render = self._request_thumbnails
+        
         # Buttons frame
         buttons_frame = ttk.Frame(self.search_tab)
         buttons_frame.pack(fill=tk.X, pady=10)
@@ -147,9 +3716,19 @@ class YouTubeMusicDownloader:
         add_to_queue_button = ttk.Button(buttons_frame, text="Add to Queue", command=self.add_selected_to_queue)
         add_to_queue_button.pack(side=tk.LEFT, padx=5)
         
+        preview_button = ttk.Button(buttons_frame, text="Preview", command=self.play_preview)
+        preview_button.pack(side=tk.LEFT, padx=5)
+        
+        stop_preview_button = ttk.Button(buttons_frame, text="Stop Preview", command=self.stop_preview)
+        stop_preview_button.pack(side=tk.LEFT, padx=5)
+        
         clear_button = ttk.Button(buttons_frame, text="Clear", command=self.clear_search)
         clear_button.pack(side=tk.LEFT, padx=5)
         
+        self.load_more_button = ttk.Button(buttons_frame, text="Load More", command=self.load_more_results,
+                                           state=tk.DISABLED)
+        self.load_more_button.pack(side=tk.RIGHT, padx=5)
+        
         # Status
         self.search_status_label = ttk.Label(self.search_tab, text="")
         self.search_status_label.pack(pady=(10, 0))
@@ -250,9 +3829,34 @@ class YouTubeMusicDownloader:
         # Concurrent downloads
         ttk.Label(settings_frame, text="Max Concurrent Downloads:").grid(row=0, column=0, padx=10, pady=10, sticky=tk.W)
         
-        concurrent_spinner = ttk.Spinbox(settings_frame, from_=1, to=5, textvariable=self.max_concurrent_downloads, width=5)
+        concurrent_spinner = ttk.Spinbox(settings_frame, from_=1, to=16, textvariable=self.max_concurrent_downloads, width=5)
         concurrent_spinner.grid(row=0, column=1, padx=10, pady=10, sticky=tk.W)
         
+        # Let throughput and errors pick the level, up to the maximum above
+        self.adaptive_var = tk.BooleanVar(value=self.engine.concurrency.enabled)
+        adaptive_check = ttk.Checkbutton(settings_frame, text="Adjust concurrency automatically (up to the maximum)",
+                                         variable=self.adaptive_var, command=self.on_adaptive_changed)
+        adaptive_check.grid(row=2, column=0, columnspan=2, padx=10, pady=(0, 10), sticky=tk.W)
+        
+        # Parallel fragment connections per download
+        ttk.Label(settings_frame, text="Connections per Download:").grid(row=1, column=0, padx=10, pady=(0, 10), sticky=tk.W)
+        
+        connections_spinner = ttk.Spinbox(settings_frame, from_=1, to=16, textvariable=self.connections_var, width=5)
+        connections_spinner.grid(row=1, column=1, padx=10, pady=(0, 10), sticky=tk.W)
+        
+        # Bandwidth cap shared by all downloads; a direct download gets the largest share
+        ttk.Label(settings_frame, text="Bandwidth Limit (KB/s, 0 = unlimited):").grid(row=1, column=2, padx=10, pady=(0, 10), sticky=tk.W)
+        
+        rate_limit_spinner = ttk.Spinbox(settings_frame, from_=0, to=1000000, increment=64,
+                                         textvariable=self.rate_limit_var, width=8)
+        rate_limit_spinner.grid(row=1, column=3, padx=10, pady=(0, 10), sticky=tk.W)
+        
+        # Duplicate detection
+        self.verify_archive_var = tk.BooleanVar(value=False)
+        verify_check = ttk.Checkbutton(settings_frame, text="Verify already-downloaded files by content hash",
+                                       variable=self.verify_archive_var, command=self.on_verify_archive_changed)
+        verify_check.grid(row=0, column=2, padx=10, pady=10, sticky=tk.W)
+        
         # Queue controls
         controls_frame = ttk.Frame(self.queue_tab)
         controls_frame.pack(fill=tk.X, padx=10, pady=10)
@@ -271,17 +3875,23 @@ class YouTubeMusicDownloader:
         queue_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
         
         # Create treeview for queue
-        self.queue_tree = ttk.Treeview(queue_frame, 
-                                     columns=("title", "status", "progress"), 
-                                     show="headings")
+        # Not sortable: row order mirrors the download order
+        self.queue_tree = VirtualTreeview(queue_frame, 
+                                          columns=("title", "status", "progress") + JobTimings.PHASES, 
+                                          show="headings", sortable=False)
         self.queue_tree.heading("title", text="Title")
         self.queue_tree.heading("status", text="Status")
         self.queue_tree.heading("progress", text="Progress")
         
-        self.queue_tree.column("title", width=400)
+        self.queue_tree.column("title", width=300)
         self.queue_tree.column("status", width=100)
         self.queue_tree.column("progress", width=100)
         
+        # Seconds each job spent per phase, filled in as the phases finish
+        for phase, heading in zip(JobTimings.PHASES, ("Wait", "Extract", "Download", "Convert", "Library")):
+            self.queue_tree.heading(phase, text=heading)
+            self.queue_tree.column(phase, width=60, anchor=tk.E)
+        
         scrollbar = ttk.Scrollbar(queue_frame, orient=tk.VERTICAL, command=self.queue_tree.yview)
         self.queue_tree.configure(yscrollcommand=scrollbar.set)
         
@@ -291,6 +3901,7 @@ class YouTubeMusicDownloader:
         # Right-click menu for queue items
         self.queue_menu = tk.Menu(self.queue_tree, tearoff=0)
         self.queue_menu.add_command(label="Remove", command=self.remove_from_queue)
+        self.queue_menu.add_command(label="Move to Top", command=lambda: self.move_in_queue("top"))
         self.queue_menu.add_command(label="Move Up", command=lambda: self.move_in_queue("up"))
         self.queue_menu.add_command(label="Move Down", command=lambda: self.move_in_queue("down"))
         
@@ -300,160 +3911,277 @@ class YouTubeMusicDownloader:
         self.queue_status_label = ttk.Label(self.queue_tab, text="Queue is empty")
         self.queue_status_label.pack(pady=10)
     
-    def start_queue_processor(self):
-        """Start the queue processor thread"""
-        self.queue_active = True
-        threading.Thread(target=self.process_queue, daemon=True).start()
+    def restore_queue(self, restored):
+        """Show the items the engine re-queued from an interrupted session"""
+        for handle in restored:
+            # Restored jobs may have started while the storage thread handed them over
+            if handle.state != "removed" and not self.queue_tree.exists(handle.id):
+                progress = "Restored" if handle.state == "queued" else ""
+                self.queue_tree.insert("", tk.END, iid=handle.id,
+                                       values=(handle.title, handle.state.capitalize(), progress))
+        
+        if restored:
+            self.update_queue_status()
     
-    def process_queue(self):
-        """Process the download queue"""
-        while True:
-            if self.queue_active and self.active_downloads < self.max_concurrent_downloads.get():
-                try:
-                    # Get the next item from the queue (non-blocking)
-                    item = self.download_queue.get_nowait()
-                    
-                    # Update status
-                    self.root.after(0, lambda i=item: self.update_queue_item_status(i["id"], "Downloading"))
-                    
-                    # Start download in a new thread
-                    self.active_downloads += 1
-                    download_thread = threading.Thread(
-                        target=self.download_queued_item, 
-                        args=(item,),
-                        daemon=True
-                    )
-                    download_thread.start()
-                    self.download_threads.append(download_thread)
-                    
-                except queue.Empty:
-                    # Queue is empty, nothing to do
-                    pass
+    def on_auth_changed(self, *args):
+        """Pass the auth settings from the Tk variables on to the engine"""
+        if self.auth_method.get() == "browser_cookies":
+            self.engine.cookie_browser = self.browser_var.get()
+        else:
+            self.engine.cookie_browser = None
+    
+    def on_engine_event(self, handle, event):
+        """Turn engine job events into UI updates (called on worker threads)"""
+        job_id = DIRECT_DOWNLOAD_JOB if handle.direct else handle.id
+        
+        if event["type"] == "progress":
+            percent = event["percent"]
+            if not handle.direct:
+                self.progress_bus.publish(job_id, progress=f"{percent:.1f}%")
+                return
             
-            # Clean up completed threads
-            self.download_threads = [t for t in self.download_threads if t.is_alive()]
+            self.progress_bus.publish(job_id, percent=percent, label=f"Downloading: {percent:.1f}%")
             
-            # Update queue status
-            self.root.after(0, self.update_queue_status)
+            # Update speed and ETA if available
+            speed = event.get("speed")
+            if speed:
+                speed_str = f"{speed/1024/1024:.2f} MB/s"
+                eta = event.get("eta")
+                if eta:
+                    self.progress_bus.publish(job_id, status=f"Speed: {speed_str} | ETA: {eta} seconds")
+                else:
+                    self.progress_bus.publish(job_id, status=f"Speed: {speed_str}")
+            return
+        
+        state = event["state"]
+        if not handle.direct:
+            self.progress_bus.publish(job_id, phases=handle.timings.snapshot()["phases"])
+        
+        if handle.direct:
+            self.on_direct_download_state(handle, state)
+        elif state == "downloading":
+            self.progress_bus.publish(job_id, status="Downloading")
+        elif state == "converting":
+            self.progress_bus.publish(job_id, progress="Converting...")
+        elif state == "completed":
+            self.progress_bus.publish(job_id, status="Completed", progress="100%")
             
-            # Sleep to prevent high CPU usage
-            time.sleep(0.5)
+            # Update song list if needed
+            if handle.output_dir == self.output_dir:
+                self.root.after(0, self.update_song_list)
+        elif state == "failed":
+            self.progress_bus.publish(job_id, status=f"Error: {handle.error[:30]}...")
+        elif state == "retrying":
+            label = ERROR_CLASS_LABELS.get(handle.error_class, handle.error_class)
+            self.progress_bus.publish(job_id, progress="",
+                                      status=f"Retry {event['attempt']}/{event['retries']} in "
+                                             f"{event['delay']:.0f}s ({label})")
+        elif state == "queued":
+            self.progress_bus.publish(job_id, status="Queued", progress="Waiting...")
+        elif state == "skipped":
+            self.progress_bus.publish(job_id, status=f"Skipped ({handle.skip_reason})", progress="")
     
-    def download_queued_item(self, item):
-        """Download a queued item"""
-        try:
-            # Configure yt-dlp options
-            audio_format = item["format"]
-            audio_quality = item["quality"]
-            output_dir = item["output_dir"]
-            url = item["url"]
-            item_id = item["id"]
-            
-            # Create output directory if it doesn't exist
-            if not os.path.exists(output_dir):
-                os.makedirs(output_dir)
+    def on_direct_download_state(self, handle, state):
+        """Report state changes of the Download tab's direct download"""
+        if state == "converting":
+            self.progress_bus.publish(DIRECT_DOWNLOAD_JOB, label="Download complete. Converting...")
+            return
+        if state not in ("completed", "failed", "skipped"):
+            return
+        
+        if state == "skipped":
+            self.progress_bus.publish(DIRECT_DOWNLOAD_JOB, label="Skipped",
+                                      status=f"Already {handle.skip_reason}: {handle.title}")
+        elif state == "completed":
+            # Show success message
+            self.progress_bus.publish(DIRECT_DOWNLOAD_JOB, label="Download Complete!",
+                                      status=f"Saved to: {handle.filename}")
+            self.root.after(0, lambda: messagebox.showinfo("Success", f"Downloaded: {handle.title}"))
             
-            ydl_opts = {
-                'format': 'bestaudio/best',
-                'postprocessors': [{
-                    'key': 'FFmpegExtractAudio',
-                    'preferredcodec': audio_format,
-                    'preferredquality': audio_quality,
-                }],
-                'outtmpl': os.path.join(output_dir, '%(title)s.%(ext)s'),
-                'progress_hooks': [lambda d: self.update_queue_progress_hook(d, item_id)],
-                'quiet': True,
-                'no_warnings': True
-            }
+            # Update song list
+            self.root.after(0, self.update_song_list)
+        else:
+            error_msg = handle.error
+            self.progress_bus.publish(DIRECT_DOWNLOAD_JOB, label="Error!", status=error_msg)
             
-            # Add authentication if selected
-            if self.auth_method.get() == "browser_cookies":
-                browser = self.browser_var.get()
-                ydl_opts['cookiesfrombrowser'] = (browser, None, None, None)
+            # YouTube wants a signed-in session
+            forbidden = handle.error_class == "auth"
+            self.root.after(0, lambda: self.show_download_error(error_msg, forbidden))
+        
+        # Reset UI
+        self.progress_bus.publish(DIRECT_DOWNLOAD_JOB, percent=0)
+        self.root.after(0, lambda: self.download_button.config(state=tk.NORMAL))
+    
+    def apply_progress_updates(self, updates):
+        """Apply a batch of coalesced progress updates (runs on the Tk thread)"""
+        # New queue rows go in first, so this batch's updates to them aren't lost
+        self._insert_queue_rows(updates.get(QUEUE_STATUS_JOB, {}).get("rows", ()))
+        
+        for job_id, fields in updates.items():
+            if job_id == DIRECT_DOWNLOAD_JOB:
+                if "percent" in fields:
+                    self.progress_bar["value"] = fields["percent"]
+                if "label" in fields:
+                    self.progress_label.config(text=fields["label"])
+                if "status" in fields:
+                    self.status_label.config(text=fields["status"])
+                continue
             
-            # Download the audio
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=True)
-                filename = ydl.prepare_filename(info)
-                base_filename = os.path.splitext(filename)[0] + f".{audio_format}"
+            if job_id == QUEUE_STATUS_JOB:
+                self.update_queue_status()
+                continue
             
-            # Update queue item status
-            self.root.after(0, lambda: self.update_queue_item_status(item_id, "Completed"))
+            if job_id == SEARCH_JOB:
+                for generation, index, result in fields.get("results", ()):
+                    self._add_search_result(generation, index, result)
+                if "finished" in fields:
+                    self._finish_search(*fields["finished"])
+                continue
             
-            # Update song list if needed
-            if output_dir == self.output_dir:
-                self.root.after(0, self.update_song_list)
+            if job_id == THUMBNAILS_JOB:
+                for video_id, data in fields["loaded"]:
+                    self._thumbnail_ready(video_id, data)
+                continue
             
-        except Exception as e:
-            # Update queue item status with error
-            self.root.after(0, lambda: self.update_queue_item_status(item_id, f"Error: {str(e)[:30]}..."))
-        
-        finally:
-            # Decrement active downloads counter
-            self.active_downloads -= 1
-            self.download_queue.task_done()
+            # Only the rows that changed are touched
+            if "status" in fields:
+                self.update_queue_item_status(job_id, fields["status"])
+            if "progress" in fields:
+                self.update_queue_item_progress(job_id, fields["progress"])
+            if "phases" in fields:
+                self.update_queue_item_phases(job_id, fields["phases"])
     
-    def update_queue_progress_hook(self, d, item_id):
-        """Update progress for a queued download"""
-        if d['status'] == 'downloading':
-            # Calculate download progress
-            downloaded = d.get('downloaded_bytes', 0)
-            total = d.get('total_bytes', 0) or d.get('total_bytes_estimate', 0)
-            
-            if total > 0:
-                percent = (downloaded / total) * 100
-                self.root.after(0, lambda: self.update_queue_item_progress(item_id, f"{percent:.1f}%"))
+    def on_close(self):
+        """Flush the queue journal and close pooled sessions before the window closes"""
+        for expansion in self.playlist_expansions:
+            expansion["stop"].set()
+        self.engine.close()
+        self.root.destroy()
+    
+    def start_queue_processor(self):
+        """Start handing queued items to the download workers"""
+        self.engine.resume()
+    
+    def on_max_concurrent_changed(self, *args):
+        """Apply a new concurrency limit from the Queue tab"""
+        try:
+            max_downloads = self.max_concurrent_downloads.get()
+        except tk.TclError:
+            # Spinbox is being edited and holds no valid number yet
+            return
+        if max_downloads > 0:
+            self.engine.set_max_concurrent(max_downloads)
+    
+    def on_adaptive_changed(self):
+        """Hand the concurrency level to the adaptive controller, or take it back"""
+        try:
+            max_downloads = self.max_concurrent_downloads.get()
+        except tk.TclError:
+            max_downloads = self.engine.dispatcher.max_workers
+        self.engine.set_adaptive(self.adaptive_var.get(), max(1, max_downloads))
+        self.update_queue_status()
+    
+    def on_connections_changed(self, *args):
+        """Apply a new per-download connection count (used from the next download on)"""
+        try:
+            connections = self.connections_var.get()
+        except tk.TclError:
+            return
+        if connections > 0:
+            self.engine.connections = connections
+    
+    def on_rate_limit_changed(self, *args):
+        """Apply a new bandwidth cap to running and future downloads"""
+        try:
+            rate_limit = self.rate_limit_var.get()
+        except tk.TclError:
+            return
+        if rate_limit >= 0:
+            self.engine.limiter.set_rate(rate_limit * 1024)
+            self.update_queue_status()
+    
+    def on_verify_archive_changed(self):
+        """Toggle content-hash checks of archived downloads"""
+        verify_files = self.verify_archive_var.get()
         
-        elif d['status'] == 'finished':
-            self.root.after(0, lambda: self.update_queue_item_progress(item_id, "Converting..."))
+        def apply():
+            if self.engine.archive is not None:
+                self.engine.archive.verify_files = verify_files
+        
+        self._storage_tasks.put(apply)
     
     def update_queue_item_status(self, item_id, status):
         """Update the status of a queue item"""
-        for item in self.queue_tree.get_children():
-            if item == item_id:
-                self.queue_tree.set(item, "status", status)
-                break
+        if self.queue_tree.exists(item_id):
+            self.queue_tree.set(item_id, "status", status)
     
     def update_queue_item_progress(self, item_id, progress):
         """Update the progress of a queue item"""
-        for item in self.queue_tree.get_children():
-            if item == item_id:
-                self.queue_tree.set(item, "progress", progress)
-                break
+        if self.queue_tree.exists(item_id):
+            self.queue_tree.set(item_id, "progress", progress)
+    
+    def update_queue_item_phases(self, item_id, phases):
+        """Show the seconds a queue item has spent in each finished phase"""
+        if self.queue_tree.exists(item_id):
+            for phase in JobTimings.PHASES:
+                if phase in phases:
+                    self.queue_tree.set(item_id, phase, f"{phases[phase]:.1f}s")
     
     def update_queue_status(self):
         """Update the queue status label"""
-        queue_size = self.download_queue.qsize()
-        active = self.active_downloads
-        status = "active" if self.queue_active else "paused"
+        queue_size = self.engine.pending_count
+        active = self.engine.active_count
+        status = "Paused" if self.engine.paused else "Active"
+        if self.engine.breaker.state == "open":
+            status = f"Paused, YouTube is rate-limiting (resuming in {self.engine.breaker.reopens_in or 0:.0f}s)"
+        retrying = self.engine.retrying_count
+        retrying = f" | Waiting to retry: {retrying}" if retrying else ""
+        
+        stats = self.engine.stage_stats()
+        download, transcode = stats["download"], stats["transcode"]
+        converting = transcode["active"] + transcode["queued"]
+        
+        slots = ""
+        concurrency = ""
+        if self.engine.concurrency.enabled:
+            slots = f" of {download['max_concurrent']} (auto)"
+            concurrency = f"\nConcurrency: {self.engine.concurrency.reason}"
+        
+        limit = ""
+        if download["rate_limit"]:
+            limit = f" (limit {download['rate_limit'] // 1024} KB/s)"
+        
+        listing = ""
+        if self.playlist_expansions:
+            added = sum(expansion["added"] for expansion in self.playlist_expansions)
+            listing = f" | Listing playlists: {added} added"
         
         self.queue_status_label.config(
-            text=f"Queue Status: {status.capitalize()} | Items in queue: {queue_size} | Active downloads: {active}"
+            text=f"Queue Status: {status} | Items in queue: {queue_size} | Active downloads: {active}{slots}"
+                 f" | Converting: {converting}{retrying}{listing}\n"
+                 f"Download: {download['items_per_minute']:.1f}/min, {download['mb_per_second']:.2f} MB/s{limit}"
+                 f" | Convert: {transcode['items_per_minute']:.1f}/min{concurrency}"
         )
     
     def start_queue(self):
         """Start/resume the download queue"""
-        self.queue_active = True
+        self.engine.resume()
         self.update_queue_status()
     
     def pause_queue(self):
         """Pause the download queue"""
-        self.queue_active = False
+        self.engine.pause()
         self.update_queue_status()
     
     def clear_queue(self):
         """Clear all items from the download queue"""
-        # Clear the queue
-        while not self.download_queue.empty():
-            try:
-                self.download_queue.get_nowait()
-                self.download_queue.task_done()
-            except queue.Empty:
-                break
+        # Stop listing playlists, then clear the pending items (running downloads keep going)
+        for expansion in self.playlist_expansions:
+            expansion["stop"].set()
+        self.engine.clear()
         
         # Clear the treeview
-        for item in self.queue_tree.get_children():
-            self.queue_tree.delete(item)
+        self.queue_tree.delete_all()
         
         self.update_queue_status()
     
@@ -468,8 +4196,8 @@ class YouTubeMusicDownloader:
         """Remove selected item from queue"""
         selected = self.queue_tree.selection()
         if selected:
-            # Note: This only removes from the UI, not from the actual queue
-            # For a complete implementation, you would need to track queue items
+            # Pending items are dropped from the queue; running ones finish
+            self.engine.remove(selected[0])
             self.queue_tree.delete(selected[0])
     
     def move_in_queue(self, direction):
@@ -479,41 +4207,80 @@ class YouTubeMusicDownloader:
             return
         
         item = selected[0]
-        index = self.queue_tree.index(item)
-        
-        if direction == "up" and index > 0:
-            self.queue_tree.move(item, "", index - 1)
-        elif direction == "down":
-            self.queue_tree.move(item, "", index + 1)
-    
-    def add_to_queue(self, url, title):
-        """Add a URL to the download queue"""
-        # Create a unique ID for this queue item
-        item_id = f"item_{int(time.time())}_{len(self.queue_tree.get_children())}"
-        
-        # Add to queue data structure
-        queue_item = {
-            "id": item_id,
-            "url": url,
-            "title": title,
-            "format": self.format_var.get(),
-            "quality": self.quality_var.get(),
-            "output_dir": self.dir_entry.get(),
-            "added": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        }
         
-        self.download_queue.put(queue_item)
+        # The row only moves if the engine did, so the view keeps matching the download order;
+        # running and finished items can't be reordered
+        if direction == "top":
+            if self.engine.move_to_top(item):
+                self.queue_tree.move(item, "", 0)
+            return
         
-        # Add to queue UI
-        self.queue_tree.insert("", tk.END, iid=item_id, values=(title, "Queued", "Waiting..."))
+        # Swap with the neighbouring row in both the queue and the view
+        neighbour = self.queue_tree.prev(item) if direction == "up" else self.queue_tree.next(item)
+        if not neighbour:
+            return
         
-        # Update queue status
-        self.update_queue_status()
+        if self.engine.swap(item, neighbour):
+            self.queue_tree.move(item, "", self.queue_tree.index(neighbour))
+    
+    def check_quality(self):
+        """Normalise the typed audio quality (e.g. "192k" to "192"), or tell the user why it can't be used"""
+        try:
+            self.quality_var.set(DownloadEngine.normalize_quality(self.quality_var.get()))
+        except ValueError as e:
+            messagebox.showerror("Invalid Quality", str(e))
+            return False
+        return True
+    
+    def confirm_duplicate(self, url, title, then):
+        """Check the archive and queue on the storage thread, then call then(skip_duplicates) unless declined"""
+        video_id = extract_video_id(url)
+        if not video_id:
+            then(True)
+            return
         
-        # Switch to queue tab
-        self.notebook.select(self.queue_tab)
+        audio_format = self.format_var.get()
+        
+        def check():
+            reason = self.engine.find_duplicate(video_id, audio_format)
+            self.root.after(0, lambda: self._ask_about_duplicate(reason, url, title, audio_format, then))
         
-        return item_id
+        self._storage_tasks.put(check)
+    
+    def _ask_about_duplicate(self, reason, url, title, audio_format, then):
+        """Download (skipping duplicates found later), download again on the user's say-so, or do nothing"""
+        if reason == "queued":
+            messagebox.showinfo("Already Queued", f"This video is already in the queue as {audio_format.upper()}:\n{title or url}")
+            return
+        if reason == "downloaded":
+            if messagebox.askyesno("Already Downloaded",
+                                   f"This video was already downloaded as {audio_format.upper()}:\n{title or url}\n\n"
+                                   "Download it again?"):
+                then(False)
+            return
+        then(True)
+    
+    def add_to_queue(self, url, title, skip_duplicates=True, on_done=None):
+        """Queue a URL on the storage thread; on_done(handle) runs on the Tk thread ("skipped" for a duplicate)"""
+        settings = (self.format_var.get(), self.quality_var.get(), self.dir_entry.get())
+        
+        def submit():
+            handle = self.engine.submit(url, *settings, title=title, skip_duplicates=skip_duplicates)
+            if handle.state != "skipped":
+                self.progress_bus.append(QUEUE_STATUS_JOB, "rows", handle)
+            if on_done:
+                self.root.after(0, lambda: on_done(handle))
+        
+        self._storage_tasks.put(submit)
+    
+    def _report_queued(self, handle, title, announce=True):
+        """Tell the user whether an item was queued or skipped as a duplicate"""
+        if handle.state == "skipped":
+            messagebox.showinfo("Queue", f"Skipped, already {handle.skip_reason}:\n{title}")
+            return
+        self.notebook.select(self.queue_tab)
+        if announce:
+            messagebox.showinfo("Queue", f"Added to download queue:\n{title}")
     
     def start_download(self):
         """Start the download process based on selected method"""
@@ -521,44 +4288,112 @@ class YouTubeMusicDownloader:
         if not url:
             messagebox.showwarning("Warning", "Please enter a YouTube URL")
             return
+        if not self.check_quality():
+            return
         
-        # Get video info first
+        if is_playlist_url(url):
+            self.start_playlist(url)
+            return
+        
+        method = self.download_method.get()
+        self.confirm_duplicate(url, None,
+                               lambda skip_duplicates: self._fetch_info_then_confirm(url, method, skip_duplicates))
+    
+    def _fetch_info_then_confirm(self, url, method, skip_duplicates):
+        """Get the video info off the Tk thread (the download reuses it through the info cache)"""
+        self.download_button.config(state=tk.DISABLED)
+        self.progress_label.config(text="Getting video info...")
+        threading.Thread(target=self._fetch_download_info, args=(url, method, skip_duplicates), daemon=True).start()
+    
+    def _fetch_download_info(self, url, method, skip_duplicates):
         try:
-            with yt_dlp.YoutubeDL({'quiet': True}) as ydl:
-                info = ydl.extract_info(url, download=False)
-                title = info.get('title', 'Unknown')
-                duration = self._format_duration(info.get('duration', 0))
-                
-                # Confirm download
-                if not messagebox.askyesno("Confirm Download", 
-                                          f"Do you want to download:\n{title}\nDuration: {duration}?"):
-                    return
-                
-                # Check download method
-                if self.download_method.get() == "queue":
-                    # Add to queue
-                    self.add_to_queue(url, title)
-                    messagebox.showinfo("Queue", f"Added to download queue:\n{title}")
-                else:
-                    # Direct download
-                    self.download_button.config(state=tk.DISABLED)
-                    self.progress_label.config(text="Preparing download...")
-                    self.status_label.config(text="")
-                    
-                    # Start download in a separate thread
-                    threading.Thread(target=self.download_audio, args=(url,), daemon=True).start()
-                
-        except Exception as e:
+            info = self.engine.get_video_info(url)
+        except Exception:
+            info = None
+        self.root.after(0, lambda: self._confirm_download(url, info, method, skip_duplicates))
+    
+    def _confirm_download(self, url, info, method, skip_duplicates):
+        """Confirm a download once its info has been fetched, then start it"""
+        self.download_button.config(state=tk.NORMAL)
+        self.progress_label.config(text="")
+        
+        if info:
+            title = info.get('title', 'Unknown')
+            duration = self._format_duration(info.get('duration', 0))
+            
+            # Confirm download
+            if not messagebox.askyesno("Confirm Download", 
+                                      f"Do you want to download:\n{title}\nDuration: {duration}?"):
+                return
+        else:
             # If we can't get info, just confirm with the URL
-            if self.download_method.get() == "queue":
-                if messagebox.askyesno("Confirm Download", f"Unable to get video info. Add this URL to queue?\n{url}"):
-                    self.add_to_queue(url, f"Unknown ({url[-11:] if len(url) > 11 else url})")
-            else:
-                if messagebox.askyesno("Confirm Download", f"Unable to get video info. Download this URL?\n{url}"):
-                    self.download_button.config(state=tk.DISABLED)
-                    self.progress_label.config(text="Preparing download...")
-                    self.status_label.config(text="")
-                    threading.Thread(target=self.download_audio, args=(url,), daemon=True).start()
+            title = f"Unknown ({url[-11:] if len(url) > 11 else url})"
+            action = "Add this URL to queue" if method == "queue" else "Download this URL"
+            if not messagebox.askyesno("Confirm Download", f"Unable to get video info. {action}?\n{url}"):
+                return
+        
+        # Check download method
+        if method == "queue":
+            # Add to queue (it may have been queued or downloaded while the info was fetched)
+            self.add_to_queue(url, title, skip_duplicates,
+                              on_done=lambda handle: self._report_queued(handle, title, announce=bool(info)))
+        else:
+            # Direct download
+            self.download_button.config(state=tk.DISABLED)
+            self.progress_label.config(text="Preparing download...")
+            self.status_label.config(text="")
+            
+            # Get output directory from entry field (in case it was edited manually)
+            self.output_dir = self.dir_entry.get()
+            
+            if self.engine.cookie_browser:
+                self.status_label.config(text=f"Using cookies from {self.engine.cookie_browser}")
+            
+            # Start download on its own thread (settings are read here, on the Tk thread)
+            settings = (self.format_var.get(), self.quality_var.get(), self.output_dir)
+            self._storage_tasks.put(lambda: self.engine.submit(url, *settings, direct=True,
+                                                               skip_duplicates=skip_duplicates))
+    
+    def start_playlist(self, url):
+        """Queue every video of a playlist or channel while it is being listed"""
+        if not messagebox.askyesno("Confirm Playlist",
+                                   f"Add every video of this playlist or channel to the queue?\n{url}"):
+            return
+        
+        expansion = {"url": url, "added": 0, "skipped": 0, "stop": None}
+        expansion["stop"] = self.engine.submit_playlist(
+            url, self.format_var.get(), self.quality_var.get(), self.dir_entry.get(),
+            on_submit=lambda handle: self._on_playlist_entry(expansion, handle),
+            on_done=lambda count, error: self.root.after(0, lambda: self._finish_playlist(expansion, error)))
+        self.playlist_expansions.append(expansion)
+        
+        self.notebook.select(self.queue_tab)
+        self.update_queue_status()
+    
+    def _on_playlist_entry(self, expansion, handle):
+        """Count a listed playlist entry and publish its queue row (called on the listing thread)"""
+        if handle.state == "skipped":
+            expansion["skipped"] += 1
+            return
+        expansion["added"] += 1
+        self.progress_bus.append(QUEUE_STATUS_JOB, "rows", handle)
+    
+    def _insert_queue_rows(self, handles):
+        """Insert queue rows for jobs queued since the last UI tick"""
+        for handle in handles:
+            if handle.state != "removed" and not self.queue_tree.exists(handle.id):
+                progress = "Waiting..." if handle.state == "queued" else ""
+                self.queue_tree.insert("", tk.END, iid=handle.id,
+                                       values=(handle.title, handle.state.capitalize(), progress))
+    
+    def _finish_playlist(self, expansion, error):
+        if expansion in self.playlist_expansions:
+            self.playlist_expansions.remove(expansion)
+        self.update_queue_status()
+        
+        if error and not expansion["stop"].is_set():
+            messagebox.showerror("Playlist Error",
+                                 f"Stopped listing after {expansion['added']} videos:\n{error}")
     
     def download_selected(self):
         """Download the selected search result"""
@@ -566,6 +4401,8 @@ class YouTubeMusicDownloader:
         if not selected_item:
             messagebox.showwarning("Warning", "Please select a song to download")
             return
+        if not self.check_quality():
+            return
         
         index = int(selected_item)
         if 0 <= index < len(self.search_results):
@@ -573,19 +4410,27 @@ class YouTubeMusicDownloader:
             url = f"https://www.youtube.com/watch?v={video_id}"
             title = self.search_results[index].get('title', 'Unknown')
             
-            # Confirm download
-            if messagebox.askyesno("Confirm Download", f"Do you want to download:\n{title}?"):
-                # Check download method
-                if self.download_method.get() == "queue":
-                    # Add to queue
-                    self.add_to_queue(url, title)
-                    messagebox.showinfo("Queue", f"Added to download queue:\n{title}")
-                else:
-                    # Switch to download tab and start download
-                    self.notebook.select(self.download_tab)
-                    self.url_entry.delete(0, tk.END)
-                    self.url_entry.insert(0, url)
-                    self.start_download()
+            # start_download does its own duplicate check for direct downloads
+            if self.download_method.get() == "queue":
+                self.confirm_duplicate(url, title,
+                                       lambda skip_duplicates: self._download_result(url, title, skip_duplicates))
+            else:
+                self._download_result(url, title, True)
+    
+    def _download_result(self, url, title, skip_duplicates):
+        """Confirm the download of a search result, then queue or start it"""
+        if messagebox.askyesno("Confirm Download", f"Do you want to download:\n{title}?"):
+            # Check download method
+            if self.download_method.get() == "queue":
+                # Add to queue
+                self.add_to_queue(url, title, skip_duplicates,
+                                  on_done=lambda handle: self._report_queued(handle, title))
+            else:
+                # Switch to download tab and start download
+                self.notebook.select(self.download_tab)
+                self.url_entry.delete(0, tk.END)
+                self.url_entry.insert(0, url)
+                self.start_download()
 
     def play_preview(self):
         """Play a preview of the selected song"""
@@ -595,75 +4440,58 @@ class YouTubeMusicDownloader:
             return
         
         index = int(selected_item)
-        if 0 <= index < len(self.search_results):
+        if 0 <= index < len(self.search_results) and self.audio_available():
             video_id = self.search_results[index].get('id', '')
             title = self.search_results[index].get('title', 'Unknown')
             
             self.search_status_label.config(text=f"Loading preview for: {title}")
             
             # Start preview in a separate thread
-            threading.Thread(target=self._load_preview, args=(video_id, title), daemon=True).start()
+            self.stop_preview()
+            self.preview_stop = threading.Event()
+            volume = self.volume_scale.get() / 100
+            threading.Thread(target=self.engine.profiler.wrap("preview", self._load_preview),
+                             args=(video_id, title, self.preview_stop, volume),
+                             daemon=True).start()
     
-    def _load_preview(self, video_id, title):
-        """Load and play a preview of the song"""
+    def _load_preview(self, video_id, title, stop, volume):
+        """Stream a preview into the mixer, starting with the first decoded chunk"""
         try:
-            # Configure yt-dlp options for preview
-            ydl_opts = {
-                'quiet': True,
-                'no_warnings': True,
-                'format': 'bestaudio/best',
-                'postprocessors': [{
-                    'key': 'FFmpegExtractAudio',
-                    'preferredcodec': 'mp3',
-                    'preferredquality': '128',
-                }],
-                'outtmpl': os.path.join(self.output_dir, 'preview.%(ext)s'),
-                'max_filesize': 3 * 1024 * 1024,  # Limit to 3MB for preview
-                'playlistend': 1,
-            }
-            
-            # Download a short preview
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                ydl.download([f"https://www.youtube.com/watch?v={video_id}"])
+            frequency, _, channels = pygame.mixer.get_init()
+            channel = None
+            for chunk in self.engine.preview_chunks(video_id, frequency, channels, stop=stop):
+                sound = pygame.mixer.Sound(buffer=chunk)
+                if channel is None:
+                    pygame.mixer.music.stop()
+                    channel = pygame.mixer.find_channel(True)
+                    channel.set_volume(volume)
+                    channel.play(sound)
+                    self.preview_channel = channel
+                    self.root.after(0, lambda: self.search_status_label.config(text=f"Playing preview: {title}"))
+                    continue
+                
+                # A channel holds one queued sound; wait until the last one has started
+                while channel.get_queue() is not None and not stop.is_set():
+                    time.sleep(0.05)
+                if stop.is_set():
+                    break
+                channel.queue(sound)
             
-            # Play the preview
-            preview_path = os.path.join(self.output_dir, 'preview.mp3')
-            if os.path.exists(preview_path):
-                self.root.after(0, lambda: self._play_file(preview_path, f"Preview: {title}"))
-                self.root.after(0, lambda: self.search_status_label.config(text=f"Playing preview: {title}"))
-            else:
+            if channel is None and not stop.is_set():
                 self.root.after(0, lambda: self.search_status_label.config(text="Failed to load preview"))
                 
         except Exception as e:
-            self.root.after(0, lambda: self.search_status_label.config(text=f"Error: {str(e)}"))
+            error_msg = str(e)
+            self.root.after(0, lambda: self.search_status_label.config(text=f"Error: {error_msg}"))
     
-    def update_progress_hook(self, d):
-        """Update progress bar based on download progress"""
-        if d['status'] == 'downloading':
-            # Calculate download progress
-            downloaded = d.get('downloaded_bytes', 0)
-            total = d.get('total_bytes', 0) or d.get('total_bytes_estimate', 0)
-            
-            if total > 0:
-                percent = (downloaded / total) * 100
-                self.progress_bar["value"] = percent
-                self.progress_label.config(text=f"Downloading: {percent:.1f}%")
-                
-                # Update speed and ETA if available
-                speed = d.get('speed', 0)
-                if speed:
-                    speed_str = f"{speed/1024/1024:.2f} MB/s"
-                    eta = d.get('eta', 0)
-                    if eta:
-                        self.status_label.config(text=f"Speed: {speed_str} | ETA: {eta} seconds")
-                    else:
-                        self.status_label.config(text=f"Speed: {speed_str}")
-            
-            self.root.update_idletasks()
-        
-        elif d['status'] == 'finished':
-            self.progress_label.config(text="Download complete. Converting...")
-            self.root.update_idletasks()
+    def stop_preview(self):
+        """Stop the preview that is playing or loading"""
+        if self.preview_stop:
+            self.preview_stop.set()
+            self.preview_stop = None
+        if self.preview_channel:
+            self.preview_channel.stop()
+            self.preview_channel = None
     
     def setup_settings_tab(self):
         """Setup the settings tab for authentication options"""
@@ -731,137 +4559,104 @@ class YouTubeMusicDownloader:
                     self.root.after(0, lambda: self.settings_status_label.config(
                         text=f"Error updating yt-dlp: {result.stderr}"))
             except Exception as e:
+                error_msg = str(e)
                 self.root.after(0, lambda: self.settings_status_label.config(
-                    text=f"Error updating yt-dlp: {str(e)}"))
+                    text=f"Error updating yt-dlp: {error_msg}"))
         
         threading.Thread(target=_update, daemon=True).start()
     
-    def download_audio(self, url):
-        """Download audio from YouTube URL"""
-        try:
-            # Get output directory from entry field (in case it was edited manually)
-            self.output_dir = self.dir_entry.get()
-            
-            # Create output directory if it doesn't exist
-            if not os.path.exists(self.output_dir):
-                os.makedirs(self.output_dir)
-            
-            # Configure yt-dlp options
-            audio_format = self.format_var.get()
-            audio_quality = self.quality_var.get()
-            
-            ydl_opts = {
-                'format': 'bestaudio/best',
-                'postprocessors': [{
-                    'key': 'FFmpegExtractAudio',
-                    'preferredcodec': audio_format,
-                    'preferredquality': audio_quality,
-                }],
-                'outtmpl': os.path.join(self.output_dir, '%(title)s.%(ext)s'),
-                'progress_hooks': [self.update_progress_hook],
-                'quiet': True,
-                'no_warnings': True
-            }
-            
-            # Add authentication if selected
-            if self.auth_method.get() == "browser_cookies":
-                browser = self.browser_var.get()
-                ydl_opts['cookiesfrombrowser'] = (browser, None, None, None)
-                self.status_label.config(text=f"Using cookies from {browser}")
-            
-            # Download the audio
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=True)
-                filename = ydl.prepare_filename(info)
-                base_filename = os.path.splitext(filename)[0] + f".{audio_format}"
-            
-            # Show success message
-            self.progress_label.config(text="Download Complete!")
-            self.status_label.config(text=f"Saved to: {base_filename}")
-            messagebox.showinfo("Success", f"Downloaded: {info.get('title')}")
-            
-            # Update song list
-            self.update_song_list()
-            
-        except yt_dlp.utils.DownloadError as e:
-            error_msg = str(e)
-            self.progress_label.config(text="Error!")
-            self.status_label.config(text=str(e))
-            
-            # Check for 403 error
-            if "403" in error_msg or "forbidden" in error_msg.lower():
-                messagebox.showerror("Authentication Error", 
-                                   "403 Forbidden Error: YouTube requires authentication.\n\n"
-                                   "Please go to the Settings tab and enable browser cookies authentication.")
-                # Switch to settings tab
-                self.notebook.select(self.settings_tab)
-            else:
-                messagebox.showerror("Error", str(e))
-        
-        except Exception as e:
-            self.progress_label.config(text="Error!")
-            self.status_label.config(text=str(e))
-            messagebox.showerror("Error", str(e))
-        
-        finally:
-            # Reset UI
-            self.progress_bar["value"] = 0
-            self.download_button.config(state=tk.NORMAL)
+    def show_download_error(self, error_msg, forbidden=False):
+        """Report a failed direct download"""
+        if forbidden:
+            messagebox.showerror("Authentication Error", 
+                               "403 Forbidden Error: YouTube requires authentication.\n\n"
+                               "Please go to the Settings tab and enable browser cookies authentication.")
+            # Switch to settings tab
+            self.notebook.select(self.settings_tab)
+        else:
+            messagebox.showerror("Error", error_msg)
     
-    def start_download(self):
-        """Start the download process in a separate thread"""
-        url = self.url_entry.get().strip()
-        if not url:
-            messagebox.showwarning("Warning", "Please enter a YouTube URL")
+    def update_song_list(self):
+        """Sync the song list with the library index (scans run off the Tk thread)"""
+        if self._library_scan_running:
+            # Fold overlapping requests into one more scan when this one ends
+            self._library_rescan = True
             return
         
-        # Confirm download
+        output_dir = self.dir_entry.get()
+        reload = output_dir != self._library_dir
+        self._library_dir = output_dir
+        self._library_scan_running = True
+        threading.Thread(target=self.engine.profiler.wrap("library", self._scan_library),
+                         args=(output_dir, reload), daemon=True).start()
+    
+    def _scan_library(self, output_dir, reload):
+        """Load the indexed tracks, then push only what changed on disk"""
         try:
-            # Get video info first
-            with yt_dlp.YoutubeDL({'quiet': True}) as ydl:
-                info = ydl.extract_info(url, download=False)
-                title = info.get('title', 'Unknown')
-                duration = self._format_duration(info.get('duration', 0))
-                
-                if not messagebox.askyesno("Confirm Download", 
-                                          f"Do you want to download:\n{title}\nDuration: {duration}?"):
-                    return
+            if reload:
+                tracks = self.engine.library.tracks(output_dir)
+                self.root.after(0, lambda: self._reload_song_tree(tracks))
+            changes = self.engine.scan_library(output_dir)
+            self.root.after(0, lambda: self._apply_library_changes(changes))
         except Exception as e:
-            # If we can't get info, just confirm with the URL
-            if not messagebox.askyesno("Confirm Download", f"Do you want to download this URL?\n{url}"):
-                return
-        
-        # Disable download button during download
-        self.download_button.config(state=tk.DISABLED)
-        self.progress_label.config(text="Preparing download...")
-        self.status_label.config(text="")
-        
-        # Start download in a separate thread to keep UI responsive
-        threading.Thread(target=self.download_audio, args=(url,), daemon=True).start()
+            error_msg = str(e)
+            self.root.after(0, lambda: messagebox.showerror("Error", f"Error updating song list: {error_msg}"))
+        finally:
+            self.root.after(0, self._library_scan_done)
     
-    def update_song_list(self):
-        """Update the list of downloaded songs"""
-        # Clear the treeview
-        for item in self.song_tree.get_children():
-            self.song_tree.delete(item)
-        
-        self.downloaded_songs = []
-        
+    def _library_scan_done(self):
+        self._library_scan_running = False
+        if self._library_rescan:
+            self._library_rescan = False
+            self.update_song_list()
+        elif not self._library_probe_running:
+            # Read tags of files that don't have them yet, one batch at a time
+            self._library_probe_running = True
+            threading.Thread(target=self.engine.profiler.wrap("library", self._probe_library),
+                             args=(self._library_dir,), daemon=True).start()
+    
+    def _probe_library(self, output_dir):
         try:
-            # Get output directory from entry field
-            output_dir = self.dir_entry.get()
-            
-            if os.path.exists(output_dir):
-                # Find all audio files
-                audio_extensions = (".mp3", ".m4a")
-                for file in os.listdir(output_dir):
-                    if file.lower().endswith(audio_extensions) and file != "preview.mp3":
-                        file_path = os.path.join(output_dir, file)
-                        self.downloaded_songs.append(file_path)
-                        title = os.path.splitext(file)[0]
-                        self.song_tree.insert("", tk.END, values=(title, file_path))
+            for tracks in self.engine.library.fill_tags(output_dir):
+                if output_dir != self._library_dir:
+                    break
+                self.root.after(0, lambda tracks=tracks: self._apply_library_changes({"changed": tracks}))
         except Exception as e:
-            messagebox.showerror("Error", f"Error updating song list: {str(e)}")
+            logger.warning("Error reading tags: %s", e)
+        finally:
+            self._library_probe_running = False
+    
+    @staticmethod
+    def _song_values(track):
+        duration = track["duration"]
+        return (
+            track["title"],
+            track["path"],
+            f"{int(duration // 60)}:{int(duration % 60):02d}" if duration else "",
+            f"{track['bitrate']} kbps" if track["bitrate"] else "",
+            track["codec"] or ""
+        )
+    
+    def _reload_song_tree(self, tracks):
+        """Replace the song list with the tracks indexed for a newly chosen folder"""
+        self.song_tree.delete_all()
+        for track in tracks:
+            self.song_tree.insert("", tk.END, iid=track["path"], values=self._song_values(track))
+        self.downloaded_songs = [track["path"] for track in tracks]
+    
+    def _apply_library_changes(self, changes):
+        """Push added, changed and removed tracks to the song list"""
+        self.song_tree.delete(*[path for path in changes.get("removed", ()) if self.song_tree.exists(path)])
+        
+        for track in changes.get("added", []) + changes.get("changed", []):
+            values = self._song_values(track)
+            if self.song_tree.exists(track["path"]):
+                self.song_tree.item(track["path"], values=values)
+            else:
+                self.song_tree.insert("", tk.END, iid=track["path"], values=values)
+        
+        if changes.get("added") or changes.get("removed"):
+            self.downloaded_songs = list(self.song_tree.get_children())
     
     # These methods have been replaced by the new implementations above
     
@@ -907,74 +4702,125 @@ class YouTubeMusicDownloader:
             return
         
         # Clear previous results
-        for item in self.results_tree.get_children():
-            self.results_tree.delete(item)
+        self.results_tree.delete_all()
         
         self.search_results = []
+        self.search_generation += 1
+        self.thumbnail_rows.clear()
+        self.load_more_button.config(state=tk.DISABLED)
         self.search_status_label.config(text="Searching...")
         
+        # Repeated queries reuse the results (and pages) already fetched
+        self.current_search = self.engine.search(query)
+        self.search_results = self.current_search.results
+        
         # Start search in a separate thread to keep UI responsive
-        threading.Thread(target=self._perform_search, args=(query,), daemon=True).start()
+        threading.Thread(target=self.engine.profiler.wrap("search", self._perform_search),
+                         args=(self.current_search, self.search_generation, 0), daemon=True).start()
+    
+    def load_more_results(self):
+        """Fetch the next page of results for the current search"""
+        if self.current_search is None or self.current_search.exhausted:
+            return
+        
+        self.load_more_button.config(state=tk.DISABLED)
+        self.search_status_label.config(text="Loading more results...")
+        threading.Thread(target=self.engine.profiler.wrap("search", self._perform_search),
+                         args=(self.current_search, self.search_generation, len(self.current_search.results)),
+                         daemon=True).start()
     
-    def _perform_search(self, query):
-        """Perform the actual search using yt-dlp"""
+    def _perform_search(self, search, generation, start):
+        """Show cached results and stream further ones from yt-dlp as they arrive"""
+        query = search.query
         try:
-            # Configure yt-dlp options for search
-            ydl_opts = {
-                'quiet': True,
-                'no_warnings': True,
-                'extract_flat': True,
-                'skip_download': True,
-                'format': 'bestaudio/best',
-            }
+            # Results already fetched for this query appear on the next UI tick; new ones
+            # are added to the treeview in batches as yt-dlp yields them
+            count = SEARCH_PAGE_SIZE if start else max(SEARCH_PAGE_SIZE, len(search.results))
+            search.fetch(start, count, on_result=lambda i, result: self.progress_bus.append(
+                SEARCH_JOB, "results", (generation, i, result)))
             
-            # Add authentication if selected
-            if self.auth_method.get() == "browser_cookies":
-                browser = self.browser_var.get()
-                ydl_opts['cookiesfrombrowser'] = (browser, None, None, None)
-            
-            # Search YouTube
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                # Use ytsearch to find videos
-                search_results = ydl.extract_info(f"ytsearch10:{query}", download=False)
-                
-                if search_results and 'entries' in search_results:
-                    # Process results
-                    for i, entry in enumerate(search_results['entries']):
-                        if entry:
-                            # Store result data
-                            self.search_results.append({
-                                'id': entry.get('id', ''),
-                                'title': entry.get('title', 'Unknown'),
-                                'duration': entry.get('duration', 0),
-                                'channel': entry.get('channel', 'Unknown'),
-                                'url': entry.get('url', '')
-                            })
-                            
-                            # Format duration
-                            duration_str = self._format_duration(entry.get('duration', 0))
-                            
-                            # Add to treeview
-                            self.root.after(0, lambda i=i, entry=entry, duration_str=duration_str: 
-                                self.results_tree.insert("", tk.END, iid=str(i), values=(
-                                    entry.get('title', 'Unknown'),
-                                    duration_str,
-                                    entry.get('channel', 'Unknown')
-                                ))
-                            )
-                    
-                    # Update status
-                    self.root.after(0, lambda: self.search_status_label.config(
-                        text=f"Found {len(self.search_results)} results for: {query}"))
-                else:
-                    # No results
-                    self.root.after(0, lambda: self.search_status_label.config(
-                        text=f"No results found for: {query}"))
+            if search.results:
+                # Update status
+                self.progress_bus.publish(SEARCH_JOB, finished=(
+                    generation, f"Found {len(search.results)} results for: {query}", not search.exhausted))
+            else:
+                # No results
+                self.progress_bus.publish(SEARCH_JOB, finished=(
+                    generation, f"No results found for: {query}", False))
             
         except Exception as e:
             # Handle errors
-            self.root.after(0, lambda: self.search_status_label.config(
-                text=f"Error: {str(e)}"))
+            self.progress_bus.publish(SEARCH_JOB, finished=(generation, f"Error: {e}", not search.exhausted))
+    
+    def _add_search_result(self, generation, index, result):
+        """Insert one search result row unless a newer search replaced the list"""
+        if generation != self.search_generation or self.results_tree.exists(str(index)):
+            return
+        
+        # Format duration
+        duration_str = self._format_duration(result.get('duration', 0))
+        video_id = result.get('id', '')
+        image = self.thumbnail_images.get(video_id) if video_id else None
+        self.results_tree.insert("", tk.END, iid=str(index), image=image or "", values=(
+            result.get('title', 'Unknown'),
+            duration_str,
+            result.get('channel', 'Unknown')
+        ))
+        if video_id:
+            self.thumbnail_rows[video_id].add(str(index))
+    
+    def _request_thumbnails(self, iids):
+        """Load the thumbnails of the visible result rows that don't have one yet"""
+        if not self._storage_open:
+            # Opening the thumbnail cache here would block the Tk thread
+            self._waiting_thumbnails = iids
+            return
+        # Newest requests are served first, so queue the top row last
+        for iid in reversed(iids):
+            index = int(iid)
+            if index >= len(self.search_results) or self.results_tree.item(iid, "image"):
+                continue
+            result = self.search_results[index]
+            video_id = result.get('id', '')
+            if not video_id:
+                continue
+            image = self.thumbnail_images.get(video_id)
+            if image is not None:
+                self.results_tree.item(iid, image=image)
+                continue
+            self.engine.thumbnails.request(video_id, ThumbnailLoader.thumbnail_url(result),
+                                           lambda video_id, data: self.progress_bus.append(
+                                               THUMBNAILS_JOB, "loaded", (video_id, data)))
+    
+    def _thumbnail_ready(self, video_id, data):
+        """Show a loaded thumbnail on the result rows of its video"""
+        if data is None:
+            return
+        image = self.thumbnail_images.get(video_id)
+        if image is None:
+            try:
+                # Tk decodes the PNG here, on its own thread; at 80x45 that is cheap
+                image = tk.PhotoImage(data=data)
+            except tk.TclError as e:
+                logger.info("Bad thumbnail for %s: %s", video_id, e)
+                return
+            self.thumbnail_images.put(video_id, image)
+        for iid in self.thumbnail_rows.get(video_id, ()):
+            if self.results_tree.exists(iid):
+                self.results_tree.item(iid, image=image)
+    
+    def _thumbnail_evicted(self, video_id):
+        """Drop an evicted thumbnail from its rows; it reloads from disk if they scroll back"""
+        for iid in self.thumbnail_rows.get(video_id, ()):
+            if self.results_tree.exists(iid):
+                self.results_tree.item(iid, image="")
+    
+    def _finish_search(self, generation, status, can_load_more):
+        """Update the search status once a page has been fetched"""
+        if generation != self.search_generation:
+            return
+        self.search_status_label.config(text=status)
+        self.load_more_button.config(state=tk.NORMAL if can_load_more else tk.DISABLED)
 
     def select_search_result(self, event):
         """Handle double-click on search result"""
@@ -1016,12 +4862,19 @@ class YouTubeMusicDownloader:
         list_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
         
         # Create treeview for song list
-        self.song_tree = ttk.Treeview(list_frame, columns=("title", "path"), show="headings")
+        self.song_tree = VirtualTreeview(list_frame, columns=("title", "path", "duration", "bitrate", "codec"),
+                                         show="headings")
         self.song_tree.heading("title", text="Title")
         self.song_tree.heading("path", text="Path")
+        self.song_tree.heading("duration", text="Length")
+        self.song_tree.heading("bitrate", text="Bitrate")
+        self.song_tree.heading("codec", text="Codec")
         
         self.song_tree.column("title", width=300)
         self.song_tree.column("path", width=400)
+        self.song_tree.column("duration", width=60)
+        self.song_tree.column("bitrate", width=80)
+        self.song_tree.column("codec", width=60)
         
         scrollbar = ttk.Scrollbar(list_frame, orient=tk.VERTICAL, command=self.song_tree.yview)
         self.song_tree.configure(yscrollcommand=scrollbar.set)
@@ -1090,6 +4943,7 @@ class YouTubeMusicDownloader:
     
     def stop_music(self):
         """Stop the currently playing music"""
+        self.stop_preview()
         if self.currently_playing:
             pygame.mixer.music.stop()
             self.currently_playing = None
@@ -1098,12 +4952,20 @@ class YouTubeMusicDownloader:
     
     def set_volume(self, value):
         """Set the volume of the music player"""
+        if not self.mixer_ready.is_set() or self.mixer_error:
+            # Applied by _warm_up once the mixer is ready
+            return
         volume = float(value) / 100
         pygame.mixer.music.set_volume(volume)
+        if self.preview_channel:
+            self.preview_channel.set_volume(volume)
     
-    def _play_file(self, file_path):
+    def _play_file(self, file_path, title=None):
         """Play an audio file"""
+        if not self.audio_available():
+            return
         try:
+            self.stop_preview()
             pygame.mixer.music.stop()
             pygame.mixer.music.load(file_path)
             pygame.mixer.music.play()
@@ -1111,8 +4973,7 @@ class YouTubeMusicDownloader:
             self.paused = False
             
             # Update now playing label
-            filename = os.path.basename(file_path)
-            self.now_playing_label.config(text=f"Now playing: {filename}")
+            self.now_playing_label.config(text=f"Now playing: {title or os.path.basename(file_path)}")
         except Exception as e:
             messagebox.showerror("Playback Error", f"Could not play file: {str(e)}")
     
@@ -1135,11 +4996,14 @@ class YouTubeMusicDownloader:
         self.search_entry.delete(0, tk.END)
         
         # Clear the search results treeview
-        for item in self.results_tree.get_children():
-            self.results_tree.delete(item)
+        self.results_tree.delete_all()
             
         # Clear the search results list
         self.search_results = []
+        self.current_search = None
+        self.search_generation += 1
+        self.thumbnail_rows.clear()
+        self.load_more_button.config(state=tk.DISABLED)
         
         # Update status label
         self.search_status_label.config(text="Search cleared")
@@ -1150,6 +5014,8 @@ class YouTubeMusicDownloader:
         if not selected_item:
             messagebox.showwarning("Warning", "Please select a song to add to queue")
             return
+        if not self.check_quality():
+            return
         
         index = int(selected_item)
         if 0 <= index < len(self.search_results):
@@ -1157,12 +5023,17 @@ class YouTubeMusicDownloader:
             url = f"https://www.youtube.com/watch?v={video_id}"
             title = self.search_results[index].get('title', 'Unknown')
             
-            # Add to queue
-            self.add_to_queue(url, title)
-            
-            # Show confirmation and switch to queue tab
-            self.search_status_label.config(text=f"Added to queue: {title}")
-            self.notebook.select(self.queue_tab)
+            # Ask about duplicates first, as download_selected does
+            self.confirm_duplicate(url, title, lambda skip_duplicates: self.add_to_queue(
+                url, title, skip_duplicates, on_done=lambda handle: self._added_from_search(handle, title)))
+    
+    def _added_from_search(self, handle, title):
+        """Report a search result added to the queue; a skipped duplicate keeps the Search tab open"""
+        if handle.state == "skipped":
+            self.search_status_label.config(text=f"Already {handle.skip_reason}: {title}")
+            return
+        self.search_status_label.config(text=f"Added to queue: {title}")
+        self.notebook.select(self.queue_tab)
             
     def setup_info_tab(self):
         """Setup the info tab with author details and GitHub link"""
@@ -1221,7 +5092,297 @@ License: MIT
         github_url = "https://github.com/Hasintha-Nirmal/youtube-music-downloader"
         webbrowser.open(github_url)
 
-if __name__ == "__main__":
+def current_rss_bytes():
+    """Return the resident memory of this process in bytes (0 if unknown)"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+    try:
+        import resource
+        # Peak rather than current RSS, but the best portable figure available
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+    except (ImportError, OSError):
+        return 0
+
+
+class BatchRunner:
+    """Runs URLs and search queries through a DownloadEngine and reports JSON lines"""
+    
+    def __init__(self, engine, audio_format, quality, output_dir, out=None,
+                 max_in_flight=4, max_memory=0, progress_interval=1.0, skip_duplicates=True):
+        self.engine = engine
+        self.skip_duplicates = skip_duplicates
+        self.audio_format = audio_format
+        self.quality = quality
+        self.output_dir = output_dir
+        self.out = out or sys.stdout
+        self.max_in_flight = max(1, max_in_flight)
+        self.max_memory = max_memory
+        self.progress_interval = progress_interval
+        self.jobs = []
+        self.playlist_errors = 0
+        self._last_progress = {}
+        self._in_flight = 0
+        self._cond = threading.Condition()
+        self._write_lock = threading.RLock()
+        engine.concurrency.subscribe(
+            lambda level, reason: self.emit({"event": "concurrency", "level": level, "reason": reason}))
+    
+    def emit(self, record, job=None):
+        with self._write_lock:
+            if job is not None and job["handle"] is None:
+                # Raised from inside engine.submit(); held until the "queued" line is out
+                job["early"].append(record)
+            else:
+                self._write(record)
+    
+    def _write(self, record):
+        self.out.write(json.dumps(record, default=str) + "\n")
+        self.out.flush()
+    
+    @staticmethod
+    def to_url(line):
+        """Treat anything that isn't a URL as a search for its best match"""
+        if re.match(r"^[a-z][a-z0-9+.-]*://", line, re.IGNORECASE) or line.startswith("ytsearch"):
+            return line
+        return f"ytsearch1:{line}"
+    
+    def run(self, inputs):
+        """Download every input and return the process exit code"""
+        started = time.time()
+        
+        for line in inputs:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            
+            if is_playlist_url(line):
+                # Entries are listed lazily, so only the in-flight budget is held at once
+                try:
+                    for url, title in self.engine.expand_playlist(line):
+                        self._wait_for_budget()
+                        self._submit(url, title=title, playlist=line)
+                except Exception as e:
+                    self.emit({"event": "failed", "input": line, "error": f"Could not list playlist: {e}"})
+                    self.playlist_errors += 1
+                continue
+            
+            self._wait_for_budget()
+            self._submit(line)
+        
+        for job in self.jobs:
+            job["handle"].wait()
+        
+        return self._summarize(time.time() - started)
+    
+    def _wait_for_budget(self):
+        with self._cond:
+            while self._in_flight >= self.max_in_flight:
+                self._cond.wait()
+            
+            # Hold new work back while over the memory budget (but never stall completely)
+            while self.max_memory and self._in_flight and current_rss_bytes() > self.max_memory:
+                self._cond.wait(timeout=1.0)
+    
+    def _submit(self, line, title=None, playlist=None):
+        with self._cond:
+            self._in_flight += 1
+        
+        job = {"input": line, "handle": None, "submitted": time.time(), "started": None, "finished": None,
+               "early": []}
+        self.jobs.append(job)
+        # Hold the output until the "queued" line is written so it precedes the job's own events
+        with self._write_lock:
+            job["handle"] = self.engine.submit(
+                self.to_url(line), self.audio_format, self.quality, self.output_dir, title=title or line,
+                on_event=lambda handle, event: self._on_event(job, handle, event),
+                skip_duplicates=self.skip_duplicates)
+            record = {"event": "queued", "id": job["handle"].id, "input": line}
+            if playlist:
+                record["playlist"] = playlist
+            self._write(record)
+            for record in job.pop("early"):
+                self._write(record)
+    
+    def _on_event(self, job, handle, event):
+        now = time.time()
+        
+        if event["type"] == "progress":
+            # Rate-limit progress lines per job
+            if now - self._last_progress.get(handle.id, 0) < self.progress_interval:
+                return
+            self._last_progress[handle.id] = now
+            self.emit({"event": "progress", "id": handle.id, "percent": round(event["percent"], 1),
+                       "speed": event.get("speed"), "eta": event.get("eta")}, job)
+            return
+        
+        state = event["state"]
+        if state == "downloading":
+            job["started"] = now
+        record = {"event": state, "id": handle.id}
+        if state == "completed":
+            record.update(title=handle.title, filename=handle.filename)
+        elif state in ("failed", "retrying"):
+            record.update(error=handle.error, error_class=handle.error_class)
+            if state == "retrying":
+                record.update(attempt=event["attempt"], delay=round(event["delay"], 1))
+        elif state == "skipped":
+            record["reason"] = handle.skip_reason
+        self.emit(record, job)
+        
+        if state in DownloadHandle.FINISHED_STATES:
+            job["finished"] = now
+            self._last_progress.pop(handle.id, None)
+            with self._cond:
+                self._in_flight -= 1
+                self._cond.notify_all()
+    
+    def _summarize(self, elapsed):
+        items = []
+        for job in self.jobs:
+            handle = job["handle"]
+            started = job["started"] or job["submitted"]
+            items.append({
+                "id": handle.id,
+                "input": job["input"],
+                "state": handle.state,
+                "title": handle.title,
+                "filename": handle.filename,
+                "conversion": handle.conversion,
+                "error": handle.error,
+                "error_class": handle.error_class,
+                "retries": sum(handle.attempts.values()),
+                "timings": handle.timings.snapshot(),
+                "wait_seconds": round(started - job["submitted"], 3),
+                "seconds": round((job["finished"] or time.time()) - started, 3),
+                "exit_code": 0 if handle.state in ("completed", "skipped") else 1
+            })
+        
+        failed = sum(1 for item in items if item["exit_code"]) + self.playlist_errors
+        self.emit({
+            "event": "summary",
+            "total": len(items) + self.playlist_errors,
+            "completed": sum(1 for item in items if item["state"] == "completed"),
+            "skipped": sum(1 for item in items if item["state"] == "skipped"),
+            "failed": failed,
+            "elapsed_seconds": round(elapsed, 3),
+            "rss_bytes": current_rss_bytes(),
+            "stages": self.engine.stage_stats(),
+            "concurrency": self.engine.concurrency.snapshot(),
+            "items": items
+        })
+        return 1 if failed else 0
+
+
+def read_inputs(args):
+    """Yield input lines from the command line, then from --input (a file or - for stdin)"""
+    for item in args.items:
+        yield item
+    
+    if args.input == "-":
+        yield from sys.stdin
+    elif args.input:
+        with open(args.input, "r", encoding="utf-8") as f:
+            yield from f
+
+
+def run_batch(args):
+    """Run the headless batch downloader and return its exit code"""
+    engine = DownloadEngine(max_concurrent=args.workers, use_journal=False, persist_info=False,
+                            info_cache_size=max(16, args.workers * 4), verify_files=args.verify_files,
+                            connections=args.connections, rate_limit=args.max_rate * 1024,
+                            adaptive=args.adaptive, preview_cache_size=0,
+                            profiler=JobProfiler(args.profile_dir, args.profile_sample) if args.profile_dir else None)
+    engine.cookie_browser = args.cookies_from_browser
+    
+    runner = BatchRunner(
+        engine, args.format, args.quality, args.output,
+        max_in_flight=args.max_in_flight or args.workers * 2,
+        max_memory=args.max_memory * 1024 * 1024,
+        progress_interval=args.progress_interval,
+        skip_duplicates=not args.force
+    )
+    try:
+        if args.metrics_port is not None:
+            port = engine.serve_metrics(args.metrics_port)
+            runner.emit({"event": "metrics", "url": f"http://127.0.0.1:{port}/metrics"})
+        return runner.run(read_inputs(args))
+    finally:
+        if args.metrics_json:
+            with open(args.metrics_json, "w", encoding="utf-8") as f:
+                json.dump(engine.metrics_json(), f, indent=2)
+        engine.close()
+
+
+def run_gui():
+    """Start the desktop application"""
     root = tk.Tk()
     app = YouTubeMusicDownloader(root)
-    root.mainloop()
\ No newline at end of file
+    root.mainloop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="YouTube Music Downloader. Without arguments the desktop app starts; "
+                    "with URLs, search queries or --input it downloads them headlessly "
+                    "and reports progress as JSON lines on stdout.")
+    parser.add_argument("items", nargs="*", help="URLs or search queries to download")
+    parser.add_argument("-i", "--input", help="file with one URL or search query per line (- for stdin)")
+    parser.add_argument("-o", "--output", default=os.path.join(os.path.expanduser("~"), "Downloads"),
+                        help="output directory (default: ~/Downloads)")
+    parser.add_argument("-f", "--format", choices=("mp3", "m4a"), default="mp3", help="audio format")
+    parser.add_argument("-q", "--quality", choices=("128", "192", "256", "320"), default="192",
+                        help="audio quality in kbps")
+    parser.add_argument("-w", "--workers", type=int, default=2,
+                        help="parallel downloads (the upper limit with --adaptive)")
+    parser.add_argument("--adaptive", action="store_true",
+                        help="tune the number of parallel downloads from throughput and errors")
+    parser.add_argument("--connections", type=int, default=4,
+                        help="fragments fetched in parallel per DASH/HLS download")
+    parser.add_argument("--max-rate", type=int, default=0,
+                        help="bandwidth cap in KB/s shared by all downloads (default: unlimited)")
+    parser.add_argument("--max-in-flight", type=int, default=0,
+                        help="most unfinished jobs held at once (default: twice the workers)")
+    parser.add_argument("--max-memory", type=int, default=0,
+                        help="stop submitting new jobs while RSS exceeds this many MB")
+    parser.add_argument("--progress-interval", type=float, default=1.0,
+                        help="seconds between progress lines per job")
+    parser.add_argument("--force", action="store_true",
+                        help="download videos again even if they are in the download archive")
+    parser.add_argument("--verify-files", action="store_true",
+                        help="only treat archived videos as downloaded if their file's content hash still matches")
+    parser.add_argument("--cookies-from-browser", metavar="BROWSER",
+                        help="authenticate with cookies from this browser")
+    parser.add_argument("--metrics-port", type=int, metavar="PORT",
+                        help="serve Prometheus metrics on http://127.0.0.1:PORT/metrics (0 picks a port)")
+    parser.add_argument("--metrics-json", metavar="FILE",
+                        help="write the metrics and per-job timings to FILE as JSON when the run ends")
+    parser.add_argument("--profile-dir", metavar="DIR",
+                        help="write cProfile and tracemalloc captures of sampled jobs to DIR "
+                             "(default: $YTMD_PROFILE_DIR, off if unset)")
+    parser.add_argument("--profile-sample", type=int, default=1, metavar="N",
+                        help="profile one job in N of each kind (with --profile-dir)")
+    args = parser.parse_args(argv)
+    # Warnings and worker errors go to stderr; in batch mode stdout carries only JSON lines
+    logging.basicConfig(format="%(levelname)s %(name)s: %(message)s")
+    
+    if not args.items and not args.input:
+        run_gui()
+        return 0
+    
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    if args.connections < 1:
+        parser.error("--connections must be at least 1")
+    if args.max_rate < 0:
+        parser.error("--max-rate cannot be negative")
+    if args.profile_sample < 1:
+        parser.error("--profile-sample must be at least 1")
+    return run_batch(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
\ No newline at end of file